@@ -0,0 +1,78 @@
+import asyncio
+import types
+
+import discord
+import pytest
+from discord.ext import commands
+
+SESSIONS = 1000
+# Reactions per round, divide the round time by this for the cost of one reaction
+EVENTS = 10000
+BOT_USER_ID = 1
+
+
+def reaction(message_id:int, user_id:int):
+    return types.SimpleNamespace(message_id=message_id, user_id=user_id, member=None,
+                                 emoji=types.SimpleNamespace(name='✅'), event_type='REACTION_ADD')
+
+
+@pytest.fixture
+def dispatching_bot(bot):
+    # A roll call or picker open on every one of the messages
+    bot._connection.user = discord.Object(id=BOT_USER_ID)
+    for message_id in range(SESSIONS):
+        bot.reactions.register(message_id)
+    return bot
+
+
+def fire(loop, bot, payloads):
+    async def dispatch():
+        for payload in payloads:
+            await bot.on_raw_reaction_add(payload)
+    loop.run_until_complete(dispatch())
+
+
+def drain(bot):
+    for reactions in bot.reactions.sessions.values():
+        while not reactions.empty():
+            reactions.get_nowait()
+
+
+def bench_dispatch_owned(benchmark, loop, dispatching_bot):
+    # Players answering roll calls and captains picking, spread over every open session
+    payloads = [reaction(i % SESSIONS, 1000 + i) for i in range(EVENTS)]
+    benchmark.pedantic(fire, args=(loop, dispatching_bot, payloads), setup=lambda: drain(dispatching_bot), rounds=50)
+
+
+def bench_dispatch_unowned(benchmark, loop, dispatching_bot):
+    # Reactions on every other message the bot can see, dropped after one lookup
+    payloads = [reaction(SESSIONS + i, 1000 + i) for i in range(EVENTS)]
+    benchmark(fire, loop, dispatching_bot, payloads)
+
+
+@pytest.fixture
+def waiting_bot(loop):
+    # How sessions waited before the dispatcher: one bot.wait_for check per open message, run on every reaction
+    bot = commands.Bot("!")
+
+    def waiter(message_id:int):
+        def check(payload):
+            return payload.user_id != BOT_USER_ID and payload.message_id == message_id
+        return bot.wait_for('raw_reaction_add', check=check)
+    waiters = [loop.create_task(waiter(m)) for m in range(SESSIONS)]
+    loop.run_until_complete(asyncio.sleep(0))
+    yield bot
+    for task in waiters:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*waiters, return_exceptions=True))
+
+
+def bench_dispatch_unowned_wait_for(benchmark, waiting_bot):
+    # The same unowned reactions through the old path. A reaction that satisfied a check would end that wait,
+    # so only the ones every check turns down are comparable round after round
+    payloads = [reaction(SESSIONS + i, 1000 + i) for i in range(EVENTS)]
+
+    def dispatch():
+        for payload in payloads:
+            waiting_bot.dispatch('raw_reaction_add', payload)
+    benchmark(dispatch)
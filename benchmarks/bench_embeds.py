@@ -0,0 +1,22 @@
+import pytest
+
+from benchmarks.helpers import TEAM_SIZES, make_players
+from src.embeds import EmbeddedPicker, EmbeddedRollCall
+
+
+@pytest.mark.parametrize('team_size', TEAM_SIZES)
+def bench_unplaced_players(benchmark, team_size):
+    picker = EmbeddedPicker(make_players(team_size * 2))
+    benchmark(lambda: picker.unplaced_players)
+
+
+@pytest.mark.parametrize('team_size', TEAM_SIZES)
+def bench_picker_page(benchmark, team_size):
+    picker = EmbeddedPicker(make_players(team_size * 2))
+    benchmark(picker._get_page, picker.current_captain.display_name)
+
+
+@pytest.mark.parametrize('team_size', TEAM_SIZES)
+def bench_rollcall_page(benchmark, team_size):
+    rollcall = EmbeddedRollCall(make_players(team_size * 2))
+    benchmark(rollcall._get_rollcall_page)
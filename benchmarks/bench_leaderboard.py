@@ -0,0 +1,58 @@
+import random
+
+import pytest
+
+from benchmarks.helpers import GUILD_ID, make_players
+from src.leaderboard import LEADERBOARD_METRICS, build_leaderboard_off_loop
+
+BOARD_SIZES = [10000, 1000000]
+
+
+@pytest.fixture(scope='module', params=BOARD_SIZES, ids=lambda n: 'players{n}'.format(n=n))
+def board_players(request):
+    return make_players(request.param)
+
+
+@pytest.fixture(scope='module')
+def board(board_players):
+    return build_leaderboard_off_loop(board_players)
+
+
+def bench_build_leaderboard(benchmark, board_players):
+    benchmark.pedantic(build_leaderboard_off_loop, args=(board_players,), rounds=3)
+
+
+def bench_get_leaderboard(benchmark, seeded_bot):
+    # What the first !leaderboard in a guild waits for when nothing is cached: the guild load and the build
+    bot = seeded_bot
+
+    def evict():
+        bot.leaderboards.clear()
+        guild_players = bot.players.pop(GUILD_ID, {})
+        bot._cached_player_count -= len(guild_players)
+
+    benchmark.pedantic(lambda: bot.loop.run_until_complete(bot.get_leaderboard(GUILD_ID, None)), setup=evict, rounds=3)
+
+
+@pytest.mark.parametrize('metric', sorted(LEADERBOARD_METRICS))
+def bench_leaderboard_page(benchmark, board, metric):
+    # A page from the middle of the standings, the embed's next button
+    benchmark(board.get_top, metric, len(board) // 2, 10)
+
+
+def bench_leaderboard_rank(benchmark, board, board_players):
+    ids = [p.discord_id for p in random.Random(0).sample(board_players, 1000)]
+    benchmark(lambda: [board.get_rank('rating', d) for d in ids])
+
+
+def bench_leaderboard_update(benchmark, board, board_players):
+    # A finished match moves ten players on every metric
+    players = random.Random(0).sample(board_players, 10)
+
+    def record_match():
+        for i, p in enumerate(players):
+            p.log_win() if i % 2 else p.log_loss()
+            p.rating += 1.0 if i % 2 else -1.0
+            board.update(p)
+
+    benchmark(record_match)
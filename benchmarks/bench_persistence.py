@@ -0,0 +1,42 @@
+import pytest
+
+from benchmarks.helpers import GUILD_ID, make_players, write_json_players
+
+# QueueBot.load_saved_players is gone since players moved to sqlite, a guild is now loaded on first use
+
+
+def bench_load_guild(benchmark, seeded_bot):
+    bot = seeded_bot
+
+    def evict():
+        guild_players = bot.players.pop(GUILD_ID, {})
+        bot._cached_player_count -= len(guild_players)
+
+    benchmark.pedantic(lambda: bot.loop.run_until_complete(bot.get_guild_players(GUILD_ID)),
+                       setup=evict, rounds=3)
+
+
+@pytest.mark.parametrize('dirty', [10, 1000])
+def bench_flush_players(benchmark, seeded_bot, store_size, dirty):
+    # Compared against bench_save_json in the same group: sqlite writes the changed rows, JSON wrote everyone
+    benchmark.group = 'save {n} players'.format(n=store_size)
+    bot = seeded_bot
+    players = list(bot.loop.run_until_complete(bot.get_guild_players(GUILD_ID)).values())[:dirty]
+
+    def mark_dirty():
+        for p in players:
+            p.total_wins += 1
+            bot.mark_player_dirty(p.key, p)
+
+    benchmark.pedantic(lambda: bot.loop.run_until_complete(bot.flush_players()), setup=mark_dirty, rounds=20)
+
+
+def bench_save_json(benchmark, store_size, tmp_path):
+    benchmark.group = 'save {n} players'.format(n=store_size)
+    records = {str(p.discord_id): p.to_record() for p in make_players(store_size)}
+    benchmark.pedantic(write_json_players, args=(str(tmp_path / 'players.json'), records), rounds=3)
+
+
+def bench_save_players(benchmark, bot):
+    # Called after every match, must stay a flag set however large the store is
+    benchmark(bot.save_players)
@@ -0,0 +1,45 @@
+import sys
+import tracemalloc
+
+import pytest
+
+from src.player import Player
+
+PLAYER_COUNT = 1000000
+
+
+class DictPlayer:
+    # Player as it was before __slots__: the same constructor, with every field in a per-instance __dict__
+    __init__ = Player.__init__
+
+
+def make_records(count:int) -> list:
+    return [dict(discord_name='player{i}'.format(i=i), display_name='Player {i}'.format(i=i), discord_id=100000 + i,
+                 guild_id=1, game=None, total_wins=i % 17, total_losses=i % 13, rating=900.0 + i % 200)
+            for i in range(count)]
+
+
+def bytes_per_player(cls, records:list) -> float:
+    # Names, ids and ratings already exist in the records, so only the objects themselves are counted
+    tracemalloc.start()
+    try:
+        players = [cls(**r) for r in records]
+        allocated = tracemalloc.get_traced_memory()[0] - sys.getsizeof(players)
+    finally:
+        tracemalloc.stop()
+    return allocated / len(players)
+
+
+@pytest.fixture(scope='module')
+def records():
+    return make_records(PLAYER_COUNT)
+
+
+@pytest.mark.parametrize('cls', [Player, DictPlayer], ids=['slots', 'dict'])
+def bench_build_players(benchmark, records, cls):
+    # The footprint is saved with the run alongside the timings
+    size = bytes_per_player(cls, records)
+    benchmark.extra_info['bytes_per_player'] = round(size, 1)
+    if cls is Player:
+        assert size < bytes_per_player(DictPlayer, records)
+    benchmark.pedantic(lambda: [cls(**r) for r in records], rounds=3)
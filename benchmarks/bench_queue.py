@@ -0,0 +1,37 @@
+import pytest
+
+from benchmarks.helpers import TEAM_SIZES, make_players
+from src.match_queue_session import MatchQueue
+
+
+def new_queue(team_size:int) -> MatchQueue:
+    return MatchQueue(guild_id=1, channel_id=1, team_size=team_size)
+
+
+@pytest.mark.parametrize('team_size', TEAM_SIZES)
+def bench_add_player(benchmark, team_size):
+    players = make_players(team_size * 2)
+
+    def fill(queue):
+        for p in players:
+            queue.add_player(p)
+
+    benchmark.pedantic(fill, setup=lambda: ((new_queue(team_size),), {}), rounds=2000)
+
+
+@pytest.mark.parametrize('team_size', TEAM_SIZES)
+def bench_remove_player(benchmark, team_size):
+    players = make_players(team_size * 2)
+
+    def full_queue():
+        queue = new_queue(team_size)
+        for p in players:
+            queue.add_player(p)
+        return (queue,), {}
+
+    def empty(queue):
+        # Last to join leaves first, the longest scan for list.remove
+        for p in reversed(players):
+            queue.remove_player(p)
+
+    benchmark.pedantic(empty, setup=full_queue, rounds=2000)
@@ -0,0 +1,66 @@
+import types
+
+import pytest
+
+from benchmarks.helpers import make_players
+from src.match_queue_session import LobbyState, MatchQueue
+from src.queue_cog import QueueManagerCog
+
+GUILD_COUNTS = [100, 5000]
+# Events per round, divide the round time by this for the cost of one event
+EVENTS = 10000
+TEAM_SIZE = 5
+
+
+@pytest.fixture(params=GUILD_COUNTS, ids=lambda n: 'guilds{n}'.format(n=n))
+def routed_cog(request, loop, bot):
+    # Every guild has one lobby waiting for its players, so every team chat is in the routing index
+    cog = QueueManagerCog(bot)
+    for g in range(request.param):
+        queue = MatchQueue(guild_id=g, channel_id=g, lobby=1, team_size=TEAM_SIZE)
+        for p in make_players(TEAM_SIZE * 2, guild_id=g):
+            queue.add_player(p)
+        queue.team_1, queue.team_2 = queue.players[:TEAM_SIZE], queue.players[TEAM_SIZE:]
+        queue.team_1_vc = types.SimpleNamespace(id=(g + 1) * 10 + 1, members=[])
+        queue.team_2_vc = types.SimpleNamespace(id=(g + 1) * 10 + 2, members=[])
+        queue.progress.state = LobbyState.WAITING_FOR_PLAYERS
+        cog.set_queue(queue.queue_id, queue)
+        cog.voice_channel_queues[queue.team_1_vc.id] = queue
+        cog.voice_channel_queues[queue.team_2_vc.id] = queue
+    yield cog
+
+    async def unload():
+        cog.cog_unload()
+    loop.run_until_complete(unload())
+
+
+def voice_event(member_id:int, before, after):
+    member = types.SimpleNamespace(id=member_id, display_name='Player')
+    return member, types.SimpleNamespace(channel=before), types.SimpleNamespace(channel=after)
+
+
+def flood(loop, cog:QueueManagerCog, events):
+    async def dispatch():
+        for member, before, after in events:
+            await cog.on_voice_state_update(member, before, after)
+    loop.run_until_complete(dispatch())
+
+
+def bench_voice_event_unwatched(benchmark, loop, routed_cog):
+    # People hopping between ordinary voice channels all over the bot's guilds, dropped before any lobby is looked at
+    channels = [types.SimpleNamespace(id=-i) for i in range(1, 101)]
+    events = [voice_event(i, channels[i % 100], channels[(i + 1) % 100]) for i in range(EVENTS)]
+    benchmark(flood, loop, routed_cog, events)
+
+
+def bench_voice_event_watched(benchmark, loop, routed_cog):
+    # Players walking in and out of their own team chat across every guild. A lobby never fills, so nothing is sent
+    queues = list(routed_cog.match_queues.values())
+    events = []
+    for i in range(EVENTS):
+        queue = queues[i % len(queues)]
+        vc = queue.team_1_vc
+        player = queue.team_1[i // len(queues) % TEAM_SIZE]
+        events.append(voice_event(player.discord_id, None, vc) if i // len(queues) % 2 == 0 else
+                      voice_event(player.discord_id, vc, None))
+    benchmark(flood, loop, routed_cog, events)
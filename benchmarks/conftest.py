@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+from benchmarks.helpers import STORE_SIZES, make_players
+from src.player_store import SqlitePlayerStore, get_store_path
+from src.queue_bot import QueueBot
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def bot(loop, tmp_path):
+    bot = QueueBot("!", data_path=str(tmp_path / 'players.json'))
+    yield bot
+    bot.store.close()
+
+
+@pytest.fixture(scope='session', params=STORE_SIZES, ids=lambda n: 'store{n}'.format(n=n))
+def store_size(request) -> int:
+    return request.param
+
+
+@pytest.fixture(scope='session')
+def seeded_data_path(store_size, tmp_path_factory) -> str:
+    # One guild holding the whole store, the worst case for a cold guild load. A million rows take a while
+    # to write, so each size is seeded once and shared by every benchmark that needs it
+    data_path = str(tmp_path_factory.mktemp('store{n}'.format(n=store_size)) / 'players.json')
+    store = SqlitePlayerStore(get_store_path(data_path))
+    store.upsert([p.to_record() for p in make_players(store_size)])
+    store.close()
+    return data_path
+
+
+@pytest.fixture
+def seeded_bot(loop, seeded_data_path):
+    bot = QueueBot("!", data_path=seeded_data_path)
+    yield bot
+    bot.store.close()
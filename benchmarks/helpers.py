@@ -0,0 +1,27 @@
+import json
+import os
+import typing
+from typing import Dict, List
+
+from src.player import Player
+
+GUILD_ID = 1
+TEAM_SIZES = [2, 3, 4, 5]
+STORE_SIZES = [1000, 100000, 1000000]
+
+
+def make_players(count:int, guild_id:int=GUILD_ID, game:typing.Union[str, None]=None) -> List[Player]:
+    return [Player(discord_name='player{i}'.format(i=i), display_name='Player {i}'.format(i=i),
+                   discord_id=100000 + i, guild_id=guild_id, game=game,
+                   total_wins=i % 17, total_losses=i % 13, rating=900.0 + i % 200)
+            for i in range(count)]
+
+
+def write_json_players(path:str, records:Dict[str, dict]):
+    # How players.json was saved before the sqlite store: every player rewritten, whatever changed
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(records, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
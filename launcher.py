@@ -1,9 +1,13 @@
+import io
 import logging
+import time
 
 import discord
 from discord.ext import commands
 
 from src.config import BotConfig
+from src.constants import PROFILE_MAX_SECONDS
+from src.log_pipeline import start_logging
 from src.queue_bot import QueueBot
 from src.queue_cog import QueueManagerCog
 
@@ -14,21 +18,20 @@ TESTING = False
 
 
 if __name__ == "__main__":
-    logger = logging.getLogger('discord')
-    logger.setLevel(logging.INFO)
-    handler = logging.FileHandler(filename='discord.log', encoding='utf-8', mode='w')
-    handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
-    logger.addHandler(handler)
-
-    logger.info("Loading config file")
     config = BotConfig(CFG_PATH)
+    # Appends to the log across restarts, written from a background thread
+    log_listener = start_logging(config.log_path, level=config.log_level, max_bytes=config.log_max_bytes,
+                                 backups=config.log_backups, debug_sample_rate=config.log_debug_sample_rate)
+    logger = logging.getLogger('discord')
     logger.info("Config load successful")
 
     intents = discord.Intents.default()
     intents.typing = False
     intents.presences = False
 
-    bot = QueueBot("!", data_path=config.player_data_path, intents=intents)
+    bot = QueueBot("!", data_path=config.player_data_path, save_interval=config.save_interval,
+                   max_cached_players=config.max_cached_players, rating_k_factor=config.rating_k_factor,
+                   metrics_port=config.metrics_port, intents=intents)
 
     @bot.command(name='allow_queues')
     @commands.is_owner()
@@ -44,20 +47,45 @@ if __name__ == "__main__":
     @commands.is_owner()
     async def remove_cog(ctx:commands.Context):
         if len(bot.cogs) == 1:
-            bot.save_players()
+            await bot.flush_players()
             logger.info("Stopping Queue Cog")
+            # Live lobbies are picked back up the next time the cog loads
             cog: QueueManagerCog = bot.get_cog('QueueManagerCog')
-            logger.info("Cleaning up queue channels")
-            await cog.clean_up_queue_channels(ctx.guild)
-            logger.info("Channels cleaned")
+            await cog.save_snapshot()
             bot.remove_cog("QueueManagerCog")
             logger.info("Queue Cog successfully unloaded from the bot")
             await ctx.channel.send("Queue cog successfully unloaded from the bot. I'm sorry it was annoying...")
 
+    @bot.command(name='profile')
+    @commands.is_owner()
+    async def profile(ctx:commands.Context, seconds:float=10.0):
+        seconds = max(1.0, min(seconds, PROFILE_MAX_SECONDS))
+        await ctx.channel.send("Profiling for {s:.0f} seconds".format(s=seconds))
+        stacks = await bot.watchdog.profile(seconds)
+        # Collapsed stacks, ready for flamegraph.pl or speedscope
+        filename = 'profile-{t}.folded'.format(t=time.strftime('%Y%m%d-%H%M%S'))
+        await ctx.channel.send(file=discord.File(io.BytesIO(stacks.encode('utf-8')), filename=filename))
+
+
+    @bot.command(name='stats')
+    @commands.is_owner()
+    async def stats(ctx:commands.Context):
+        await ctx.channel.send("```\n{s}\n```".format(s=bot.metrics.summary()))
+
+    @bot.command(name='rerate')
+    @commands.is_owner()
+    async def rerate(ctx:commands.Context, *, game:str=None):
+        logger.info("Recomputing ratings for guild %s, game %s", ctx.guild.id, game)
+        updated = await bot.replay_ratings(ctx.guild.id, game)
+        await ctx.channel.send("Ratings recomputed from match history for {n} players".format(n=updated))
 
     @bot.command(name="save_player_data")
     async def save_data(ctx: commands.Context):
         if ctx.author.id == config.bot_admin_id:
-            bot.save_players()
+            await bot.flush_players()
 
-    bot.run(config.token)
\ No newline at end of file
+    try:
+        bot.run(config.token)
+    finally:
+        # Writes out whatever is still queued
+        log_listener.stop()
\ No newline at end of file
@@ -0,0 +1,331 @@
+import asyncio
+import collections
+import itertools
+import types
+import typing
+from typing import Callable, Dict, List, Tuple
+
+import discord
+
+# Stand-ins for the handful of discord.py objects the queue code touches. Anything that would be a REST call
+# goes through MockRest, so it is counted and held to Discord-like rate limits. Nothing touches the network.
+
+_ids = itertools.count(700000000000000000)
+
+# route -> (requests, per seconds). Message routes are limited per channel, guild routes per guild
+ROUTES: Dict[str, Tuple[int, float]] = {
+    'POST /channels/{channel_id}/messages': (5, 5.0),
+    'PATCH /channels/{channel_id}/messages/{message_id}': (5, 5.0),
+    'GET /channels/{channel_id}/messages/{message_id}': (50, 1.0),
+    'PUT /channels/{channel_id}/messages/{message_id}/reactions/{emoji}/@me': (1, 0.25),
+    'DELETE /channels/{channel_id}/messages/{message_id}/reactions/{emoji}': (1, 0.25),
+    'DELETE /channels/{channel_id}/messages/{message_id}/reactions/{emoji}/{user_id}': (1, 0.25),
+    'POST /guilds/{guild_id}/channels': (5, 5.0),
+    'PATCH /channels/{channel_id}': (2, 600.0),
+    'DELETE /channels/{channel_id}': (5, 5.0),
+    'PATCH /guilds/{guild_id}/members/{user_id}': (10, 10.0),
+    'GET /guilds/{guild_id}/members/{user_id}': (5, 1.0),
+}
+GLOBAL_LIMIT = (50, 1.0)
+
+# What discord.NotFound reads off an aiohttp response
+_NOT_FOUND = types.SimpleNamespace(status=404, reason='Not Found')
+
+
+class _Bucket:
+    def __init__(self, limit:int, per:float):
+        self.limit = limit
+        self.per = per
+        self._sent: typing.Deque[float] = collections.deque()
+
+    async def acquire(self) -> float:
+        # Seconds spent waiting for room in the window, exactly 0.0 when there was room straight away
+        loop = asyncio.get_event_loop()
+        waited = 0.0
+        while True:
+            now = loop.time()
+            while self._sent and now - self._sent[0] >= self.per:
+                self._sent.popleft()
+            if len(self._sent) < self.limit:
+                self._sent.append(now)
+                return waited
+            delay = self._sent[0] + self.per - now
+            await asyncio.sleep(delay)
+            waited += delay
+
+
+class MockRest:
+    def __init__(self, latency:float=0.05, time_scale:float=1.0):
+        # time_scale shrinks every window and round trip alike, so a long run can be replayed in less wall time
+        self.latency = latency * time_scale
+        self.time_scale = time_scale
+        self.calls: typing.Counter[str] = collections.Counter()
+        self.rate_limited: typing.Counter[str] = collections.Counter()
+        self.waited: typing.Counter[str] = collections.Counter()
+        self._global = _Bucket(GLOBAL_LIMIT[0], GLOBAL_LIMIT[1] * time_scale)
+        self._buckets: Dict[Tuple[str, int], _Bucket] = {}
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    async def request(self, route:str, major_id:int):
+        limit, per = ROUTES[route]
+        bucket = self._buckets.get((route, major_id))
+        if bucket is None:
+            bucket = self._buckets[(route, major_id)] = _Bucket(limit, per * self.time_scale)
+        self.calls[route] += 1
+        waited = await self._global.acquire() + await bucket.acquire()
+        if waited:
+            # discord.py would have slept on the bucket headers the same way
+            self.rate_limited[route] += 1
+            self.waited[route] += waited
+        await asyncio.sleep(self.latency)
+
+
+class FakeReaction:
+    def __init__(self, emoji:str, me:bool=False):
+        self.emoji = emoji
+        self.me = me
+        self.reacted: List['FakeMember'] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.reacted) + self.me
+
+    def users(self):
+        return _AsyncList(list(self.reacted))
+
+
+class _AsyncList:
+    def __init__(self, items:list):
+        self._items = iter(items)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._items)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeMessage:
+    def __init__(self, channel:'FakeTextChannel', content:str=None, embed:discord.Embed=None):
+        self.id = next(_ids)
+        self.channel = channel
+        self.guild = channel.guild
+        self.content = content
+        self.embeds: List[discord.Embed] = [embed] if embed is not None else []
+        self.reactions: List[FakeReaction] = []
+
+    async def edit(self, content:str=None, embed:discord.Embed=None):
+        await self.channel.rest.request('PATCH /channels/{channel_id}/messages/{message_id}', self.channel.id)
+        if content is not None:
+            self.content = content
+        if embed is not None:
+            self.embeds = [embed]
+
+    def _get_reaction(self, emoji:str) -> FakeReaction:
+        for r in self.reactions:
+            if r.emoji == emoji:
+                return r
+        reaction = FakeReaction(emoji)
+        self.reactions.append(reaction)
+        return reaction
+
+    async def add_reaction(self, emoji:str):
+        await self.channel.rest.request('PUT /channels/{channel_id}/messages/{message_id}/reactions/{emoji}/@me', self.channel.id)
+        self._get_reaction(emoji).me = True
+
+    def react(self, member:'FakeMember', emoji:str):
+        # A user reacting in their own client. The bot only hears about it if the caller also dispatches the event
+        reaction = self._get_reaction(emoji)
+        if member not in reaction.reacted:
+            reaction.reacted.append(member)
+
+    async def remove_reaction(self, emoji, member:'FakeMember'):
+        await self.channel.rest.request('DELETE /channels/{channel_id}/messages/{message_id}/reactions/{emoji}/{user_id}', self.channel.id)
+        emoji = getattr(emoji, 'name', emoji)
+        for r in self.reactions:
+            if r.emoji == emoji and member in r.reacted:
+                r.reacted.remove(member)
+
+    async def clear_reaction(self, emoji:str):
+        await self.channel.rest.request('DELETE /channels/{channel_id}/messages/{message_id}/reactions/{emoji}', self.channel.id)
+        self.reactions = [r for r in self.reactions if r.emoji != emoji]
+
+
+class FakeTextChannel:
+    def __init__(self, guild:'FakeGuild', name:str):
+        self.id = next(_ids)
+        self.guild = guild
+        self.name = name
+        self.rest = guild.rest
+        self._messages: Dict[int, FakeMessage] = {}
+
+    async def send(self, content:str=None, embed:discord.Embed=None) -> FakeMessage:
+        await self.rest.request('POST /channels/{channel_id}/messages', self.id)
+        msg = FakeMessage(self, content, embed)
+        self._messages[msg.id] = msg
+        return msg
+
+    async def fetch_message(self, message_id:int) -> FakeMessage:
+        await self.rest.request('GET /channels/{channel_id}/messages/{message_id}', self.id)
+        if message_id not in self._messages:
+            raise discord.NotFound(_NOT_FOUND, 'Unknown Message')
+        return self._messages[message_id]
+
+    def get_message(self, message_id:int) -> typing.Union[FakeMessage, None]:
+        return self._messages.get(message_id)
+
+    def delete_message(self, message_id:int):
+        # Someone deleting a message by hand
+        self._messages.pop(message_id, None)
+
+
+class FakeVoiceChannel:
+    def __init__(self, guild:'FakeGuild', name:str, category:'FakeCategory'):
+        self.id = next(_ids)
+        self.guild = guild
+        self.name = name
+        self.category = category
+        self.members: List['FakeMember'] = []
+
+    async def edit(self, name:str=None):
+        await self.guild.rest.request('PATCH /channels/{channel_id}', self.id)
+        if name is not None:
+            self.name = name
+
+    async def delete(self):
+        await self.guild.rest.request('DELETE /channels/{channel_id}', self.guild.id)
+        self.guild.remove_channel(self)
+
+
+class FakeCategory:
+    def __init__(self, guild:'FakeGuild', name:str):
+        self.id = next(_ids)
+        self.guild = guild
+        self.name = name
+        self.channels: List[FakeVoiceChannel] = []
+
+    @property
+    def voice_channels(self) -> List[FakeVoiceChannel]:
+        return list(self.channels)
+
+    async def create_voice_channel(self, name:str) -> FakeVoiceChannel:
+        await self.guild.rest.request('POST /guilds/{guild_id}/channels', self.guild.id)
+        channel = FakeVoiceChannel(self.guild, name, self)
+        self.channels.append(channel)
+        self.guild.add_channel(channel)
+        return channel
+
+    async def delete(self):
+        await self.guild.rest.request('DELETE /channels/{channel_id}', self.guild.id)
+        self.guild.remove_channel(self)
+
+
+class FakeVoiceState:
+    def __init__(self, channel:typing.Union[FakeVoiceChannel, None]):
+        self.channel = channel
+
+
+class FakeMember:
+    def __init__(self, guild:'FakeGuild', name:str):
+        self.id = next(_ids)
+        self.guild = guild
+        self.name = name
+        self.display_name = name
+        self.bot = False
+        self.voice = FakeVoiceState(None)
+
+    def connect(self, channel:typing.Union[FakeVoiceChannel, None]):
+        # What the user does in their own client, the bot only hears about it through the gateway
+        before = self.voice
+        if before.channel is not None and self in before.channel.members:
+            before.channel.members.remove(self)
+        if channel is not None:
+            channel.members.append(self)
+        self.voice = FakeVoiceState(channel)
+        self.guild.gateway('voice_state_update', self, before, self.voice)
+
+    async def move_to(self, channel:typing.Union[FakeVoiceChannel, None]):
+        await self.guild.rest.request('PATCH /guilds/{guild_id}/members/{user_id}', self.guild.id)
+        self.connect(channel)
+
+
+class FakeGuild:
+    def __init__(self, rest:MockRest, name:str, gateway:Callable[..., None]):
+        self.id = next(_ids)
+        self.name = name
+        self.rest = rest
+        # Events are handed to the bot the way the gateway would, as their own dispatch
+        self.gateway = gateway
+        self._channels: Dict[int, object] = {}
+        self._members: Dict[int, FakeMember] = {}
+
+    @property
+    def categories(self) -> List[FakeCategory]:
+        return [c for c in self._channels.values() if isinstance(c, FakeCategory)]
+
+    @property
+    def members(self) -> List[FakeMember]:
+        return list(self._members.values())
+
+    def get_channel(self, channel_id:int):
+        return self._channels.get(channel_id)
+
+    def get_member(self, member_id:int) -> typing.Union[FakeMember, None]:
+        return self._members.get(member_id)
+
+    async def fetch_member(self, member_id:int) -> FakeMember:
+        await self.rest.request('GET /guilds/{guild_id}/members/{user_id}', self.id)
+        return self._members[member_id]
+
+    async def create_category(self, name:str) -> FakeCategory:
+        await self.rest.request('POST /guilds/{guild_id}/channels', self.id)
+        category = FakeCategory(self, name)
+        self.add_channel(category)
+        return category
+
+    def add_channel(self, channel):
+        self._channels[channel.id] = channel
+
+    def remove_channel(self, channel):
+        self._channels.pop(channel.id, None)
+        if isinstance(channel, FakeVoiceChannel) and channel in channel.category.channels:
+            channel.category.channels.remove(channel)
+
+    def add_text_channel(self, name:str) -> FakeTextChannel:
+        channel = FakeTextChannel(self, name)
+        self.add_channel(channel)
+        return channel
+
+    def add_member(self, name:str) -> FakeMember:
+        member = FakeMember(self, name)
+        self._members[member.id] = member
+        return member
+
+
+class FakeContext:
+    def __init__(self, bot, guild:FakeGuild, channel:FakeTextChannel, author:FakeMember):
+        self.bot = bot
+        self.guild = guild
+        self.channel = channel
+        self.author = author
+        self.message = None
+
+    async def send(self, content:str=None, embed:discord.Embed=None) -> FakeMessage:
+        return await self.channel.send(content, embed=embed)
+
+
+def make_reaction(message_id:int, member:FakeMember, channel:FakeTextChannel, emoji:str):
+    return types.SimpleNamespace(
+        message_id=message_id,
+        user_id=member.id,
+        member=member,
+        channel_id=channel.id,
+        guild_id=channel.guild.id,
+        emoji=types.SimpleNamespace(name=emoji),
+        event_type='REACTION_ADD')
@@ -0,0 +1,276 @@
+import argparse
+import asyncio
+import collections
+import logging
+import os
+import random
+import tempfile
+import time
+import typing
+from typing import Dict, List
+
+import discord
+
+from loadtest.fake_discord import FakeContext, FakeGuild, FakeMember, FakeTextChannel, MockRest, make_reaction
+from src.match_queue_session import LobbyState, MatchQueue
+from src.matchmaker import Matchmaker
+from src.queue_bot import QueueBot
+from src.queue_cog import QueueManagerCog
+
+log = logging.getLogger(__name__)
+
+# Drives the real bot and cog through thousands of scripted lobbies against fake guilds:
+#   python -m loadtest.run --guilds 10 --channels 5 --lobbies 20 --team-size 5 --time-scale 0.05
+
+
+class LoadTestBot(QueueBot):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fake_guilds: Dict[int, FakeGuild] = {}
+        self.fake_user = discord.Object(id=1)
+
+    @property
+    def user(self):
+        return self.fake_user
+
+    def get_guild(self, guild_id:int):
+        return self.fake_guilds.get(guild_id)
+
+    def get_channel(self, channel_id:int):
+        for guild in self.fake_guilds.values():
+            channel = guild.get_channel(channel_id)
+            if channel is not None:
+                return channel
+        return None
+
+    async def fetch_channel(self, channel_id:int):
+        return self.get_channel(channel_id)
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = collections.defaultdict(list)
+        self.errors: typing.Counter[str] = collections.Counter()
+        self.loop_lag: List[float] = []
+        self.matches = 0
+
+    async def timed(self, name:str, coro:typing.Awaitable):
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        try:
+            await coro
+        except Exception:
+            self.errors[name] += 1
+            log.exception("%s failed", name)
+        self.latencies[name].append(loop.time() - started)
+
+    async def sample_loop_lag(self, interval:float=0.05):
+        loop = asyncio.get_event_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            self.loop_lag.append(loop.time() - started - interval)
+
+
+def percentiles(values:List[float]) -> str:
+    if not values:
+        return 'n/a'
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return 'p50 {a:8.1f}  p95 {b:8.1f}  p99 {c:8.1f}  max {d:8.1f} ms'.format(
+        a=pick(0.50), b=pick(0.95), c=pick(0.99), d=ordered[-1] * 1000)
+
+
+class LoadTestCog(QueueManagerCog):
+    # Every lobby the cog forms gets a script that plays it out the way its players would
+    def __init__(self, bot:LoadTestBot, harness:'Harness'):
+        super().__init__(bot)
+        self.harness = harness
+
+    def form_lobbies(self, matchmaker:Matchmaker) -> List[MatchQueue]:
+        lobbies = super().form_lobbies(matchmaker)
+        channel = self.bot.get_channel(matchmaker.queue_id.channel_id)
+        for queue in lobbies:
+            self.harness.scripts.append(asyncio.get_event_loop().create_task(self.harness.play_lobby(channel, queue)))
+        return lobbies
+
+
+class Harness:
+    def __init__(self, args:argparse.Namespace):
+        self.args = args
+        self.rest = MockRest(latency=args.latency, time_scale=args.time_scale)
+        self.stats = Stats()
+        # One per lobby formed, and one per player going back in line
+        self.scripts: List[asyncio.Task] = []
+        self.rejoins: List[asyncio.Task] = []
+        data_dir = tempfile.mkdtemp(prefix='queue-loadtest-')
+        self.bot = LoadTestBot("!", data_path=os.path.join(data_dir, 'players.db'), intents=discord.Intents.default())
+        self.cog: typing.Union[LoadTestCog, None] = None
+        self.members: Dict[int, FakeMember] = {}
+        self.rounds_left: Dict[int, int] = {}
+
+    def think(self) -> float:
+        # How long a person takes to notice something and react to it
+        return random.uniform(0.2, self.args.think_time) * self.args.time_scale
+
+    async def until(self, predicate:typing.Callable[[], bool], timeout:float=600.0) -> bool:
+        deadline = asyncio.get_event_loop().time() + timeout * self.args.time_scale + 30
+        while not predicate():
+            if asyncio.get_event_loop().time() > deadline:
+                return False
+            await asyncio.sleep(self.think())
+        return True
+
+    def react(self, message_id:int, member:FakeMember, channel:FakeTextChannel, emoji:str):
+        message = channel.get_message(message_id)
+        if message is not None:
+            message.react(member, emoji)
+        self.bot.dispatch('raw_reaction_add', make_reaction(message_id, member, channel, emoji))
+
+    def context(self, member:FakeMember, channel:FakeTextChannel) -> FakeContext:
+        return FakeContext(self.bot, member.guild, channel, member)
+
+    async def play_lobby(self, channel:FakeTextChannel, queue:MatchQueue):
+        sessions = self.bot.reactions.sessions
+        members = [self.members[p.discord_id] for p in queue.players]
+        if not await self.until(lambda: queue.rollcall is not None and queue.rollcall.message_id in sessions):
+            return
+        await asyncio.gather(*[self._react_later(queue.rollcall.message_id, m, channel, '✅') for m in members])
+
+        if not queue.balanced:
+            if not await self.until(lambda: queue.picker is not None and queue.picker.message_id in sessions):
+                return
+            picker = queue.picker
+            while queue.progress.state == LobbyState.PICKING and picker.unplaced_players:
+                left = len(picker.unplaced_players)
+                pick = random.choice(picker.unplaced_players)
+                await asyncio.sleep(self.think())
+                self.react(picker.message_id, self.members[picker.current_captain.discord_id], channel, picker.player_emojis[pick])
+                await self.until(lambda: len(picker.unplaced_players) < left or queue.progress.state != LobbyState.PICKING)
+
+        if not await self.until(lambda: queue.progress.state != LobbyState.PICKING and queue.progress.vote_complete):
+            return
+        for team, vc in ((queue.team_1, queue.team_1_vc), (queue.team_2, queue.team_2_vc)):
+            for p in team:
+                asyncio.get_event_loop().call_later(self.think(), self.members[p.discord_id].connect, vc)
+        if not await self.until(lambda: queue.progress.ready_to_start):
+            return
+
+        captains = [self.members[d] for d in queue.captain_ids]
+        for captain in captains:
+            await asyncio.sleep(self.think())
+            await self.stats.timed('result', self.cog.report_result(self.context(captain, channel), 1))
+        for m in members:
+            m.connect(None)
+        await asyncio.sleep(self.think())
+        await self.stats.timed('reset', self.cog.reset_queue(self.context(captains[0], channel)))
+        self.stats.matches += 1
+        # Everyone goes back in line for another round
+        for m in members:
+            self.rounds_left[m.id] -= 1
+            if self.rounds_left[m.id] > 0:
+                self.rejoins.append(asyncio.get_event_loop().create_task(self.join(m, channel)))
+
+    async def _react_later(self, message_id:int, member:FakeMember, channel:FakeTextChannel, emoji:str):
+        await asyncio.sleep(self.think())
+        self.react(message_id, member, channel, emoji)
+
+    async def join(self, member:FakeMember, channel:FakeTextChannel):
+        await asyncio.sleep(self.think())
+        await self.stats.timed('q', self.cog.queue(self.context(member, channel)))
+        # Some change their mind while the lobby is still filling, and come back a moment later
+        if random.random() < self.args.leave_rate:
+            await asyncio.sleep(self.think())
+            if member.id in self.cog.waiting_players:
+                await self.stats.timed('leave', self.cog.leave_queue(self.context(member, channel)))
+                await asyncio.sleep(self.think())
+                await self.stats.timed('q', self.cog.queue(self.context(member, channel)))
+
+    def build_guilds(self) -> List[typing.Tuple[FakeMember, FakeTextChannel]]:
+        joins = []
+        players_per_channel = self.args.lobbies * self.args.team_size * 2
+        for g in range(self.args.guilds):
+            guild = FakeGuild(self.rest, 'guild {g}'.format(g=g), self.bot.dispatch)
+            self.bot.fake_guilds[guild.id] = guild
+            for c in range(self.args.channels):
+                channel = guild.add_text_channel('queue-{c}'.format(c=c))
+                for i in range(players_per_channel):
+                    member = guild.add_member('player {g}-{c}-{i}'.format(g=g, c=c, i=i))
+                    self.members[member.id] = member
+                    self.rounds_left[member.id] = self.args.rounds
+                    joins.append((member, channel))
+        return joins
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        self.cog = LoadTestCog(self.bot, self)
+        self.bot.add_cog(self.cog)
+        # There is no gateway to log in to, so the snapshot and flush loops would otherwise wait forever
+        self.bot._ready.set()
+        joins = self.build_guilds()
+        for guild in self.bot.fake_guilds.values():
+            for channel in [c for c in guild._channels.values() if isinstance(c, FakeTextChannel)]:
+                admin = guild.add_member('admin')
+                await self.cog.new_queue(self.context(admin, channel), self.args.team_size,
+                                         game='balanced' if self.args.balanced else None)
+        expected = len(joins) * self.args.rounds // (self.args.team_size * 2)
+
+        lag_task = loop.create_task(self.stats.sample_loop_lag())
+        started = time.perf_counter()
+        random.shuffle(joins)
+        await asyncio.gather(*[self.join(m, c) for m, c in joins])
+        while self.stats.matches < expected:
+            await asyncio.sleep(0.5)
+            # Every script has played its lobby out or given up on it, nothing else is going to happen
+            if all(t.done() for t in self.scripts + self.rejoins):
+                break
+        elapsed = time.perf_counter() - started
+        stuck = collections.Counter(q.progress.state.value for q in self.cog.match_queues.values()
+                                    if q.progress.state not in (LobbyState.CANCELLED, LobbyState.FINISHED))
+        await self.stats.timed('flush', self.bot.flush_players())
+        lag_task.cancel()
+        self.cog.cog_unload()
+        self.report(expected, elapsed, stuck)
+
+    def report(self, expected:int, elapsed:float, stuck:typing.Counter[str]):
+        stats = self.stats
+        print("{m} of {e} matches in {t:.1f}s wall time ({r:.1f} matches/minute, time scale {s})".format(
+            m=stats.matches, e=expected, t=elapsed, r=stats.matches / elapsed * 60, s=self.args.time_scale))
+        if stuck:
+            print("Lobbies left unfinished: {s}".format(s=', '.join('{n} {st}'.format(n=n, st=st) for st, n in stuck.items())))
+        print("\nCommand latency")
+        for name, values in sorted(stats.latencies.items()):
+            print("  {n:8} {c:7} calls  {p}".format(n=name, c=len(values), p=percentiles(values)))
+        if stats.errors:
+            print("  errors: {e}".format(e=dict(stats.errors)))
+        print("\nEvent loop lag  {p}".format(p=percentiles(stats.loop_lag)))
+        print("\nREST calls: {t} total, {m:.1f} per match".format(
+            t=self.rest.total_calls, m=self.rest.total_calls / max(stats.matches, 1)))
+        for route, count in self.rest.calls.most_common():
+            print("  {c:8} {r}  ({l} waited on a rate limit, {w:.1f}s total)".format(
+                c=count, r=route, l=self.rest.rate_limited[route], w=self.rest.waited[route] / self.args.time_scale))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play scripted lobbies against the bot with no network")
+    parser.add_argument('--guilds', type=int, default=10)
+    parser.add_argument('--channels', type=int, default=5, help="Queue channels per guild")
+    parser.add_argument('--lobbies', type=int, default=20, help="Lobbies filled per channel each round")
+    parser.add_argument('--team-size', type=int, default=5)
+    parser.add_argument('--rounds', type=int, default=1, help="Matches every player plays")
+    parser.add_argument('--balanced', action='store_true', help="Balance teams by rating instead of drafting")
+    parser.add_argument('--latency', type=float, default=0.05, help="REST round trip in seconds")
+    parser.add_argument('--leave-rate', type=float, default=0.0,
+                        help="Share of joins followed by a !leave and a second !q before the lobby fills")
+    parser.add_argument('--think-time', type=float, default=3.0, help="Longest a player takes to act, in seconds")
+    parser.add_argument('--time-scale', type=float, default=1.0,
+                        help="Shrinks rate limit windows, round trips and think time alike")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.get_event_loop().run_until_complete(Harness(args).run())
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,15 @@ class BotConfig:
         self._check_token()
         self.bot_admin_id = config.get('permissions', 'bot_admin_id', fallback=ConfigDefaults.bot_admin_id)
         self.player_data_path = config.get('paths', 'player_data', fallback=ConfigDefaults.player_data_path)
+        self.save_interval = config.getfloat('persistence', 'save_interval', fallback=ConfigDefaults.save_interval)
+        self.max_cached_players = config.getint('persistence', 'max_cached_players', fallback=ConfigDefaults.max_cached_players)
+        self.rating_k_factor = config.getfloat('ratings', 'k_factor', fallback=ConfigDefaults.rating_k_factor)
+        self.metrics_port = config.getint('metrics', 'port', fallback=ConfigDefaults.metrics_port)
+        self.log_path = config.get('logging', 'path', fallback=ConfigDefaults.log_path)
+        self.log_level = config.get('logging', 'level', fallback=ConfigDefaults.log_level)
+        self.log_max_bytes = config.getint('logging', 'max_bytes', fallback=ConfigDefaults.log_max_bytes)
+        self.log_backups = config.getint('logging', 'backups', fallback=ConfigDefaults.log_backups)
+        self.log_debug_sample_rate = config.getint('logging', 'debug_sample_rate', fallback=ConfigDefaults.log_debug_sample_rate)
 
 
     def _config_exists(self) -> bool:
@@ -25,6 +34,19 @@ class BotConfig:
             config['permissions']['bot_admin_id'] = ConfigDefaults.bot_admin_id
             config['paths'] = {}
             config['paths']['player_data'] = ConfigDefaults.player_data_path
+            config['persistence'] = {}
+            config['persistence']['save_interval'] = str(ConfigDefaults.save_interval)
+            config['persistence']['max_cached_players'] = str(ConfigDefaults.max_cached_players)
+            config['ratings'] = {}
+            config['ratings']['k_factor'] = str(ConfigDefaults.rating_k_factor)
+            config['metrics'] = {}
+            config['metrics']['port'] = str(ConfigDefaults.metrics_port)
+            config['logging'] = {}
+            config['logging']['path'] = ConfigDefaults.log_path
+            config['logging']['level'] = ConfigDefaults.log_level
+            config['logging']['max_bytes'] = str(ConfigDefaults.log_max_bytes)
+            config['logging']['backups'] = str(ConfigDefaults.log_backups)
+            config['logging']['debug_sample_rate'] = str(ConfigDefaults.log_debug_sample_rate)
             with open(self.path, 'w') as f:
                 config.write(f)
             raise ConfigError("Config file, {file}, did not exist. It has been created, please fill it out accordingly.")
@@ -53,4 +75,16 @@ class BotConfig:
 class ConfigDefaults:
     token = None
     bot_admin_id = None
-    player_data_path = 'data/players.json'
\ No newline at end of file
+    # The store lives in the matching .db, the JSON path is kept so an existing players.json is still migrated
+    player_data_path = 'data/players.json'
+    save_interval = 30.0
+    max_cached_players = 50000
+    rating_k_factor = 32.0
+    # 0 leaves the Prometheus endpoint off
+    metrics_port = 0
+    log_path = 'discord.log'
+    log_level = 'INFO'
+    log_max_bytes = 10 * 1024 * 1024
+    log_backups = 5
+    # 1 in this many DEBUG records from each call site is kept
+    log_debug_sample_rate = 100
\ No newline at end of file
@@ -0,0 +1,29 @@
+# Lobby deadlines, in seconds
+ROLL_CALL_TIMEOUT = 300
+PICK_TURN_TIMEOUT = 120
+KICK_VOTE_TIMEOUT = 120
+IDLE_QUEUE_TIMEOUT = 1800
+
+# Teams remembered per guild when balancing
+RECENT_TEAMS_KEPT = 10
+
+# Seconds between match history checkpoints
+HISTORY_COMPACT_INTERVAL = 3600
+
+# Rating points a waiting player is forgiven per second spent in the matchmaking pool
+MATCHMAKING_WAIT_BONUS = 2.0
+
+# Empty team voice channels each guild keeps around between matches
+VOICE_POOL_IDLE_KEPT = 4
+
+# Seconds between snapshots of live lobbies
+SNAPSHOT_INTERVAL = 5
+
+
+# Event loop watchdog, in seconds: heartbeat period and how long the loop may go without one before it is reported
+LOOP_HEARTBEAT_INTERVAL = 0.1
+LOOP_LAG_THRESHOLD = 0.25
+
+# !profile samples the loop thread this often, for at most this many seconds
+PROFILE_SAMPLE_INTERVAL = 0.005
+PROFILE_MAX_SECONDS = 60
@@ -1,23 +1,42 @@
 import asyncio
 import logging
 import random
-import time
-from typing import List
+import typing
+from typing import Dict, FrozenSet, Iterable, List, Set
 import discord
 from discord.ext import commands
 
+from src.leaderboard import Leaderboard, LEADERBOARD_METRICS
+from src.message_utils import MessageUpdater, fetch_message
 from src.player import Player
+from src.queue_bot import QueueBot
+from src.team_balancer import balance_teams
+from src.timer_wheel import TimerWheel, WheelTimer
 
 log = logging.getLogger(__name__)
 
+def schedule_timeout(timers:TimerWheel, reactions:asyncio.Queue, timeout:float) -> WheelTimer:
+    # The expired timer itself is queued behind the reactions, so a waiter can tell its own deadline from a stale one
+    timer = None
+
+    def expire():
+        reactions.put_nowait(timer)
+    timer = timers.call_later(timeout, expire)
+    return timer
+
 class EmbeddedRollCall:
-    def __init__(self, players:List[Player], timeout:int=300, testing=False):
+    def __init__(self, players:List[Player], timeout:int=300, testing=False,
+                 present:Iterable[Player]=(), message_id:int=None):
         self.testing=testing
         self.players = players
         self.timeout:int = timeout
         self.presence_dict = {x.display_name: "Missing" for x in self.players}
         if self.testing:
             self.presence_dict = self._make_fakes_present()
+        for p in present:
+            self.presence_dict[p.display_name] = "Present"
+        # Set once the message is up, or up front when a restored roll call carries on in its old message
+        self.message_id: typing.Union[int, None] = message_id
         self.page:discord.Embed = self._get_rollcall_page()
         self.good_to_go = False
 
@@ -25,38 +44,61 @@ class EmbeddedRollCall:
     def all_present(self):
         return all([v == 'Present' for k,v in self.presence_dict.items()])
 
-    async def send_message(self, ctx:commands.Context):
-        msg:discord.Message = await ctx.channel.send(embed=self.page)
-        wait_for_players = True
-        bot: commands.Bot = ctx.bot
-        time_started = time.time()
-        running_timeout = self.timeout
-        while wait_for_players:
-            try:
-                def check_reaction(payload:discord.RawReactionActionEvent):
-                    if payload.user_id != bot.user.id and msg.id == payload.message_id:
-                        return True
-                payload:discord.RawReactionActionEvent = await bot.wait_for(
-                    "raw_reaction_add", timeout=running_timeout, check=check_reaction
-                )
-
-                running_timeout -= int(time.time() - time_started)
-                responding_player:Player = self.get_player_from_id(payload.user_id)
-                if responding_player is not None:
-                    self.presence_dict[responding_player.display_name] = "Present"
-                    embed = self._get_rollcall_page()
-                    await msg.edit(embed=embed)
-                else:
-                    await msg.reactions.remove(payload.emoji)
+    @property
+    def present_players(self) -> List[Player]:
+        return [p for p in self.players if self.presence_dict.get(p.display_name) == 'Present']
 
+    async def send_message(self, channel:discord.TextChannel, bot:QueueBot):
+        msg:discord.Message = await self._get_message(channel)
+        self.message_id = msg.id
+        reactions = bot.reactions.register(msg.id)
+        updater = MessageUpdater(msg)
+        updater.update(self._get_rollcall_page())
+        # The lobby task can be cancelled at any await, so the message is always released on the way out
+        try:
+            if self.all_present or await self._wait_for_players(msg, reactions, updater, bot.timers):
+                await updater.flush()
+                return True
+        finally:
+            bot.reactions.unregister(msg.id)
+            updater.cancel()
+        await channel.send('Roll call has timed out because someone did not show. Queue will reset now...')
+        return False
+
+    async def _get_message(self, channel:discord.TextChannel) -> discord.Message:
+        msg = await fetch_message(channel, self.message_id)
+        if msg is None:
+            return await channel.send(embed=self.page)
+        # Anyone who reacted while the bot was away still counts
+        for reaction in msg.reactions:
+            async for user in reaction.users():
+                player = self.get_player_from_id(user.id)
+                if player is not None:
+                    self.presence_dict[player.display_name] = "Present"
+        return msg
+
+    async def _wait_for_players(self, msg:discord.Message, reactions:asyncio.Queue, updater:MessageUpdater, timers:TimerWheel):
+        # One deadline for the whole roll call
+        timeout = schedule_timeout(timers, reactions, self.timeout)
+        try:
+            while True:
+                payload = await reactions.get()
+                if payload is timeout:
+                    return False
+                if isinstance(payload, WheelTimer):
+                    continue
+
+                self._mark_present(payload, updater)
                 if self.all_present:
-                    wait_for_players = False
                     return True
+        finally:
+            timeout.cancel()
 
-            except asyncio.TimeoutError:
-                wait_for_players = False
-        await ctx.channel.send('Roll call has timed out because someone did not show. Queue will reset now...')
-        return False
+    def _mark_present(self, payload:discord.RawReactionActionEvent, updater:MessageUpdater):
+        responding_player:Player = self.get_player_from_id(payload.user_id)
+        if responding_player is not None:
+            self.presence_dict[responding_player.display_name] = "Present"
+            updater.update(self._get_rollcall_page())
 
     def _get_rollcall_page(self):
         description = 'Everyone must be preset before we pick teams'
@@ -83,14 +125,22 @@ class EmbeddedRollCall:
         return None
 
 class EmbeddedPicker:
-    def __init__(self, players:List[Player], timeout=300, testing=False):
+    def __init__(self, players:List[Player], timeout=300, testing=False,
+                 team_1:List[Player]=None, team_2:List[Player]=None, message_id:int=None):
         self.testing = testing
         self.players = players
         self.timeout = timeout
         self.all_emojis: List[str] = ["1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣"]
-        self.team_1 = []
-        self.team_2 = []
-        self.choose_captains()
+        self.message_id: typing.Union[int, None] = message_id
+        # A restored draft keeps its captains and picks so far
+        if team_1 and team_2:
+            self.team_1 = list(team_1)
+            self.team_2 = list(team_2)
+            self._assign_emojis()
+        else:
+            self.team_1 = []
+            self.team_2 = []
+            self.choose_captains()
 
     @property
     def team_1_field_value(self):
@@ -106,54 +156,101 @@ class EmbeddedPicker:
 
     @property
     def remaining_emojis(self) -> List[str]:
-        return self.all_emojis[0:len(self.unplaced_players)]
+        return [self.player_emojis[x] for x in self.unplaced_players]
 
-    async def send_message(self, ctx:commands.Context):
-        embed:discord.Embed = self._get_page(self.team_1[0].display_name)
-        msg:discord.Message = await ctx.channel.send(embed=embed)
-        bot: commands.Bot = ctx.bot
-        time_started = time.time()
-        running_timeout = self.timeout
-        blame_captain = None
-        while blame_captain is None:
-            await self._clear_add_reactions(msg)
-            current_captain, current_team = (self.team_1[0], 1) if len(self.remaining_emojis) % 2 == 0 else (
-            self.team_2[0], 2)
+    @property
+    def current_captain(self) -> Player:
+        return self.team_1[0] if len(self.unplaced_players) % 2 == 0 else self.team_2[0]
+
+    async def send_message(self, channel:discord.TextChannel, bot:QueueBot):
+        embed:discord.Embed = self._get_page(self.current_captain.display_name)
+        msg = await fetch_message(channel, self.message_id)
+        resumed = msg is not None
+        if not resumed:
+            msg = await channel.send(embed=embed)
+        self.message_id = msg.id
+        reactions = bot.reactions.register(msg.id)
+        updater = MessageUpdater(msg)
+        try:
+            if resumed:
+                await self._apply_missed_picks(msg)
+                updater.update(self._get_page(self.current_captain.display_name))
+            await self._add_reactions(msg)
+            blame_captain = await self._pick_teams(msg, reactions, updater, bot.timers)
+            if blame_captain is None:
+                updater.update(self._get_final_page())
+                await updater.flush()
+                return True
+        finally:
+            bot.reactions.unregister(msg.id)
+            updater.cancel()
+        await channel.send('Team picking has timed out because {c} could not make a decision. The queue will be reset'.format(c=blame_captain.display_name))
+        return False
+
+    async def _pick_teams(self, msg:discord.Message, reactions:asyncio.Queue, updater:MessageUpdater, timers:TimerWheel):
+        while len(self.unplaced_players) > 0:
+            current_captain = self.current_captain
+            current_team = 1 if current_captain is self.team_1[0] else 2
+            selected_player = None
+            # Every captain gets a fresh deadline for their own pick
+            timeout = schedule_timeout(timers, reactions, self.timeout)
             try:
-                def check_reaction(payload: discord.RawReactionActionEvent):
-                    if payload.user_id == current_captain.discord_id and msg.id == payload.message_id:
-                        return True
-
-                payload: discord.RawReactionActionEvent = await bot.wait_for(
-                    "raw_reaction_add", timeout=running_timeout, check=check_reaction
-                )
-
-                running_timeout -= int(time.time() - time_started)
-                selected_player_index = self.remaining_emojis.index(payload.emoji.name)
-                if current_team == 1:
-                    self.team_1.append(self.unplaced_players[selected_player_index])
-                else:
-                    self.team_2.append(self.unplaced_players[selected_player_index])
+                # Reactions from anyone but the captain on the clock, or on players already taken, are ignored
+                while selected_player is None:
+                    payload = await reactions.get()
+                    if payload is timeout:
+                        return current_captain
+                    if isinstance(payload, WheelTimer):
+                        continue
+                    if payload.user_id == current_captain.discord_id:
+                        selected_player = self._get_unplaced_player(payload.emoji.name)
+                    if selected_player is None and payload.member is not None:
+                        # Taken back off so the reaction can be pressed again, a captain who reacted out of turn
+                        # would otherwise have nothing left to click once their turn comes
+                        asyncio.get_event_loop().create_task(msg.remove_reaction(payload.emoji, payload.member))
+            finally:
+                timeout.cancel()
 
+            if current_team == 1:
+                self.team_1.append(selected_player)
+            else:
+                self.team_2.append(selected_player)
 
-                if len(self.unplaced_players) < 1:
-                    await msg.edit(embed=self._get_final_page())
-                    return True
-                else:
-                    if current_team == 1:
-                        await msg.edit(embed=self._get_page(self.team_2[0].display_name))
-                    else:
-                        await msg.edit(embed=self._get_page(self.team_1[0].display_name))
+            if len(self.unplaced_players) > 0:
+                next_captain = self.team_2[0] if current_team == 1 else self.team_1[0]
+                # Only the picked emoji goes away, the rest of the reactions stay where they are
+                updater.update(self._get_page(next_captain.display_name))
+                await msg.clear_reaction(self.player_emojis[selected_player])
+        return None
 
-            except asyncio.TimeoutError:
-                blame_captain = current_captain
-        await ctx.channel.send('Team picking has timed out because {c} could not make a decision. The queue will be reset'.format(c=blame_captain))
+    async def _apply_missed_picks(self, msg:discord.Message):
+        # Picks the captains made while the bot was away are still on the message. Reactions carry no order,
+        # so each captain in turn gets whichever of their reactions is on a player nobody has taken yet
+        reactors: Dict[str, Set[int]] = {}
+        for reaction in msg.reactions:
+            if str(reaction.emoji) in self.emoji_players:
+                reactors[str(reaction.emoji)] = {user.id async for user in reaction.users()}
+        picked = []
+        while len(self.unplaced_players) > 0:
+            current_captain = self.current_captain
+            selected_player = next((p for p in self.unplaced_players
+                                    if current_captain.discord_id in reactors.get(self.player_emojis[p], ())), None)
+            if selected_player is None:
+                break
+            (self.team_1 if current_captain is self.team_1[0] else self.team_2).append(selected_player)
+            picked.append(self.player_emojis[selected_player])
+        await asyncio.gather(*[msg.clear_reaction(em) for em in picked])
 
+    async def _add_reactions(self, msg:discord.Message):
+        # A resumed draft only puts back the emojis that went missing while the bot was away
+        added = {str(r.emoji) for r in msg.reactions if r.me}
+        await asyncio.gather(*[msg.add_reaction(em) for em in self.remaining_emojis if em not in added])
 
-    async def _clear_add_reactions(self, msg:discord.Message):
-        await msg.clear_reactions()
-        for em in self.remaining_emojis:
-            await msg.add_reaction(em)
+    def _get_unplaced_player(self, emoji:str):
+        player = self.emoji_players.get(emoji)
+        if player is None or player not in self.unplaced_players:
+            return None
+        return player
 
     def choose_captains(self):
         if not self.testing:
@@ -161,6 +258,12 @@ class EmbeddedPicker:
 
         self.team_1.append(self.players[0])
         self.team_2.append(self.players[1])
+        self._assign_emojis()
+
+    def _assign_emojis(self):
+        # Each player keeps the same emoji for the whole draft
+        self.player_emojis: Dict[Player, str] = dict(zip(self.players[2:], self.all_emojis))
+        self.emoji_players: Dict[str, Player] = {v: k for k,v in self.player_emojis.items()}
 
     def _get_page(self, captain):
         description = 'The captains are picking their teams now'
@@ -185,13 +288,102 @@ class EmbeddedPicker:
     def _get_final_page(self):
         description = 'Head to your team chats once they are available'
         # footer = 'Good luck or something'
-        embed: discord.Embed = discord.Embed(title='Chosen Teams', description=description)
-        embed.add_field(
-            name='Team {c1}'.format(c1=self.team_1[0].display_name),
-            value=self.team_1_field_value,
-            inline=True)
-        embed.add_field(
-            name='Team {c2}'.format(c2=self.team_2[0].display_name),
-            value=self.team_2_field_value,
-            inline=True)
-        return embed
\ No newline at end of file
+        return get_teams_page('Chosen Teams', description, self.team_1, self.team_2)
+
+
+class EmbeddedBalancedTeams:
+    def __init__(self, players:List[Player], recent_teams:Iterable[FrozenSet[int]]=()):
+        self.players = players
+        self.team_1, self.team_2 = balance_teams(players, recent_teams)
+
+    async def send_message(self, channel:discord.TextChannel, bot:QueueBot):
+        await channel.send(embed=self._get_final_page())
+        return True
+
+    def _get_final_page(self):
+        description = 'Teams were balanced by rating. Head to your team chats once they are available'
+        return get_teams_page('Balanced Teams', description, self.team_1, self.team_2)
+
+
+class EmbeddedLeaderboard:
+    def __init__(self, leaderboard:Leaderboard, metric:str, game:typing.Union[str, None], author_id:int,
+                 page_size:int=10, timeout:int=120):
+        self.leaderboard = leaderboard
+        self.metric = metric
+        self.game = game
+        self.author_id = author_id
+        self.page_size = page_size
+        self.timeout = timeout
+        self.page_number = 0
+        self.previous_emoji = "◀️"
+        self.next_emoji = "▶️"
+
+    @property
+    def page_count(self):
+        return max(1, -(-len(self.leaderboard) // self.page_size))
+
+    async def send_message(self, ctx:commands.Context):
+        msg:discord.Message = await ctx.channel.send(embed=self._get_page())
+        if self.page_count < 2:
+            return
+        bot: QueueBot = ctx.bot
+        reactions = bot.reactions.register(msg.id)
+        updater = MessageUpdater(msg, delay=0.3, max_delay=1.0)
+        timeout = schedule_timeout(bot.timers, reactions, self.timeout)
+        try:
+            await asyncio.gather(msg.add_reaction(self.previous_emoji), msg.add_reaction(self.next_emoji))
+            while True:
+                payload = await reactions.get()
+                if isinstance(payload, WheelTimer):
+                    return
+                if payload.emoji.name == self.next_emoji:
+                    self.page_number = min(self.page_number + 1, self.page_count - 1)
+                elif payload.emoji.name == self.previous_emoji:
+                    self.page_number = max(self.page_number - 1, 0)
+                else:
+                    continue
+                updater.update(self._get_page())
+                # Leave the arrows ready to be pressed again
+                if payload.member is not None:
+                    bot.loop.create_task(msg.remove_reaction(payload.emoji, payload.member))
+        finally:
+            timeout.cancel()
+            bot.reactions.unregister(msg.id)
+            await updater.flush()
+
+    def _get_page(self):
+        start = self.page_number * self.page_size
+        players = self.leaderboard.get_top(self.metric, start, self.page_size)
+        lines = ["{r}. {p} - {v}".format(r=start + i + 1, p=p.display_name, v=format_metric(self.metric, p))
+                 for i, p in enumerate(players)]
+        title = 'Leaderboard - {m}'.format(m=self.metric) if self.game is None else \
+            '{g} Leaderboard - {m}'.format(g=self.game, m=self.metric)
+        embed:discord.Embed = discord.Embed(title=title, description='\n'.join(lines) or 'No players yet')
+        rank = self.leaderboard.get_rank(self.metric, self.author_id)
+        footer = 'Page {n} of {t}'.format(n=self.page_number + 1, t=self.page_count)
+        if rank is not None:
+            footer += ' | Your rank: {r}'.format(r=rank)
+        embed.set_footer(text=footer)
+        return embed
+
+
+def format_metric(metric:str, player:Player) -> str:
+    value = LEADERBOARD_METRICS[metric](player)
+    if metric == 'winrate':
+        return '{v:.0%} ({w}-{l})'.format(v=value, w=player.total_wins, l=player.total_losses)
+    if metric == 'rating':
+        return '{v:.0f}'.format(v=value)
+    return str(value)
+
+
+def get_teams_page(title:str, description:str, team_1:List[Player], team_2:List[Player]) -> discord.Embed:
+    embed: discord.Embed = discord.Embed(title=title, description=description)
+    embed.add_field(
+        name='Team {c1}'.format(c1=team_1[0].display_name),
+        value='\n'.join([x.display_name for x in team_1]),
+        inline=True)
+    embed.add_field(
+        name='Team {c2}'.format(c2=team_2[0].display_name),
+        value='\n'.join([x.display_name for x in team_2]),
+        inline=True)
+    return embed
@@ -0,0 +1,217 @@
+import asyncio
+import gc
+import random
+import threading
+import typing
+from typing import Callable, Dict, List, Tuple
+
+from src.player import Player
+
+# Indexable skip list: every link also stores how many entries it jumps over, so finding an entry's rank or
+# the entry at a rank costs O(log n) expected, the same as an insert or a removal.
+_MAX_LEVELS = 32
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, levels:int):
+        self.key = key
+        self.next: List[typing.Union['_Node', None]] = [None] * levels
+        self.width: List[int] = [1] * levels
+
+
+class RankIndex:
+    def __init__(self):
+        self._head = _Node(None, _MAX_LEVELS)
+        self._levels = 1
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @classmethod
+    def from_sorted(cls, keys:list) -> 'RankIndex':
+        # Bulk build in O(n): every 2^l-th entry is linked on level l, which is the shape random levels aim for
+        index = cls()
+        size = len(keys)
+        levels = 1
+        while levels < _MAX_LEVELS and (1 << levels) <= size:
+            levels += 1
+        last = [index._head] * levels
+        last_position = [0] * levels
+        for position, key in enumerate(keys, 1):
+            node_levels = 1
+            while node_levels < levels and position % (1 << node_levels) == 0:
+                node_levels += 1
+            node = _Node(key, node_levels)
+            for level in range(node_levels):
+                last[level].next[level] = node
+                last[level].width[level] = position - last_position[level]
+                last[level] = node
+                last_position[level] = position
+        for level in range(levels):
+            last[level].width[level] = size + 1 - last_position[level]
+        index._levels = levels
+        index._size = size
+        return index
+
+    @staticmethod
+    def _random_levels() -> int:
+        levels = 1
+        while levels < _MAX_LEVELS and random.random() < 0.5:
+            levels += 1
+        return levels
+
+    def insert(self, key):
+        levels = self._random_levels()
+        if levels > self._levels:
+            for level in range(self._levels, levels):
+                self._head.width[level] = self._size + 1
+            self._levels = levels
+        update = [self._head] * self._levels
+        steps = [0] * self._levels
+        node = self._head
+        position = 0
+        for level in range(self._levels - 1, -1, -1):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+            update[level] = node
+            steps[level] = position
+        new_node = _Node(key, levels)
+        for level in range(self._levels):
+            prev = update[level]
+            if level < levels:
+                new_node.next[level] = prev.next[level]
+                prev.next[level] = new_node
+                # The new node sits position - steps[level] + 1 entries after prev on this level
+                new_node.width[level] = prev.width[level] - (position - steps[level])
+                prev.width[level] = position - steps[level] + 1
+            else:
+                prev.width[level] += 1
+        self._size += 1
+
+    def remove(self, key) -> bool:
+        update = [self._head] * self._levels
+        node = self._head
+        for level in range(self._levels - 1, -1, -1):
+            while node.next[level] is not None and node.next[level].key < key:
+                node = node.next[level]
+            update[level] = node
+        target = node.next[0]
+        if target is None or target.key != key:
+            return False
+        for level in range(self._levels):
+            prev = update[level]
+            if prev.next[level] is target:
+                prev.width[level] += target.width[level] - 1
+                prev.next[level] = target.next[level]
+            else:
+                prev.width[level] -= 1
+        self._size -= 1
+        return True
+
+    def rank(self, key) -> typing.Union[int, None]:
+        # Zero based position of key
+        node = self._head
+        position = 0
+        for level in range(self._levels - 1, -1, -1):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        node = node.next[0]
+        if node is None or node.key != key:
+            return None
+        return position
+
+    def slice(self, start:int, count:int) -> list:
+        # Walk down to the entry at `start` in O(log n) and read forward from there
+        if start >= self._size or count <= 0:
+            return []
+        node = self._head
+        remaining = start + 1
+        for level in range(self._levels - 1, -1, -1):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        keys = []
+        while node is not None and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+def _win_rate(p:Player) -> float:
+    return p.total_wins / p.matches_played if p.matches_played > 0 else 0.0
+
+
+LEADERBOARD_METRICS: Dict[str, Callable[[Player], float]] = {
+    'wins': lambda p: p.total_wins,
+    'winrate': _win_rate,
+    'streak': lambda p: p.win_streak,
+    'rating': lambda p: p.rating,
+}
+
+
+class Leaderboard:
+    # One rank index per metric for a single guild/game. Keys sort best first, ties broken by discord id.
+    def __init__(self, players:typing.Iterable[Player]=()):
+        self._players: Dict[int, Player] = {p.discord_id: p for p in players if p.discord_id is not None}
+        # metric -> discord id -> key, one flat dict per metric rather than one small dict per player
+        self._keys: Dict[str, Dict[int, Tuple[float, int]]] = {
+            m: {d: (-f(p), d) for d, p in self._players.items()} for m, f in LEADERBOARD_METRICS.items()}
+        self._indexes: Dict[str, RankIndex] = {
+            m: RankIndex.from_sorted(sorted(keys.values())) for m, keys in self._keys.items()}
+
+    def update(self, player:Player):
+        if player.discord_id is None:
+            return
+        for metric, f in LEADERBOARD_METRICS.items():
+            keys = self._keys[metric]
+            old_key = keys.get(player.discord_id)
+            new_key = (-f(player), player.discord_id)
+            if old_key == new_key:
+                continue
+            if old_key is not None:
+                self._indexes[metric].remove(old_key)
+            self._indexes[metric].insert(new_key)
+            keys[player.discord_id] = new_key
+        self._players[player.discord_id] = player
+
+    def get_top(self, metric:str, start:int=0, count:int=10) -> List[Player]:
+        return [self._players[k[1]] for k in self._indexes[metric].slice(start, count)]
+
+    def get_rank(self, metric:str, discord_id:int) -> typing.Union[int, None]:
+        key = self._keys[metric].get(discord_id)
+        if key is None:
+            return None
+        return self._indexes[metric].rank(key) + 1
+
+    def __len__(self):
+        return len(self._players)
+
+
+# The collector is process wide, so builds take turns: each one finds it in the state the last one left it
+_bulk_build_lock = threading.Lock()
+
+
+def build_leaderboard_off_loop(players:typing.Iterable[Player]) -> Leaderboard:
+    # For an executor thread only. A large guild allocates millions of keys and nodes, none of which can form a
+    # cycle, and left running the collector would scan them over and over while they pile up, about two thirds of
+    # the build at a million players. It is paused for the whole process while the build runs, the event loop
+    # included, which only defers its collections by the length of the build
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        raise RuntimeError("build_leaderboard_off_loop would pause the collector under a running event loop")
+    with _bulk_build_lock:
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            return Leaderboard(players)
+        finally:
+            if collecting:
+                gc.enable()
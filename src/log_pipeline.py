@@ -0,0 +1,89 @@
+import collections
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import typing
+
+# Records leave the event loop through a QueueHandler. Formatting and file writes happen on the
+# QueueListener's thread, so a slow disk never holds up a command.
+
+# Set on a record by whichever QueueIdentifier it mentions, or passed directly through extra=
+QUEUE_FIELDS = ('guild_id', 'channel_id', 'lobby', 'game')
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record:logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in QUEUE_FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class DebugSampler(logging.Filter):
+    # Keeps the first of every `rate` DEBUG records per call site, everything at INFO and above goes through
+    def __init__(self, rate:int):
+        super().__init__()
+        self.rate = max(1, rate)
+        self._seen: typing.Counter[typing.Tuple[str, int]] = collections.Counter()
+        self._lock = threading.Lock()
+
+    def filter(self, record:logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate == 1:
+            return True
+        site = (record.pathname, record.lineno)
+        with self._lock:
+            seen = self._seen[site]
+            self._seen[site] = seen + 1
+        return seen % self.rate == 0
+
+
+class _LoopQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record:logging.LogRecord) -> logging.LogRecord:
+        # Only the message text is rendered on the caller's thread, while its arguments are still as logged.
+        # Unlike the stock prepare, exc_info is kept for the listener to format: nothing here is pickled.
+        record = copy.copy(record)
+        args = record.args if isinstance(record.args, tuple) else ()
+        for arg in args:
+            fields = getattr(arg, 'log_fields', None)
+            if fields is not None:
+                for k, v in fields.items():
+                    if not hasattr(record, k):
+                        setattr(record, k, v)
+                break
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def start_logging(path:str, level:str='INFO', max_bytes:int=10 * 1024 * 1024, backups:int=5,
+                  debug_sample_rate:int=100) -> logging.handlers.QueueListener:
+    file_handler = logging.handlers.RotatingFileHandler(path, mode='a', maxBytes=max_bytes, backupCount=backups,
+                                                        encoding='utf-8', delay=True)
+    file_handler.setFormatter(JsonFormatter())
+    console = logging.StreamHandler()
+    console.setLevel(logging.INFO)
+    console.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    handler = _LoopQueueHandler(records)
+    handler.addFilter(DebugSampler(debug_sample_rate))
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    root.addHandler(handler)
+
+    listener = logging.handlers.QueueListener(records, file_handler, console, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,167 @@
+import asyncio
+import itertools
+import logging
+import sqlite3
+import time
+import typing
+from concurrent.futures import Executor
+from typing import AsyncIterator, List
+
+from src.player import Player
+from src.ratings import EloRatings
+
+log = logging.getLogger(__name__)
+
+# Matches are only ever inserted. Rows of one guild/game sit together under the segment index, and every
+# participant gets a row keyed by player first, so per-player queries never touch anyone else's matches.
+_CREATE_MATCHES = """
+CREATE TABLE IF NOT EXISTS matches (
+    match_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id INTEGER NOT NULL,
+    game TEXT NOT NULL DEFAULT '',
+    played_at REAL NOT NULL,
+    winning_team INTEGER NOT NULL
+)
+"""
+_CREATE_SEGMENT_INDEX = "CREATE INDEX IF NOT EXISTS matches_by_segment ON matches (guild_id, game, match_id)"
+_CREATE_MATCH_PLAYERS = """
+CREATE TABLE IF NOT EXISTS match_players (
+    discord_id INTEGER NOT NULL,
+    guild_id INTEGER NOT NULL,
+    game TEXT NOT NULL DEFAULT '',
+    match_id INTEGER NOT NULL,
+    team INTEGER NOT NULL,
+    won INTEGER NOT NULL,
+    PRIMARY KEY (discord_id, guild_id, game, match_id)
+) WITHOUT ROWID
+"""
+_CREATE_MATCH_INDEX = "CREATE INDEX IF NOT EXISTS match_players_by_match ON match_players (match_id)"
+
+
+class MatchRecord:
+    __slots__ = ('match_id', 'played_at', 'team', 'won', 'teammates', 'opponents')
+
+    def __init__(self, match_id:int, played_at:float, team:int, won:bool):
+        self.match_id = match_id
+        self.played_at = played_at
+        self.team = team
+        self.won = won
+        self.teammates: List[int] = []
+        self.opponents: List[int] = []
+
+
+class PendingMatch(typing.NamedTuple):
+    guild_id: int
+    game: str
+    # (discord id, team) for everyone on either team
+    players: List[typing.Tuple[int, int]]
+    winning_team: int
+    played_at: float
+
+
+class MatchHistory:
+    def __init__(self, conn:sqlite3.Connection, executor:Executor):
+        self._conn = conn
+        self.executor = executor
+        conn.execute(_CREATE_MATCHES)
+        conn.execute(_CREATE_SEGMENT_INDEX)
+        conn.execute(_CREATE_MATCH_PLAYERS)
+        conn.execute(_CREATE_MATCH_INDEX)
+        conn.commit()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, func, *args)
+
+    # Writing
+    @staticmethod
+    def new_match(guild_id:int, game:typing.Union[str, None], team_1:List[Player], team_2:List[Player], winning_team:int) -> PendingMatch:
+        players = [(p.discord_id, 1) for p in team_1 if p.discord_id is not None] + \
+                  [(p.discord_id, 2) for p in team_2 if p.discord_id is not None]
+        return PendingMatch(guild_id, game or '', players, winning_team, time.time())
+
+    def write(self, matches:List[PendingMatch]):
+        # Leaves the transaction open, the players whose stats a match changed are committed with it
+        for m in matches:
+            cursor = self._conn.execute(
+                "INSERT INTO matches (guild_id, game, played_at, winning_team) VALUES (?, ?, ?, ?)",
+                (m.guild_id, m.game, m.played_at, m.winning_team))
+            match_id = cursor.lastrowid
+            self._conn.executemany(
+                "INSERT INTO match_players (discord_id, guild_id, game, match_id, team, won) VALUES (?, ?, ?, ?, ?, ?)",
+                [(d, m.guild_id, m.game, match_id, team, int(team == m.winning_team)) for d, team in m.players])
+
+    # Queries
+    async def get_player_history(self, discord_id:int, guild_id:int, game:typing.Union[str, None],
+                                 before_match_id:int=None, page_size:int=10) -> List[MatchRecord]:
+        return await self._run(self._get_player_history, discord_id, guild_id, game or '', before_match_id, page_size)
+
+    def _get_player_history(self, discord_id:int, guild_id:int, game:str, before_match_id, page_size:int) -> List[MatchRecord]:
+        # Keyset paging on match_id walks straight down the player's own index entries
+        rows = self._conn.execute(
+            "SELECT mp.match_id, m.played_at, mp.team, mp.won FROM match_players mp "
+            "JOIN matches m ON m.match_id = mp.match_id "
+            "WHERE mp.discord_id = ? AND mp.guild_id = ? AND mp.game = ? AND mp.match_id < ? "
+            "ORDER BY mp.match_id DESC LIMIT ?",
+            (discord_id, guild_id, game, before_match_id if before_match_id is not None else 2 ** 62, page_size)).fetchall()
+        records = [MatchRecord(r['match_id'], r['played_at'], r['team'], bool(r['won'])) for r in rows]
+        by_id = {r.match_id: r for r in records}
+        if by_id:
+            others = self._conn.execute(
+                "SELECT match_id, discord_id, team FROM match_players WHERE match_id IN ({ids}) AND discord_id != ?".format(
+                    ids=','.join('?' * len(by_id))),
+                (*by_id.keys(), discord_id))
+            for r in others:
+                record = by_id[r['match_id']]
+                (record.teammates if r['team'] == record.team else record.opponents).append(r['discord_id'])
+        return records
+
+    async def iter_player_history(self, discord_id:int, guild_id:int, game:typing.Union[str, None],
+                                  page_size:int=50) -> AsyncIterator[MatchRecord]:
+        before = None
+        while True:
+            page = await self.get_player_history(discord_id, guild_id, game, before, page_size)
+            for record in page:
+                yield record
+            if len(page) < page_size:
+                return
+            before = page[-1].match_id
+
+    async def get_recent_form(self, discord_id:int, guild_id:int, game:typing.Union[str, None], matches:int=5) -> str:
+        page = await self.get_player_history(discord_id, guild_id, game, page_size=matches)
+        return ''.join('W' if r.won else 'L' for r in page)
+
+    async def get_head_to_head(self, discord_id:int, other_id:int, guild_id:int, game:typing.Union[str, None]) -> typing.Tuple[int, int]:
+        return await self._run(self._get_head_to_head, discord_id, other_id, guild_id, game or '')
+
+    def _get_head_to_head(self, discord_id:int, other_id:int, guild_id:int, game:str) -> typing.Tuple[int, int]:
+        row = self._conn.execute(
+            "SELECT COALESCE(SUM(a.won), 0) AS wins, COUNT(*) - COALESCE(SUM(a.won), 0) AS losses "
+            "FROM match_players a JOIN match_players b "
+            "ON b.discord_id = ? AND b.guild_id = a.guild_id AND b.game = a.game AND b.match_id = a.match_id "
+            "WHERE a.discord_id = ? AND a.guild_id = ? AND a.game = ? AND a.team != b.team",
+            (other_id, discord_id, guild_id, game)).fetchone()
+        return row['wins'], row['losses']
+
+    async def replay_ratings(self, ratings:EloRatings, guild_id:int, game:typing.Union[str, None]) -> typing.Dict[int, float]:
+        return await self._run(lambda: ratings.replay(self._iter_results(guild_id, game or '')))
+
+    def _iter_results(self, guild_id:int, game:str) -> typing.Iterator[typing.Tuple[List[int], List[int]]]:
+        # Oldest first, one (winners, losers) pair per match
+        rows = self._conn.execute(
+            "SELECT mp.match_id, mp.discord_id, mp.won FROM matches m JOIN match_players mp ON mp.match_id = m.match_id "
+            "WHERE m.guild_id = ? AND m.game = ? ORDER BY m.match_id",
+            (guild_id, game))
+        for _, players in itertools.groupby(rows, key=lambda r: r[0]):
+            winners, losers = [], []
+            for r in players:
+                (winners if r[2] else losers).append(r[1])
+            yield winners, losers
+
+    # Upkeep
+    async def compact(self):
+        await self._run(self._compact)
+
+    def _compact(self):
+        # Fold the WAL back into the main file and refresh planner statistics for the indexes
+        self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._conn.execute("PRAGMA optimize")
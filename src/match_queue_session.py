@@ -1,64 +1,151 @@
+import asyncio
+import enum
 import logging
 import typing
 import discord
 from discord.ext import commands
-from typing import List, Tuple
+from typing import List
 
+from src.constants import ROLL_CALL_TIMEOUT, PICK_TURN_TIMEOUT, KICK_VOTE_TIMEOUT
 from src.player import Player
-from src.embeds import EmbeddedRollCall, EmbeddedPicker
+from src.queue_bot import QueueBot
+from src.embeds import EmbeddedRollCall, EmbeddedPicker, EmbeddedBalancedTeams
+from src.message_utils import MessageUpdater
+from src.timer_wheel import TimerWheel, WheelTimer
+from src.voice_pool import VoiceChannelPool
 
 log = logging.getLogger(__name__)
 
+class LobbyState(enum.Enum):
+    OPEN = 'open'
+    ROLL_CALL = 'roll call'
+    PICKING = 'picking'
+    WAITING_FOR_PLAYERS = 'waiting for players'
+    READY = 'ready'
+    FINISHED = 'finished'
+    CANCELLED = 'cancelled'
+
 class QueueProgress:
     def __init__(self):
         self.empty = True
         self.filled = False
-        self.vote_in_progress = False
-        self.vote_complete = False
-        self.ready_to_start = False
+        self.state = LobbyState.OPEN
         self.errored = False
 
+    def advance(self, state:LobbyState, *from_states:LobbyState) -> bool:
+        # A transition only happens from the listed states, so a repeated or late call leaves the lobby alone
+        if self.state not in from_states:
+            return False
+        self.state = state
+        return True
+
+    @property
+    def vote_in_progress(self):
+        return self.state in (LobbyState.ROLL_CALL, LobbyState.PICKING)
+
+    @property
+    def vote_complete(self):
+        return self.state in (LobbyState.WAITING_FOR_PLAYERS, LobbyState.READY, LobbyState.FINISHED)
+
+    @property
+    def ready_to_start(self):
+        return self.state == LobbyState.READY
+
 class QueueIdentifier:
     def __init__(self, **kwargs):
         assert 'ctx' in kwargs or ('guild_id' in kwargs and 'channel_id' in kwargs)
         ctx:commands.Context = kwargs.get('ctx', None)
-        guild_id:int = kwargs.get('guild_id', ctx.guild.id)
-        channel_id:int = kwargs.get('channel_id', ctx.channel.id)
+        guild_id:int = kwargs['guild_id'] if 'guild_id' in kwargs else ctx.guild.id
+        channel_id:int = kwargs['channel_id'] if 'channel_id' in kwargs else ctx.channel.id
         self.game = kwargs.get('game', None)
         self.guild_id = guild_id
         self.channel_id = channel_id
+        # 0 is the channel's matchmaker itself, every lobby it forms gets the next number
+        self.lobby:int = kwargs.get('lobby', 0)
 
     def __hash__(self):
-        return hash((self.channel_id, self.guild_id, self.game))
+        return hash((self.channel_id, self.guild_id, self.game, self.lobby))
 
     def __eq__(self, other):
-        return (self.channel_id, self.guild_id, self.game) == (other.channel_id, other.guild_id, self.game)
+        if not isinstance(other, QueueIdentifier):
+            return NotImplemented
+        return (self.channel_id, self.guild_id, self.game, self.lobby) == (other.channel_id, other.guild_id, other.game, other.lobby)
 
     def __ne__(self, other):
         return not(self == other)
 
+    @property
+    def log_fields(self) -> dict:
+        # Picked up by the log pipeline whenever a QueueIdentifier is one of a record's arguments
+        return {'guild_id': self.guild_id, 'channel_id': self.channel_id, 'lobby': self.lobby, 'game': self.game}
+
     def __str__(self):
-        return '{gid} - {cid} - {g}'.format(gid=self.guild_id, cid=self.channel_id, g=self.game)
+        return '{gid} - {cid} - {g} - {l}'.format(gid=self.guild_id, cid=self.channel_id, g=self.game, l=self.lobby)
 
 class KickVote:
-    def __init__(self, player):
+    def __init__(self, player:Player, voter_id:int):
+        # Compared as a Player, which covers the discord id and also tells apart the id-less fakes used in testing
         self.target = player
-        self.vote_count = 1
+        self.voters: typing.Set[int] = {voter_id}
+        self.expiry: typing.Union[WheelTimer, None] = None
 
     @property
     def accepted(self):
-        return self.vote_count > 1
-
-class MatchQueue:
+        return len(self.voters) > 1
+
+class KickVoting:
+    # Shared by a matchmaker and the lobbies it forms: one vote at a time, dropped after KICK_VOTE_TIMEOUT
+    kick_vote: typing.Union[KickVote, None] = None
+
+    def start_kick_vote(self, player:Player, voter_id:int, timers:TimerWheel) -> KickVote:
+        vote = KickVote(player, voter_id)
+        vote.expiry = timers.call_later(KICK_VOTE_TIMEOUT, lambda: self.end_kick_vote(vote))
+        self.kick_vote = vote
+        return vote
+
+    def vote_to_kick(self, player:Player, voter_id:int, timers:TimerWheel) -> typing.Tuple[bool, str]:
+        # True only when a second, different person names the player the open vote is about. Repeats change nothing
+        vote = self.kick_vote
+        if vote is None:
+            self.start_kick_vote(player, voter_id, timers)
+            return False, 'Vote has been initiated to kick {p}. One more player is needed to complete the kick'.format(p=player.display_name)
+        if vote.target != player:
+            return False, 'There is already a vote to kick {t}. Wait for it to finish before starting another'.format(t=vote.target.display_name)
+        if voter_id in vote.voters:
+            return False, 'You already voted to kick {p}. Someone else has to second it'.format(p=player.display_name)
+        vote.voters.add(voter_id)
+        self.end_kick_vote(vote)
+        return True, ''
+
+    def end_kick_vote(self, vote:KickVote):
+        if vote.expiry is not None:
+            vote.expiry.cancel()
+        if self.kick_vote is vote:
+            self.kick_vote = None
+
+class ResultReport:
+    def __init__(self, winning_team:int, captain_id:int):
+        self.winning_team = winning_team
+        self.confirmed_by = {captain_id}
+
+class MatchQueue(KickVoting):
     def __init__(self,
                  ctx:commands.Context=None,
                  team_size:int=4,
-                 game:typing.Union[str, None]=None):
-        self.queue_id:QueueIdentifier = QueueIdentifier(ctx=ctx)
+                 game:typing.Union[str, None]=None,
+                 guild_id:int=None,
+                 channel_id:int=None,
+                 balanced:bool=False,
+                 lobby:int=0):
+        if ctx is not None:
+            self.queue_id:QueueIdentifier = QueueIdentifier(ctx=ctx, lobby=lobby)
+        else:
+            self.queue_id:QueueIdentifier = QueueIdentifier(guild_id=guild_id, channel_id=channel_id, lobby=lobby)
 
         self.game:typing.Union[str, None] = game
         self.team_size:int = team_size
-        self.queue_category: typing.Union[discord.CategoryChannel, None] = None
+        # Balanced queues skip the captain draft and split teams by rating
+        self.balanced:bool = balanced
         self.team_1_vc: typing.Union[discord.VoiceChannel, None] = None
         self.team_2_vc: typing.Union[discord.VoiceChannel, None] = None
         self.voting_channel: typing.Union[discord.TextChannel, None] = None
@@ -67,9 +154,44 @@ class MatchQueue:
         self.team_2: List[Player] = []
 
         self.progress = QueueProgress()
+        # Held by anything that checks the lobby, awaits, then changes it
+        self.lock = asyncio.Lock()
         self.kick_vote = None
+        self.result_report: typing.Union[ResultReport, None] = None
+        # Roll call, picking and voice setup run here once the queue fills, never inside a command
+        self.lobby_task: typing.Union[asyncio.Task, None] = None
+        # The roll call and draft this lobby is running, kept so a snapshot can record how far they got
+        self.rollcall: typing.Union[EmbeddedRollCall, None] = None
+        self.picker: typing.Union[EmbeddedPicker, None] = None
+        # Players sitting in their own team chat, shown on one live status message
+        self.arrived: typing.Set[int] = set()
+        self.voice_status: typing.Union[MessageUpdater, None] = None
 
 
+    @property
+    def captain_ids(self) -> typing.Tuple[int, int]:
+        return self.team_1[0].discord_id, self.team_2[0].discord_id
+
+    def report_result(self, captain_id:int, winning_team:int) -> typing.Tuple[bool, str]:
+        # Returns True exactly once per match: when the second captain confirms the first one's report
+        if self.progress.state == LobbyState.FINISHED:
+            return False, "The result of this match has already been recorded"
+        if not self.progress.vote_complete:
+            return False, "Teams have to be chosen before a result can be reported"
+        if winning_team not in (1, 2):
+            return False, "The winning team has to be 1 or 2"
+        if captain_id not in self.captain_ids:
+            return False, "Only the team captains can report the result"
+        if self.result_report is None or self.result_report.winning_team != winning_team:
+            self.result_report = ResultReport(winning_team, captain_id)
+        else:
+            self.result_report.confirmed_by.add(captain_id)
+        if len(self.result_report.confirmed_by) < 2:
+            return False, "Team {t} reported as the winner. The other captain needs to confirm with the same result".format(t=winning_team)
+        if not self.progress.advance(LobbyState.FINISHED, LobbyState.WAITING_FOR_PLAYERS, LobbyState.READY):
+            return False, "The result of this match has already been recorded"
+        return True, "Result recorded, team {t} wins! GG".format(t=winning_team)
+
     def is_player_queued(self, player_id:str) -> bool:
         return any([x.discord_id == player_id for x in self.players])
 
@@ -77,35 +199,6 @@ class MatchQueue:
     async def add_dummy_players(self, number=4):
         self.players.extend([Player(discord_name='Dummy Player {n}'.format(n=n)) for n in range(number)])
 
-    # queue building
-    def _get_added_to_queue_msg(self, author_name) -> str:
-        ppl = "people" if len(self.players) != 1 else "person"
-        if self.game is not None:
-            msg = "{p} Added to {g} Queue! {n} {ppl} so far!".format(p=author_name,
-                                                                     g=self.game,
-                                                                     n=len(self.players),
-                                                                     ppl=ppl)
-        else:
-            msg = "{p} Added to Queue! {n} {ppl} so far!".format(p=author_name,
-                                                                 n=len(self.players),
-                                                                 ppl=ppl)
-        return msg
-
-    def _get_remove_from_queue_msg(self, author_name) -> str:
-        if self.game is not None:
-            msg = '{p} has left the {g} queue. {n} remain'.format(p=author_name, g=self.game, n=len(self.players))
-        else:
-            msg = '{p} has left the queue. {n} remain'.format(p=author_name,n=len(self.players))
-        return msg
-
-    @staticmethod
-    def _get_category_name() -> str:
-        return "Custom Games"
-        # if self.game is not None:
-        #     return "{g} Customs".format(g=self.game)
-        # else:
-        #     return "Custom Games"
-
     def add_player(self, player:Player):
         self.progress.empty = False
         self.players.append(player)
@@ -117,114 +210,181 @@ class MatchQueue:
         self.progress.empty = len(self.players) == 0
         self.progress.filled = len(self.players) == self.team_size * 2
 
-    async def try_add_player(self, ctx:commands.Context, player:Player) -> Tuple[bool, typing.Union[str]]:
-        if self.progress.filled:
-            return True, "This queue has been filled. I'm a baby bot, so I can't just make a new one all willy-nilly yet."
-        if any([ctx.author.id == p.discord_id for p in self.players]):
-            return False, "Hold your horses, you already joined the conga line"
-        self.add_player(player)
-        if self.progress.filled:
-            return True, "Queue has been filled! Roll call will start soon!"
-        return False, self._get_added_to_queue_msg(ctx.author.display_name)
-
-    async def try_add_fake(self, player:Player):
-        if self.progress.filled:
-            return True, "This queue has been filled. I'm a baby bot, so I can't just make a new one all willy-nilly yet."
-        if any([player.discord_name == p.discord_name for p in self.players]):
-            return False, "Hold your horses, you already joined the conga line"
-        self.add_player(player)
-        if self.progress.filled:
-            return True, "Queue has been filled! Roll call will start soon!"
-        return False, self._get_added_to_queue_msg(player.display_name)
-
-    async def try_remove_player(self, ctx:commands.Context, player:Player) -> Tuple[bool, typing.Union[str]]:
-        if self.progress.filled:
-            msg = 'Its too late, the queue filled. You messed up. Okay, mistakes happen... Just finish the voting and reset the queue because this situation is too complicated for me.'
-            return False, msg
-        if not any([x.discord_id == ctx.author.id for x in self.players]):
-            msg = "LMAO YOU ARE TRYING TO QUIT AND YOU NEVER EVEN STARTED"
-            return False, msg
-        self.remove_player(player)
-        return True, self._get_remove_from_queue_msg(ctx.author.display_name)
-
-    async def do_roll_call_and_pick_teams(self, ctx:commands.Context, testing=False):
-        self.voting_channel = ctx.channel
-        rollcall:EmbeddedRollCall = EmbeddedRollCall(self.players, timeout=300, testing=testing)
-        log.info("Starting rollcall")
-        self.progress.vote_in_progress = await rollcall.send_message(ctx)
-        if self.progress.vote_in_progress:
-            log.info("Rollcall successfully completed")
-            pick_team:EmbeddedPicker = EmbeddedPicker(self.players, timeout=300, testing=testing)
-            log.info("Starting team picking")
-            self.progress.vote_complete = await pick_team.send_message(ctx)
-            if self.progress.vote_complete:
-                self.team_1 = pick_team.team_1
-                self.team_2 = pick_team.team_2
-                log.info("Teams successfully chosen")
-            return self.progress.vote_complete
-        return self.progress.vote_in_progress
-
-        # self.queue_category = await ctx.guild.create_category(self._get_category_name())
-
-    def get_roll_call_message(self) -> discord.Embed:
-        player_list = '\n'.join([x.display_name for x in self.players])
-
-        if self.game is not None:
-            title = "{n} out of {n2} players so far for {g}".format(
-                n=len(self.players),
-                n2=self.team_size * 2,
-                g=self.game)
+    def start_lobby(self, coro:typing.Coroutine) -> asyncio.Task:
+        if self.lobby_task is not None:
+            coro.close()
+            return self.lobby_task
+        self.lobby_task = asyncio.get_event_loop().create_task(coro)
+        return self.lobby_task
+
+    def cancel_lobby(self):
+        if self.kick_vote is not None:
+            self.end_kick_vote(self.kick_vote)
+        if self.lobby_task is not None and not self.lobby_task.done() and self.lobby_task is not asyncio.current_task():
+            self.lobby_task.cancel()
+        self.progress.state = LobbyState.CANCELLED
+        if self.voice_status is not None:
+            self.voice_status.cancel()
+
+    async def do_roll_call_and_pick_teams(self, channel:discord.TextChannel, bot:QueueBot, voice_pool:VoiceChannelPool, testing=False,
+                                          recent_teams:typing.Iterable[typing.FrozenSet[int]]=()):
+        self.voting_channel = channel
+        # A lobby restored in the middle of its draft comes back in ROLL_CALL and goes straight to picking
+        if self.progress.state == LobbyState.OPEN:
+            if self.rollcall is None:
+                self.rollcall = EmbeddedRollCall(self.players, timeout=ROLL_CALL_TIMEOUT, testing=testing)
+            log.info("Starting rollcall for %s", self.queue_id)
+            if not self.progress.advance(LobbyState.ROLL_CALL, LobbyState.OPEN):
+                return False
+            if not await self.rollcall.send_message(channel, bot):
+                self.progress.advance(LobbyState.CANCELLED, LobbyState.ROLL_CALL)
+                return False
+            log.info("Rollcall successfully completed for %s", self.queue_id)
+        if self.balanced:
+            pick_team = EmbeddedBalancedTeams(self.players, recent_teams)
         else:
-            title = "{n} out of {n2} players so far".format(
-                n=len(self.players),
-                n2=self.team_size * 2)
-
-        return discord.Embed(title=title, description=player_list)
+            if self.picker is None:
+                self.picker = EmbeddedPicker(self.players, timeout=PICK_TURN_TIMEOUT, testing=testing)
+            pick_team = self.picker
+        log.info("Starting team picking for %s", self.queue_id)
+        if not self.progress.advance(LobbyState.PICKING, LobbyState.ROLL_CALL):
+            return False
+        if not await pick_team.send_message(channel, bot):
+            self.progress.advance(LobbyState.CANCELLED, LobbyState.PICKING)
+            return False
+        self.team_1 = pick_team.team_1
+        self.team_2 = pick_team.team_2
+        log.info("Teams successfully chosen for %s", self.queue_id)
+        await self.add_voice_channels(voice_pool)
+        if not self.progress.advance(LobbyState.WAITING_FOR_PLAYERS, LobbyState.PICKING):
+            return False
+        self.voice_status = MessageUpdater(await channel.send(embed=self.get_voice_status_page()))
+        return True
+
+    # Snapshots
+    def snapshot_stamp(self) -> tuple:
+        # Changes whenever to_snapshot would, without building it. Picks and roll call answers only ever add up
+        teams = self.picker if self.picker is not None else self
+        return (
+            self.progress.state, len(self.players), len(teams.team_1), len(teams.team_2),
+            len(self.rollcall.present_players) if self.rollcall is not None else 0,
+            self.rollcall.message_id if self.rollcall is not None else None,
+            self.picker.message_id if self.picker is not None else None,
+            self.team_1_vc, self.team_2_vc, self.voice_status,
+            (self.result_report.winning_team, len(self.result_report.confirmed_by)) if self.result_report is not None else None,
+        )
+
+    def to_snapshot(self) -> dict:
+        # Players are stored once, everything else points into that list by position
+        team_1, team_2 = (self.picker.team_1, self.picker.team_2) if self.picker is not None else (self.team_1, self.team_2)
+        return {
+            'guild_id': self.queue_id.guild_id,
+            'channel_id': self.queue_id.channel_id,
+            'lobby': self.queue_id.lobby,
+            'team_size': self.team_size,
+            'game': self.game,
+            'balanced': self.balanced,
+            'state': self.progress.state.value,
+            'players': [[p.discord_id, p.discord_name, p.display_name] for p in self.players],
+            'team_1': [self.players.index(p) for p in team_1],
+            'team_2': [self.players.index(p) for p in team_2],
+            'present': [self.players.index(p) for p in self.rollcall.present_players] if self.rollcall is not None else [],
+            'roll_call_message_id': self.rollcall.message_id if self.rollcall is not None else None,
+            'pick_message_id': self.picker.message_id if self.picker is not None else None,
+            'team_1_vc': self.team_1_vc.id if self.team_1_vc is not None else None,
+            'team_2_vc': self.team_2_vc.id if self.team_2_vc is not None else None,
+            'voice_status_message_id': self.voice_status.message.id if self.voice_status is not None else None,
+            'result': [self.result_report.winning_team, sorted(self.result_report.confirmed_by)]
+                      if self.result_report is not None else None,
+        }
+
+    def restore_snapshot(self, snapshot:dict, testing=False):
+        # Puts back everything but the discord objects, which the caller reconciles against the guild
+        self.team_1 = [self.players[i] for i in snapshot['team_1']]
+        self.team_2 = [self.players[i] for i in snapshot['team_2']]
+        if snapshot['result'] is not None:
+            self.result_report = ResultReport(snapshot['result'][0], snapshot['result'][1][0])
+            self.result_report.confirmed_by.update(snapshot['result'][1])
+        state = LobbyState(snapshot['state'])
+        if state in (LobbyState.OPEN, LobbyState.ROLL_CALL):
+            self.rollcall = EmbeddedRollCall(
+                self.players, timeout=ROLL_CALL_TIMEOUT, testing=testing,
+                present=[self.players[i] for i in snapshot['present']],
+                message_id=snapshot['roll_call_message_id'])
+            self.progress.state = LobbyState.OPEN
+        elif state == LobbyState.PICKING:
+            if not self.balanced:
+                self.picker = EmbeddedPicker(
+                    self.players, timeout=PICK_TURN_TIMEOUT, testing=testing,
+                    team_1=self.team_1, team_2=self.team_2, message_id=snapshot['pick_message_id'])
+            self.progress.state = LobbyState.ROLL_CALL
+        else:
+            self.progress.state = state
+
+    def recount_arrivals(self) -> bool:
+        # Returns True when the recount is what completes the lobby
+        self.arrived = {m.id for vc, team in ((self.team_1_vc, self.team_1), (self.team_2_vc, self.team_2))
+                        if vc is not None for m in vc.members if any(m.id == p.discord_id for p in team)}
+        return len(self.arrived) == self.team_size * 2 and \
+            self.progress.advance(LobbyState.READY, LobbyState.WAITING_FOR_PLAYERS)
+
+    async def update_voice_status(self, ready:bool):
+        if self.voice_status is not None:
+            self.voice_status.update(self.get_voice_status_page())
+        if ready:
+            await self.voting_channel.send("Match can begin!")
 
     # VC Handling
-    async def remove_queue_channels(self):
-        if self.queue_category is None:
-            return
-        await self.team_1_vc.delete()
-        await self.team_2_vc.delete()
-        await self.queue_category.delete()
-
-    async def add_voice_channels(self, ctx:commands.Context):
-        if self.queue_category is None:
-            self.queue_category = await ctx.guild.create_category(self._get_category_name())
-            self.team_1_vc = await self.queue_category.create_voice_channel(self.team_1[0].display_name)
-            self.team_2_vc = await self.queue_category.create_voice_channel(self.team_2[0].display_name)
+    def release_voice_channels(self, voice_pool:typing.Union[VoiceChannelPool, None]):
+        if voice_pool is not None:
+            voice_pool.release([self.team_1_vc, self.team_2_vc])
+
+    async def add_voice_channels(self, voice_pool:VoiceChannelPool):
+        if self.team_1_vc is None:
+            self.team_1_vc, self.team_2_vc = await voice_pool.lease(
+                [self.team_1[0].display_name, self.team_2[0].display_name])
+
+    def _get_team_vc(self, member_id:int) -> typing.Union[discord.VoiceChannel, None]:
+        if any(member_id == p.discord_id for p in self.team_1):
+            return self.team_1_vc
+        if any(member_id == p.discord_id for p in self.team_2):
+            return self.team_2_vc
+        return None
+
+    def get_voice_status_page(self) -> discord.Embed:
+        if self.progress.ready_to_start:
+            return discord.Embed(title="Match can begin!")
+        missing = [p.display_name for p in self.team_1 + self.team_2 if p.discord_id not in self.arrived]
+        return discord.Embed(
+            title="{n} out of {t} players have found the Team Chats!".format(n=len(self.arrived), t=self.team_size * 2),
+            description="Still waiting on {m}".format(m=", ".join(missing)) if missing else discord.Embed.Empty)
+
+    async def _move_back(self, member:discord.Member, channel:typing.Union[discord.VoiceChannel, None]):
+        try:
+            await member.move_to(channel)
+        except discord.HTTPException:
+            log.warning("Could not move %s out of lobby %s", member.id, self.queue_id)
 
     async def handle_relevant_voice_event(self, member:discord.Member, before:discord.VoiceState, voice_state:discord.VoiceState):
-        log.info("Voice event being handled by queue_session %s", self.queue_id)
-        # Teams haven't been pick yet, not reason to pay attention
-        if not self.progress.vote_complete:
+        log.debug("Voice event being handled by queue_session %s", self.queue_id)
+        # Only the wait between picking teams and everyone showing up is tracked
+        if self.progress.state != LobbyState.WAITING_FOR_PLAYERS:
             return
 
-        # If vote is done, check if someone joined a team chat.
-        if self.progress.vote_complete and not self.progress.ready_to_start:
-            if voice_state.channel.id == self.team_1_vc.id:
-                if not any([member.id == p.discord_id for p in self.team_1]):
-                    await self.voting_channel.send(
-                        "{name} tried to be a rat and join the wrong VC".format(name=member.display_name))
-                    await member.move_to(before.channel)
-                else:
-                    players_in_vc = len(self.team_1_vc.members) + len(self.team_2_vc.members)
-                    await self.voting_channel.send(
-                        "{n} out of {t} players have found the Team Chats!".format(n=players_in_vc,
-                                                                                   t=self.team_size * 2))
-
-            elif voice_state.channel.id == self.team_2_vc.id:
-                if not any([member.id == p.discord_id for p in self.team_2]):
-                    await self.voting_channel.send(
-                        "{name} tried to be a rat and join the wrong VC".format(name=member.display_name))
-                    await member.move_to(before.channel)
-                else:
-                    players_in_vc = len(self.team_1_vc.members) + len(self.team_2_vc.members)
-                    await self.voting_channel.send(
-                        "{n} out of {t} players have found the Team Chats!".format(n=players_in_vc,
-                                                                                   t=self.team_size * 2))
-
-        if len(self.team_1_vc.members) == self.team_size and len(self.team_2_vc.members) == self.team_size:
-            await self.voting_channel.send("Match can begin!")
-            self.progress.ready_to_start = True
\ No newline at end of file
+        channel = voice_state.channel
+        team_vc = self._get_team_vc(member.id)
+        if channel is not None and channel.id in (self.team_1_vc.id, self.team_2_vc.id) and \
+                (team_vc is None or channel.id != team_vc.id):
+            # Moving them back does not wait for the call out to be sent
+            asyncio.get_event_loop().create_task(self._move_back(member, before.channel))
+            await self.voting_channel.send("{name} tried to be a rat and join the wrong VC".format(name=member.display_name))
+            return
+
+        if team_vc is not None and channel is not None and channel.id == team_vc.id:
+            self.arrived.add(member.id)
+        else:
+            self.arrived.discard(member.id)
+
+        ready = len(self.arrived) == self.team_size * 2 and \
+            self.progress.advance(LobbyState.READY, LobbyState.WAITING_FOR_PLAYERS)
+        await self.update_voice_status(ready)
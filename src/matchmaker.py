@@ -0,0 +1,189 @@
+import asyncio
+import collections
+import heapq
+import time
+import typing
+from typing import Dict, List, Tuple
+
+import discord
+
+from src.constants import MATCHMAKING_WAIT_BONUS
+from src.match_queue_session import KickVote, KickVoting, QueueIdentifier
+from src.message_utils import MessageUpdater
+from src.player import Player
+from src.timer_wheel import WheelTimer
+
+
+def get_waiter_key(player:Player) -> typing.Hashable:
+    # Fake players used for testing have no discord id
+    return player.discord_id if player.discord_id is not None else player.discord_name
+
+
+class _Waiter:
+    __slots__ = ('player', 'joined_at')
+
+    def __init__(self, player:Player, joined_at:float):
+        self.player = player
+        self.joined_at = joined_at
+
+
+class Matchmaker(KickVoting):
+    # Everyone waiting for a match in one channel. Lobbies form as soon as enough people wait: the longest waiter
+    # anchors each lobby and the other seats go to the closest ratings, less a bonus for time already spent waiting.
+    def __init__(self,
+                 guild_id:int,
+                 channel_id:int,
+                 team_size:int=4,
+                 game:typing.Union[str, None]=None,
+                 balanced:bool=False):
+        self.queue_id = QueueIdentifier(guild_id=guild_id, channel_id=channel_id)
+        self.team_size = team_size
+        self.game = game
+        self.balanced = balanced
+        self._waiting: Dict[typing.Hashable, _Waiter] = {}
+        # Arrival order, entries of people who left are skipped when they reach the front
+        self._arrivals: typing.Deque[_Waiter] = collections.deque()
+        self.lobbies_formed = 0
+        # Bumped by every join and departure, so the snapshot loop can tell which queues moved
+        self.revision = 0
+        # Two joins at once would otherwise both send a first player count message
+        self.lock = asyncio.Lock()
+        self.kick_vote: typing.Union[KickVote, None] = None
+        self.player_count_message: typing.Union[MessageUpdater, None] = None
+        self.idle_timer: typing.Union[WheelTimer, None] = None
+
+    def __len__(self):
+        return len(self._waiting)
+
+    @property
+    def lobby_size(self) -> int:
+        return self.team_size * 2
+
+    @property
+    def players(self) -> List[Player]:
+        return [w.player for w in self._waiting.values()]
+
+    def is_waiting(self, player:Player) -> bool:
+        return get_waiter_key(player) in self._waiting
+
+    def next_lobby_id(self) -> QueueIdentifier:
+        self.lobbies_formed += 1
+        return QueueIdentifier(guild_id=self.queue_id.guild_id, channel_id=self.queue_id.channel_id,
+                               lobby=self.lobbies_formed)
+
+    def add(self, player:Player, now:float=None) -> bool:
+        key = get_waiter_key(player)
+        if key in self._waiting:
+            return False
+        waiter = _Waiter(player, time.monotonic() if now is None else now)
+        self._waiting[key] = waiter
+        self._arrivals.append(waiter)
+        self.revision += 1
+        return True
+
+    def remove(self, player:Player) -> bool:
+        if self._waiting.pop(get_waiter_key(player), None) is None:
+            return False
+        self.revision += 1
+        if len(self._arrivals) > 2 * len(self._waiting) + self.lobby_size:
+            self._arrivals = collections.deque(w for w in self._arrivals if self._is_current(w))
+        return True
+
+    def clear(self) -> List[Player]:
+        players = self.players
+        self._waiting.clear()
+        self._arrivals.clear()
+        self.revision += 1
+        return players
+
+    def _is_current(self, waiter:_Waiter) -> bool:
+        return self._waiting.get(get_waiter_key(waiter.player)) is waiter
+
+    def _pop_longest_waiting(self) -> _Waiter:
+        while True:
+            waiter = self._arrivals.popleft()
+            if self._is_current(waiter):
+                del self._waiting[get_waiter_key(waiter.player)]
+                return waiter
+
+    def form_lobbies(self, now:float=None) -> List[List[Player]]:
+        now = time.monotonic() if now is None else now
+        lobbies = []
+        while len(self._waiting) >= self.lobby_size:
+            anchor = self._pop_longest_waiting()
+            rating = anchor.player.rating
+            chosen = heapq.nsmallest(self.lobby_size - 1, self._waiting.values(),
+                                     key=lambda w: abs(w.player.rating - rating) - MATCHMAKING_WAIT_BONUS * (now - w.joined_at))
+            for waiter in chosen:
+                del self._waiting[get_waiter_key(waiter.player)]
+            lobbies.append([anchor.player] + [w.player for w in chosen])
+        if lobbies:
+            self.revision += 1
+            self._arrivals = collections.deque(w for w in self._arrivals if self._is_current(w))
+        return lobbies
+
+    # queue building
+    def _get_added_to_queue_msg(self, author_name) -> str:
+        ppl = "people" if len(self) != 1 else "person"
+        if self.game is not None:
+            msg = "{p} Added to {g} Queue! {n} {ppl} so far!".format(p=author_name, g=self.game, n=len(self), ppl=ppl)
+        else:
+            msg = "{p} Added to Queue! {n} {ppl} so far!".format(p=author_name, n=len(self), ppl=ppl)
+        return msg
+
+    def _get_remove_from_queue_msg(self, author_name) -> str:
+        if self.game is not None:
+            msg = '{p} has left the {g} queue. {n} remain'.format(p=author_name, g=self.game, n=len(self))
+        else:
+            msg = '{p} has left the queue. {n} remain'.format(p=author_name, n=len(self))
+        return msg
+
+    def try_add_player(self, player:Player) -> Tuple[bool, str]:
+        if not self.add(player):
+            return False, "Hold your horses, you already joined the conga line"
+        return True, self._get_added_to_queue_msg(player.display_name)
+
+    def try_remove_player(self, player:Player) -> Tuple[bool, str]:
+        if not self.remove(player):
+            return False, "LMAO YOU ARE TRYING TO QUIT AND YOU NEVER EVEN STARTED"
+        return True, self._get_remove_from_queue_msg(player.display_name)
+
+    def get_roll_call_message(self) -> discord.Embed:
+        player_list = '\n'.join([x.display_name for x in self.players])
+        if self.game is not None:
+            title = "{n} out of {n2} players so far for {g}".format(n=len(self), n2=self.lobby_size, g=self.game)
+        else:
+            title = "{n} out of {n2} players so far".format(n=len(self), n2=self.lobby_size)
+        return discord.Embed(title=title, description=player_list)
+
+    async def update_player_count(self, channel:discord.TextChannel):
+        # One live embed per queue, edited as people join and leave
+        async with self.lock:
+            embed = self.get_roll_call_message()
+            if self.player_count_message is None:
+                self.player_count_message = MessageUpdater(await channel.send(embed=embed))
+            else:
+                self.player_count_message.update(embed)
+
+    def snapshot_stamp(self) -> tuple:
+        return (self.revision, self.lobbies_formed, self.team_size, self.game, self.balanced, self.player_count_message is None)
+
+    def to_snapshot(self) -> dict:
+        return {
+            'guild_id': self.queue_id.guild_id,
+            'channel_id': self.queue_id.channel_id,
+            'team_size': self.team_size,
+            'game': self.game,
+            'balanced': self.balanced,
+            'lobbies_formed': self.lobbies_formed,
+            'waiting': [[p.discord_id, p.discord_name, p.display_name] for p in self.players],
+            'player_count_message_id': self.player_count_message.message.id if self.player_count_message is not None else None,
+        }
+
+    def close(self):
+        if self.idle_timer is not None:
+            self.idle_timer.cancel()
+        if self.kick_vote is not None:
+            self.end_kick_vote(self.kick_vote)
+        if self.player_count_message is not None:
+            self.player_count_message.cancel()
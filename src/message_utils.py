@@ -0,0 +1,70 @@
+import asyncio
+import logging
+import typing
+
+import discord
+
+log = logging.getLogger(__name__)
+
+async def fetch_message(channel:discord.TextChannel, message_id:typing.Union[int, None]) -> typing.Union[discord.Message, None]:
+    if message_id is None:
+        return None
+    try:
+        return await channel.fetch_message(message_id)
+    except discord.HTTPException:
+        return None
+
+class MessageUpdater:
+    def __init__(self, message:discord.Message, delay:float=1.0, max_delay:float=3.0):
+        self.message = message
+        # Edits wait for `delay` seconds of quiet, but the latest state is never held back longer than `max_delay`
+        self.delay = delay
+        self.max_delay = max_delay
+        self._pending: typing.Union[discord.Embed, None] = None
+        self._version = 0
+        self._first_pending_at = None
+        self._last_sent: typing.Union[dict, None] = message.embeds[0].to_dict() if message.embeds else None
+        self._task: typing.Union[asyncio.Task, None] = None
+        self._flush_now = asyncio.Event()
+
+    def update(self, embed:discord.Embed):
+        loop = asyncio.get_event_loop()
+        self._pending = embed
+        self._version += 1
+        if self._first_pending_at is None:
+            self._first_pending_at = loop.time()
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+
+    async def flush(self):
+        # Send whatever is pending right away and wait until it is on screen
+        if self._task is not None:
+            self._flush_now.set()
+            await self._task
+            self._flush_now.clear()
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+        self._pending = None
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while self._pending is not None:
+            deadline = self._first_pending_at + self.max_delay
+            version = self._version
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), timeout=max(0.0, min(self.delay, deadline - loop.time())))
+            except asyncio.TimeoutError:
+                if version != self._version and loop.time() < deadline:
+                    continue
+            embed, self._pending = self._pending, None
+            self._first_pending_at = None
+            data = embed.to_dict()
+            if data == self._last_sent:
+                continue
+            try:
+                await self.message.edit(embed=embed)
+                self._last_sent = data
+            except discord.HTTPException:
+                log.exception("Could not update message %s", self.message.id)
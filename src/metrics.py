@@ -0,0 +1,207 @@
+import asyncio
+import bisect
+import collections
+import functools
+import logging
+import time
+import typing
+from typing import Callable, Dict, List, Tuple
+
+log = logging.getLogger(__name__)
+
+# Upper bounds in seconds. Commands that wait on Discord land in the top few buckets
+LATENCY_BUCKETS: Tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'total', 'count')
+
+    def __init__(self, buckets:Tuple[float, ...]=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # One extra slot for everything above the last bound
+        self.counts: List[int] = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value:float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q:float) -> float:
+        # Upper bound of the bucket the quantile falls in, good enough to spot a slow command
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class RateLimitCounter(logging.Handler):
+    # discord.py sleeps through 429s on its own and only says so in its log
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.hits = 0
+        self.global_hits = 0
+
+    def emit(self, record:logging.LogRecord):
+        if not isinstance(record.msg, str):
+            return
+        if record.msg.startswith('We are being rate limited'):
+            self.hits += 1
+        elif record.msg.startswith('Global rate limit'):
+            self.global_hits += 1
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    # Recording is a counter bump or a bisect. Everything else is done when /metrics or !stats asks for it
+    def __init__(self):
+        self.command_latency: Dict[str, Histogram] = collections.defaultdict(Histogram)
+        self.command_errors: typing.Counter[str] = collections.Counter()
+        self.listener_latency: Dict[str, Histogram] = collections.defaultdict(Histogram)
+        self.listener_errors: typing.Counter[str] = collections.Counter()
+        self.rest_calls: typing.Counter[Tuple[str, str]] = collections.Counter()
+        self.rate_limits = RateLimitCounter()
+        # name -> (help, callback returning label dict -> value), read at scrape time
+        self.gauges: Dict[str, Tuple[str, Callable[[], Dict[Tuple[Tuple[str, str], ...], float]]]] = {}
+        self.started = time.time()
+        self._server: typing.Union[asyncio.AbstractServer, None] = None
+
+    def observe_command(self, name:str, elapsed:float, failed:bool):
+        self.command_latency[name].observe(elapsed)
+        if failed:
+            self.command_errors[name] += 1
+
+    def observe_listener(self, name:str, elapsed:float, failed:bool):
+        self.listener_latency[name].observe(elapsed)
+        if failed:
+            self.listener_errors[name] += 1
+
+    def add_gauge(self, name:str, help_text:str, collect:Callable[[], Dict[Tuple[Tuple[str, str], ...], float]]):
+        self.gauges[name] = (help_text, collect)
+
+    def remove_gauge(self, name:str):
+        self.gauges.pop(name, None)
+
+    def instrument_http(self, http):
+        # Every REST call discord.py makes goes through HTTPClient.request, counted by its unformatted route
+        request = http.request
+
+        @functools.wraps(request)
+        async def counted_request(route, **kwargs):
+            self.rest_calls[(route.method, route.path)] += 1
+            return await request(route, **kwargs)
+
+        http.request = counted_request
+        logging.getLogger('discord.http').addHandler(self.rate_limits)
+
+    async def start_server(self, port:int, host:str='127.0.0.1'):
+        if self._server is None:
+            self._server = await asyncio.start_server(self._serve, host, port)
+            log.info("Serving metrics on http://%s:%d/metrics", host, port)
+
+    async def stop_server(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        try:
+            # Whatever was asked for gets the metrics, the request itself only has to be read past
+            while (await reader.readline()).strip():
+                pass
+            body = self.render().encode('utf-8')
+            writer.write(b'HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                         b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def render(self) -> str:
+        lines = []
+        self._render_histograms(lines, 'queuebot_command_seconds', 'Command latency', 'command', self.command_latency)
+        self._render_counter(lines, 'queuebot_command_errors_total', 'Commands that raised', 'command', self.command_errors)
+        self._render_histograms(lines, 'queuebot_listener_seconds', 'Event listener latency', 'event', self.listener_latency)
+        self._render_counter(lines, 'queuebot_listener_errors_total', 'Event listeners that raised', 'event', self.listener_errors)
+        lines.append('# HELP queuebot_rest_requests_total REST requests made, by route')
+        lines.append('# TYPE queuebot_rest_requests_total counter')
+        for (method, path), n in self.rest_calls.items():
+            lines.append('queuebot_rest_requests_total{{method="{m}",route="{r}"}} {n}'.format(m=method, r=_escape(path), n=n))
+        lines.append('# HELP queuebot_rate_limited_total 429 responses discord.py waited out')
+        lines.append('# TYPE queuebot_rate_limited_total counter')
+        lines.append('queuebot_rate_limited_total{{scope="bucket"}} {n}'.format(n=self.rate_limits.hits))
+        lines.append('queuebot_rate_limited_total{{scope="global"}} {n}'.format(n=self.rate_limits.global_hits))
+        for name, (help_text, collect) in self.gauges.items():
+            lines.append('# HELP {n} {h}'.format(n=name, h=help_text))
+            lines.append('# TYPE {n} gauge'.format(n=name))
+            for labels, value in collect().items():
+                label_text = ','.join('{k}="{v}"'.format(k=k, v=_escape(v)) for k, v in labels)
+                lines.append('{n}{{{l}}} {v}'.format(n=name, l=label_text, v=value) if label_text else '{n} {v}'.format(n=name, v=value))
+        lines.append('# TYPE queuebot_uptime_seconds gauge')
+        lines.append('queuebot_uptime_seconds {s:.0f}'.format(s=time.time() - self.started))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _render_histograms(lines:List[str], name:str, help_text:str, label:str, histograms:Dict[str, Histogram]):
+        lines.append('# HELP {n} {h}'.format(n=name, h=help_text))
+        lines.append('# TYPE {n} histogram'.format(n=name))
+        for key, hist in histograms.items():
+            cumulative = 0
+            for bound, n in zip(hist.buckets, hist.counts):
+                cumulative += n
+                lines.append('{n}_bucket{{{l}="{k}",le="{b}"}} {c}'.format(n=name, l=label, k=key, b=bound, c=cumulative))
+            lines.append('{n}_bucket{{{l}="{k}",le="+Inf"}} {c}'.format(n=name, l=label, k=key, c=hist.count))
+            lines.append('{n}_sum{{{l}="{k}"}} {s}'.format(n=name, l=label, k=key, s=hist.total))
+            lines.append('{n}_count{{{l}="{k}"}} {c}'.format(n=name, l=label, k=key, c=hist.count))
+
+    @staticmethod
+    def _render_counter(lines:List[str], name:str, help_text:str, label:str, counts:typing.Counter[str]):
+        lines.append('# HELP {n} {h}'.format(n=name, h=help_text))
+        lines.append('# TYPE {n} counter'.format(n=name))
+        for key, n in counts.items():
+            lines.append('{n}{{{l}="{k}"}} {c}'.format(n=name, l=label, k=key, c=n))
+
+    def summary(self) -> str:
+        lines = ['{c:12} {n:>7} {e:>6} {p50:>8} {p95:>8} {m:>8}'.format(
+            c='command', n='calls', e='errors', p50='p50 ms', p95='p95 ms', m='mean ms')]
+        for name, hist in sorted(self.command_latency.items(), key=lambda kv: -kv[1].count):
+            lines.append('{c:12} {n:>7} {e:>6} {p50:>8.0f} {p95:>8.0f} {m:>8.1f}'.format(
+                c=name, n=hist.count, e=self.command_errors[name], p50=hist.quantile(0.5) * 1000,
+                p95=hist.quantile(0.95) * 1000, m=hist.total / hist.count * 1000))
+        for name, (_, collect) in sorted(self.gauges.items()):
+            values = ', '.join('{l}: {v:g}'.format(l='/'.join(v for _, v in labels) or 'total', v=value)
+                               for labels, value in collect().items())
+            lines.append('{n}: {v}'.format(n=name, v=values or 'none'))
+        lines.append('REST requests: {n}, rate limited: {r} (global {g})'.format(
+            n=sum(self.rest_calls.values()), r=self.rate_limits.hits, g=self.rate_limits.global_hits))
+        for (method, path), n in self.rest_calls.most_common(5):
+            lines.append('  {n:>7} {m} {p}'.format(n=n, m=method, p=path))
+        return '\n'.join(lines)
+
+
+def timed_listener(func):
+    # For event handlers on the bot or on a cog, both of which reach the bot's Metrics
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        metrics: Metrics = getattr(self, 'bot', self).metrics
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = await func(self, *args, **kwargs)
+            failed = False
+            return result
+        finally:
+            metrics.observe_listener(name, time.perf_counter() - started, failed)
+
+    return wrapper
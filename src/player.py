@@ -1,32 +1,53 @@
-class PlayerIdentifier:
-    def __init__(self, discord_id:int, guild_id:int, game:str):
-        self.discord_id = discord_id
-        self.guild_id = guild_id
-        self.game = game
+import sys
+import typing
+from typing import NamedTuple
 
-    def __hash__(self):
-        return hash((self.guild_id, self.discord_id, self.game))
+DEFAULT_RATING = 1000.0
 
-    def __eq__(self, other):
-        return (self.discord_id, self.guild_id, self.game) == (other.discord_id, other.guild_id, other.game)
 
-    def __ne__(self, other):
-        return not(self == other)
+class PlayerIdentifier(NamedTuple):
+    discord_id: int
+    guild_id: int
+    game: typing.Union[str, None]
+
+    @classmethod
+    def from_ids(cls, discord_id:int, guild_id:int, game:typing.Union[str, None]):
+        # Game names repeat across every player, share one string per name
+        return cls(discord_id, guild_id, sys.intern(game) if game is not None else None)
 
 
 class Player:
+    __slots__ = ('discord_name', 'display_name', 'discord_id', 'guild_id', 'game',
+                 'total_wins', 'total_losses', 'win_streak', 'loss_streak', 'rating', 'current_queue_game')
+
+    RECORD_FIELDS = ('discord_name', 'display_name', 'discord_id', 'guild_id', 'game',
+                     'total_wins', 'total_losses', 'win_streak', 'loss_streak', 'rating')
+
     def __init__(self, **kwargs):
         self.discord_name = kwargs.get('discord_name', None)
         self.display_name = kwargs.get('display_name', None)
         self.discord_id = kwargs.get('discord_id', None)
         self.guild_id = kwargs.get('guild_id', None)
-        self.game = kwargs.get("game", None)
+        game = kwargs.get("game", None)
+        self.game = sys.intern(game) if game is not None else None
         self.total_wins = kwargs.get('total_wins', 0)
         self.total_losses = kwargs.get('total_losses', 0)
         self.win_streak = kwargs.get('win_streak', 0)
         self.loss_streak = kwargs.get('loss_streak', 0)
+        self.rating = kwargs.get('rating', DEFAULT_RATING)
         self.current_queue_game = None
 
+    @classmethod
+    def from_record(cls, record:dict):
+        return cls(**{k: record[k] for k in cls.RECORD_FIELDS if k in record})
+
+    def to_record(self) -> dict:
+        return {k: getattr(self, k) for k in self.RECORD_FIELDS}
+
+    @property
+    def key(self) -> PlayerIdentifier:
+        return PlayerIdentifier(self.discord_id, self.guild_id, self.game)
+
     @property
     def matches_played(self):
         return self.total_losses + self.total_wins
@@ -0,0 +1,137 @@
+import json
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+from src.player import DEFAULT_RATING
+
+log = logging.getLogger(__name__)
+
+PLAYER_COLUMNS = ('discord_id', 'guild_id', 'game', 'discord_name', 'display_name',
+                  'total_wins', 'total_losses', 'win_streak', 'loss_streak', 'rating')
+KEY_COLUMNS = ('discord_id', 'guild_id', 'game')
+
+_CREATE_PLAYERS = """
+CREATE TABLE IF NOT EXISTS players (
+    discord_id INTEGER NOT NULL,
+    guild_id INTEGER NOT NULL,
+    game TEXT NOT NULL DEFAULT '',
+    discord_name TEXT,
+    display_name TEXT,
+    total_wins INTEGER NOT NULL DEFAULT 0,
+    total_losses INTEGER NOT NULL DEFAULT 0,
+    win_streak INTEGER NOT NULL DEFAULT 0,
+    loss_streak INTEGER NOT NULL DEFAULT 0,
+    rating REAL NOT NULL DEFAULT 1000,
+    PRIMARY KEY (discord_id, guild_id, game)
+) WITHOUT ROWID
+"""
+
+_CREATE_GUILD_INDEX = "CREATE INDEX IF NOT EXISTS players_by_guild ON players (guild_id)"
+
+_CREATE_META = "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID"
+
+JSON_MIGRATED_KEY = 'json_migrated_from'
+
+_UPSERT_PLAYER = "INSERT INTO players ({cols}) VALUES ({params}) ON CONFLICT ({keys}) DO UPDATE SET {updates}".format(
+    cols=', '.join(PLAYER_COLUMNS),
+    params=', '.join(':' + c for c in PLAYER_COLUMNS),
+    keys=', '.join(KEY_COLUMNS),
+    updates=', '.join('{c}=excluded.{c}'.format(c=c) for c in PLAYER_COLUMNS if c not in KEY_COLUMNS))
+
+
+def get_store_path(player_data_path:str) -> str:
+    # Older configs point player_data at the JSON file, keep the database right next to it
+    root, ext = os.path.splitext(player_data_path)
+    if ext == '.json':
+        return root + '.db'
+    return player_data_path
+
+
+class SqlitePlayerStore:
+    def __init__(self, path:str):
+        self.path = path
+        # sqlite connections should not be shared between writers, so every query goes through one thread
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='player-store')
+        self._conn = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(_CREATE_PLAYERS)
+        conn.execute(_CREATE_GUILD_INDEX)
+        conn.execute(_CREATE_META)
+        self._add_missing_columns(conn)
+        conn.commit()
+        return conn
+
+    @staticmethod
+    def _add_missing_columns(conn:sqlite3.Connection):
+        # Databases created before a column existed get it added with its default
+        columns = {r['name'] for r in conn.execute("PRAGMA table_info(players)")}
+        if 'rating' not in columns:
+            conn.execute("ALTER TABLE players ADD COLUMN rating REAL NOT NULL DEFAULT 1000")
+
+    @staticmethod
+    def _to_row(record:dict) -> dict:
+        row = {c: record.get(c) for c in PLAYER_COLUMNS}
+        if row['game'] is None:
+            row['game'] = ''
+        for c in ('total_wins', 'total_losses', 'win_streak', 'loss_streak'):
+            if row[c] is None:
+                row[c] = 0
+        if row['rating'] is None:
+            row['rating'] = DEFAULT_RATING
+        return row
+
+    @staticmethod
+    def _from_row(row:sqlite3.Row) -> dict:
+        record = dict(row)
+        if record['game'] == '':
+            record['game'] = None
+        return record
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        return self._conn
+
+    def load_guild(self, guild_id:int) -> List[dict]:
+        rows = self._conn.execute("SELECT * FROM players WHERE guild_id = ?", (guild_id,))
+        return [self._from_row(r) for r in rows]
+
+    def upsert(self, records:Iterable[dict]):
+        with self._conn:
+            self.write(records)
+
+    def write(self, records:Iterable[dict]):
+        # Leaves the transaction open, for callers that commit other rows along with the players
+        rows = [self._to_row(r) for r in records if r.get('discord_id') is not None]
+        if rows:
+            self._conn.executemany(_UPSERT_PLAYER, rows)
+
+    def get_meta(self, key:str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row is not None else None
+
+    @property
+    def json_migrated(self) -> bool:
+        return self.get_meta(JSON_MIGRATED_KEY) is not None
+
+    def migrate_json(self, json_path:str) -> int:
+        with open(json_path, 'r') as f:
+            player_dict: Dict[str, dict] = json.load(f)
+        records = list(player_dict.values())
+        # The marker commits with the players, so a migration that fails part way is simply run again next start
+        with self._conn:
+            self.write(records)
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (JSON_MIGRATED_KEY, json_path))
+        log.info("Migrated %d players from %s into %s", len(records), json_path, self.path)
+        return len(records)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self._conn.close()
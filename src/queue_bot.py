@@ -1,36 +1,108 @@
+import asyncio
+from collections import OrderedDict
 import discord
 from discord.ext import commands
-import json
+import logging
 import os
+import sqlite3
 import typing
 
 from typing import Dict
 
+from src.constants import HISTORY_COMPACT_INTERVAL
+from src.leaderboard import Leaderboard, build_leaderboard_off_loop
+from src.match_history import MatchHistory, PendingMatch
+from src.metrics import Metrics, timed_listener
 from src.player import Player, PlayerIdentifier
+from src.ratings import EloRatings
+from src.player_store import SqlitePlayerStore, get_store_path
+from src.reactions import ReactionDispatcher
+from src.snapshot import LobbySnapshots
+from src.timer_wheel import TimerWheel
+from src.watchdog import LoopWatchdog
+
+log = logging.getLogger(__name__)
 
 class QueueBot(commands.Bot):
-    def __init__(self, *args, data_path:str, **kwargs):
+    def __init__(self, *args, data_path:str, save_interval:float=30.0, max_cached_players:int=50000,
+                 rating_k_factor:float=32.0, metrics_port:int=0, **kwargs):
         super().__init__(*args, **kwargs)
         self.data_path = data_path
-        self.players: Dict[PlayerIdentifier, Player] = self.load_saved_players()
+        self.save_interval = save_interval
+        self.max_cached_players = max_cached_players
+        self.store = SqlitePlayerStore(get_store_path(data_path))
+        self.migrate_saved_players()
+        self.history = MatchHistory(self.store.connection, self.store.executor)
+        self.snapshots = LobbySnapshots(self.store.connection, self.store.executor)
+        self.ratings = EloRatings(k_factor=rating_k_factor)
+        # Players are loaded one guild at a time on first use, least recently used guild first
+        self.players: typing.OrderedDict[int, Dict[PlayerIdentifier, Player]] = OrderedDict()
+        self._cached_player_count = 0
+        self._guild_loads: Dict[int, asyncio.Task] = {}
+        self._dirty_players: Dict[PlayerIdentifier, Player] = {}
+        # Results waiting to be written with the next flush, in the same transaction as the players they changed
+        self._pending_matches: typing.List[PendingMatch] = []
+        # Built on first !leaderboard for a guild/game, then kept current as stats change
+        self.leaderboards: Dict[typing.Tuple[int, typing.Union[str, None]], Leaderboard] = {}
+        self._leaderboard_builds: Dict[typing.Tuple[int, typing.Union[str, None]], asyncio.Task] = {}
+        self._leaderboard_changes: Dict[typing.Tuple[int, typing.Union[str, None]], typing.Set[Player]] = {}
+        self._save_requested = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: typing.Union[asyncio.Task, None] = None
+        self._compact_task: typing.Union[asyncio.Task, None] = None
+        self.reactions = ReactionDispatcher()
+        # Every lobby deadline shares this one wheel
+        self.timers = TimerWheel()
+        # Scraped as Prometheus text on localhost when a port is configured, always readable through !stats
+        self.metrics = Metrics()
+        self.metrics.instrument_http(self.http)
+        self.metrics_port = metrics_port
+        # Logs the stack of whatever holds the loop up past LOOP_LAG_THRESHOLD, and backs !profile
+        self.watchdog = LoopWatchdog()
+        self.metrics.add_gauge('queuebot_loop_lag_seconds', 'Event loop lag, last heartbeat and worst seen', self.watchdog.get_lag)
+        self.metrics.add_gauge('queuebot_loop_stalls', 'Times the loop went quiet past the lag threshold', lambda: {(): self.watchdog.stalls})
 
+    @timed_listener
     async def on_ready(self):
-        print(f'Logged in as {self.user} (ID: {self.user.id})')
-        print('------')
+        log.info("Logged in as %s (ID: %s)", self.user, self.user.id)
+        if self._flush_task is None:
+            self._flush_task = self.loop.create_task(self._flush_loop())
+            self._compact_task = self.loop.create_task(self._compact_loop())
+        self.watchdog.start()
+        if self.metrics_port:
+            await self.metrics.start_server(self.metrics_port)
+
+    @timed_listener
+    async def on_raw_reaction_add(self, payload:discord.RawReactionActionEvent):
+        if payload.user_id != self.user.id:
+            self.reactions.dispatch(payload)
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._compact_task.cancel()
+        self.watchdog.stop()
+        await self.metrics.stop_server()
+        await self.flush_players()
+        await super().close()
+        self.store.close()
 
 
     async def get_player_from_db(self,
                                  author:typing.Union[discord.Member,discord.User],
                                  guild_id:int,
                                  game:typing.Union[str, None]):
-        # player_id = PlayerIdentifier(author.id, guild_id, game)
-        player_id = author.id
-        if player_id in self.players:
-            return self.players[player_id]
+        player_id = PlayerIdentifier.from_ids(author.id, guild_id, game)
+        guild_players = await self.get_guild_players(guild_id)
+        if player_id in guild_players:
+            return guild_players[player_id]
         else:
-            new_player = Player(discord_name=author.name, display_name=author.display_name, discord_id=author.id, guild_id=guild_id)
-            self.players[player_id] = new_player
-            print(vars(new_player))
+            new_player = Player(discord_name=author.name, display_name=author.display_name, discord_id=author.id, guild_id=guild_id, game=game)
+            guild_players[player_id] = new_player
+            self._cached_player_count += 1
+            self.mark_player_dirty(player_id, new_player)
+            self._update_leaderboards([new_player])
+            log.debug("New player %s in guild %s, game %s", author.id, guild_id, game)
             return new_player
 
     @staticmethod
@@ -38,15 +110,178 @@ class QueueBot(commands.Bot):
         new_player = Player(discord_name=fake_name, display_name=fake_display_name, discord_id=None, guild_id=guild_id)
         return new_player
 
-    def load_saved_players(self):
-        player_dict = {}
-        if os.path.exists(self.data_path):
-            with open(self.data_path, 'r') as f:
-                player_dict = json.load(f)
-        players = {k: Player(**v) for k,v in player_dict.items()}
-        return players
+    def migrate_saved_players(self):
+        if self.data_path != self.store.path and os.path.exists(self.data_path) and not self.store.json_migrated:
+            # one-shot migration of the old players.json, retried every start until it has committed
+            self.store.migrate_json(self.data_path)
+
+    async def get_guild_players(self, guild_id:int) -> Dict[PlayerIdentifier, Player]:
+        if guild_id in self.players:
+            self.players.move_to_end(guild_id)
+            return self.players[guild_id]
+        # Commands arriving together for a cold guild share one load
+        load = self._guild_loads.get(guild_id)
+        if load is None:
+            load = self.loop.create_task(self._load_guild_players(guild_id))
+            self._guild_loads[guild_id] = load
+            load.add_done_callback(lambda _: self._guild_loads.pop(guild_id, None))
+        return await asyncio.shield(load)
+
+    async def _load_guild_players(self, guild_id:int) -> Dict[PlayerIdentifier, Player]:
+        records = await self.loop.run_in_executor(self.store.executor, self.store.load_guild, guild_id)
+        guild_players = {}
+        for r in records:
+            player = Player.from_record(r)
+            guild_players[player.key] = player
+        self.players[guild_id] = guild_players
+        self._cached_player_count += len(guild_players)
+        self._evict_idle_guilds()
+        return guild_players
+
+    def _evict_idle_guilds(self):
+        if self._cached_player_count <= self.max_cached_players:
+            return
+        # Guilds with unsaved changes stay until the next flush has written them
+        dirty_guilds = {p.guild_id for p in self._dirty_players.values()}
+        for guild_id in list(self.players.keys())[:-1]:
+            if self._cached_player_count <= self.max_cached_players:
+                break
+            if guild_id in dirty_guilds:
+                continue
+            self._cached_player_count -= len(self.players.pop(guild_id))
+            for key in [k for k in self.leaderboards if k[0] == guild_id]:
+                del self.leaderboards[key]
+
+    async def record_match_result(self, guild_id:int, game:typing.Union[str, None],
+                                  team_1:typing.List[Player], team_2:typing.List[Player], winning_team:int):
+        # Everyone's stats and the match itself go to the store as one transaction
+        winners, losers = (team_1, team_2) if winning_team == 1 else (team_2, team_1)
+        cached_winners = await self._get_cached_players(winners)
+        cached_losers = await self._get_cached_players(losers)
+        self.ratings.rate_match(cached_winners, cached_losers)
+        for player in cached_winners:
+            player.log_win()
+            self.mark_player_dirty(player.key, player)
+        for player in cached_losers:
+            player.log_loss()
+            self.mark_player_dirty(player.key, player)
+        self._update_leaderboards(cached_winners + cached_losers)
+        self._pending_matches.append(self.history.new_match(guild_id, game, team_1, team_2, winning_team))
+        await self.flush_players()
+
+    async def _get_cached_players(self, players:typing.List[Player]) -> typing.List[Player]:
+        cached = []
+        for p in players:
+            if p.discord_id is None:
+                continue
+            guild_players = await self.get_guild_players(p.guild_id)
+            # The guild may have been evicted and reloaded mid match, stats go on whichever copy is cached now
+            player = guild_players.get(p.key)
+            if player is None:
+                player = guild_players[p.key] = p
+                self._cached_player_count += 1
+            cached.append(player)
+        return cached
+
+    async def replay_ratings(self, guild_id:int, game:typing.Union[str, None]) -> int:
+        # Rebuilds every rating in a guild/game from the full match history, e.g. after the K factor changed
+        new_ratings = await self.history.replay_ratings(self.ratings, guild_id, game)
+        guild_players = await self.get_guild_players(guild_id)
+        updated = 0
+        for player in guild_players.values():
+            if player.game != game:
+                continue
+            player.rating = new_ratings.get(player.discord_id, self.ratings.initial_rating)
+            self.mark_player_dirty(player.key, player)
+            self._update_leaderboards([player])
+            updated += 1
+        await self.flush_players()
+        return updated
+
+    async def get_leaderboard(self, guild_id:int, game:typing.Union[str, None]) -> Leaderboard:
+        key = (guild_id, game)
+        if key in self.leaderboards:
+            return self.leaderboards[key]
+        build = self._leaderboard_builds.get(key)
+        if build is None:
+            build = self.loop.create_task(self._build_leaderboard(key))
+            self._leaderboard_builds[key] = build
+            build.add_done_callback(lambda _: self._leaderboard_builds.pop(key, None))
+        return await asyncio.shield(build)
+
+    async def _build_leaderboard(self, key:typing.Tuple[int, typing.Union[str, None]]) -> Leaderboard:
+        guild_players = await self.get_guild_players(key[0])
+        players = [p for p in guild_players.values() if p.game == key[1]]
+        # Players whose stats change while the index is built off the loop get re-applied afterwards
+        changed = self._leaderboard_changes[key] = set()
+        try:
+            board = await self.loop.run_in_executor(None, build_leaderboard_off_loop, players)
+        finally:
+            del self._leaderboard_changes[key]
+        for player in changed:
+            board.update(player)
+        self.leaderboards[key] = board
+        return board
+
+    def _update_leaderboards(self, players:typing.Iterable[Player]):
+        for player in players:
+            key = (player.guild_id, player.game)
+            board = self.leaderboards.get(key)
+            if board is not None:
+                board.update(player)
+            elif key in self._leaderboard_changes:
+                self._leaderboard_changes[key].add(player)
+
+    # Persistence is write-behind: changes are recorded here and written by _flush_loop off the event loop
+    def mark_player_dirty(self, player_id:PlayerIdentifier, player:Player):
+        self._dirty_players[player_id] = player
 
     def save_players(self):
-        print(self.players)
-        with open(self.data_path, 'w') as f:
-            json.dump({k: vars(v) for k,v in self.players.items()}, f)
+        # Repeated calls between flushes collapse into a single write
+        self._save_requested.set()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._save_requested.wait(), timeout=self.save_interval)
+            except asyncio.TimeoutError:
+                pass
+            # Let requests that arrive together share one write
+            await asyncio.sleep(min(1.0, self.save_interval))
+            self._save_requested.clear()
+            try:
+                await self.flush_players()
+            except sqlite3.Error:
+                # The players stay dirty and go out with the next flush
+                log.exception("Saving players failed")
+            self._evict_idle_guilds()
+
+    async def _compact_loop(self):
+        while True:
+            await asyncio.sleep(HISTORY_COMPACT_INTERVAL)
+            try:
+                await self.history.compact()
+            except sqlite3.Error:
+                log.exception("Match history compaction failed")
+
+    async def flush_players(self):
+        async with self._flush_lock:
+            if not self._dirty_players and not self._pending_matches:
+                return
+            dirty, self._dirty_players = self._dirty_players, {}
+            matches, self._pending_matches = self._pending_matches, []
+            # Only the changed rows are copied and written, in a single transaction
+            records = [v.to_record() for v in dirty.values()]
+            try:
+                await self.loop.run_in_executor(self.store.executor, self._write_changes, records, matches)
+            except sqlite3.Error:
+                # keep the players dirty and the matches pending so the next flush retries them, still together
+                for k,v in dirty.items():
+                    self._dirty_players.setdefault(k, v)
+                self._pending_matches[:0] = matches
+                raise
+
+    def _write_changes(self, records:typing.List[dict], matches:typing.List[PendingMatch]):
+        with self.store.connection:
+            self.store.write(records)
+            self.history.write(matches)
@@ -1,11 +1,23 @@
 import discord
 from discord.ext import commands
 
+import asyncio
+from collections import deque
 import logging
-from typing import Dict, List, Tuple
+import sqlite3
+import time
+import typing
+from typing import Dict, FrozenSet, List, Tuple
 
 from src.queue_bot import QueueBot
-from src.match_queue_session import MatchQueue, QueueIdentifier, KickVote
+from src.embeds import EmbeddedLeaderboard
+from src.leaderboard import LEADERBOARD_METRICS
+from src.constants import IDLE_QUEUE_TIMEOUT, RECENT_TEAMS_KEPT, SNAPSHOT_INTERVAL
+from src.match_queue_session import MatchQueue, QueueIdentifier, LobbyState
+from src.matchmaker import Matchmaker
+from src.metrics import timed_listener
+from src.message_utils import MessageUpdater, fetch_message
+from src.voice_pool import VoiceChannelPool
 from src.player import Player
 
 log = logging.getLogger(__name__)
@@ -13,57 +25,90 @@ log = logging.getLogger(__name__)
 class QueueManagerCog(commands.Cog):
     def __init__(self, bot:QueueBot, testing:bool=False):
         self.bot = bot
+        # One matchmaker per channel that started a queue. People wait there until enough have joined to fill a lobby
+        self.matchmakers: Dict[QueueIdentifier, Matchmaker] = {}
+        self.guild_matchmakers: Dict[int, Dict[QueueIdentifier, Matchmaker]] = {}
+        self.waiting_players: Dict[int, QueueIdentifier] = {}
+        # Every lobby formed by a matchmaker, from roll call until it is reset
         self.match_queues: Dict[QueueIdentifier, MatchQueue] = {}
+        # Lookup indexes kept in step with match_queues so routing never scans every queue
+        self.guild_queues: Dict[int, Dict[QueueIdentifier, MatchQueue]] = {}
+        self.voice_channel_queues: Dict[int, MatchQueue] = {}
+        self.player_queues: Dict[int, QueueIdentifier] = {}
+        # Players who went back in line while the lobby of their finished match was still open, so !reset can find it
+        self.finished_queues: Dict[int, QueueIdentifier] = {}
+        # Last few teams per guild, balanced queues try not to put the same people together again
+        self.recent_teams: Dict[int, typing.Deque[FrozenSet[int]]] = {}
+        self.voice_pools: Dict[int, VoiceChannelPool] = {}
         self.testing = testing
         self.number_fakes=4
+        # Snapshot key -> stamp of what was last saved under it. Rows whose stamp still matches are not serialized again
+        self._snapshot_stamps: Dict[str, tuple] = {}
+        # Restores whatever was live before the last restart, then keeps the snapshot current
+        self._snapshot_task: asyncio.Task = bot.loop.create_task(self._snapshot_loop())
+        bot.metrics.add_gauge('queuebot_lobbies', 'Lobbies by state', self.count_lobbies_by_state)
+        bot.metrics.add_gauge('queuebot_waiting_players', 'Players waiting in a matchmaker', lambda: {(): len(self.waiting_players)})
+
+    async def cog_before_invoke(self, ctx:commands.Context):
+        ctx.started_at = time.perf_counter()
+
+    async def cog_after_invoke(self, ctx:commands.Context):
+        # Runs whether or not the command raised, ctx.command_failed says which
+        self.bot.metrics.observe_command(ctx.command.qualified_name, time.perf_counter() - ctx.started_at, ctx.command_failed)
+
+    def count_lobbies_by_state(self) -> Dict[Tuple[Tuple[str, str], ...], int]:
+        counts = {(('state', s.name.lower()),): 0 for s in LobbyState}
+        for queue in self.match_queues.values():
+            counts[(('state', queue.progress.state.name.lower()),)] += 1
+        return counts
 
     @commands.command(
         name='n',
-        help="Start a new queue. You must include the team size but the name of the game is optional",
+        help="Start a new queue in this channel. You must include the team size but the name of the game is optional. End with 'balanced' to have teams split by rating instead of drafted by captains",
         brief='Start a new queue')
     async def new_queue(self, ctx:commands.Context, team_size:int, *, game:str=None):
-        guild_id = ctx.guild.id
-        current_queues = self.get_current_guild_queues(guild_id)
-        if len(current_queues) < 1:
-            queue_id = QueueIdentifier(ctx=ctx)
-            self.match_queues[queue_id] = MatchQueue(ctx=ctx, team_size=team_size, game=game)
-            await ctx.channel.send("New {t}v{t} match queue for {g} started by {p}".format(g=game, t=team_size, p=ctx.author.name))
-        else:
-            await ctx.channel.send("Only one queue can be created at a time. Try resetting the old one")
+        queue_id = QueueIdentifier(ctx=ctx)
+        if queue_id in self.matchmakers:
+            await ctx.channel.send("This channel already has a queue. Try resetting the old one")
+            return
+        game, balanced = self.parse_queue_mode(game)
+        self.set_matchmaker(Matchmaker(queue_id.guild_id, queue_id.channel_id, team_size=team_size, game=game, balanced=balanced))
+        await ctx.channel.send("New {t}v{t} {m}match queue for {g} started by {p}".format(
+            g=game, t=team_size, p=ctx.author.name, m="balanced " if balanced else ""))
 
     @commands.command(
         name='reset',
-        help="Reset the queue after a match has completed. Specify new team size and game or it will use the same params as before. The current queue must be empty and queue-related channels vacated.",
+        help="Clear your lobby after its match has completed, or change the queue's team size and game. Lobby channels must be vacated and nobody can be waiting when the queue changes.",
         brief="Reset the queue when you're ready to go again",
         )
     async def reset_queue(self, ctx:commands.Context, team_size:int=None, *, game:str=None):
-        guild_id = ctx.guild.id
-        current_queues = self.get_current_guild_queues(guild_id)
-        if len(current_queues) < 1:
+        queue_ids = self.get_players_queues(ctx.author.id)
+        # A finished match is cleared before anything newer the player has joined since
+        queue_id = self.finished_queues.get(ctx.author.id, queue_ids[0] if queue_ids else None)
+        if queue_id is not None and team_size is None and game is None:
+            queue = self.match_queues[queue_id]
+            async with queue.lock:
+                if queue.team_1_vc is not None and queue.team_2_vc is not None:
+                    if len(queue.team_1_vc.members) > 0 or len(queue.team_2_vc.members) > 0:
+                        await ctx.channel.send("I'm kinda dumb right now, please vacate the team chat channels so I can be sure that match is complete.")
+                        return
+                # A roll call or pick still running is cancelled on the spot
+                self.close_lobby(queue)
+            await ctx.channel.send("Lobby {n} has been cleared. Good to go again".format(n=queue.queue_id.lobby))
+            return
+
+        matchmaker = self.get_matchmaker(ctx)
+        if matchmaker is None:
             await ctx.channel.send("You gotta build something before you blow it up. There is not an active queue to reset.")
             return
-        queue_id, queue = current_queues[0]
-        if not queue.progress.filled and len(queue.players) > 0:
+        if len(matchmaker) > 0:
             await ctx.channel.send("There is a queue already in progress with people in it. Please leave it instead of resetting. If someone went afk, try the 'kick' command")
             return
-
-        if queue.progress.vote_in_progress:
-            await ctx.channel.send(
-                'Previously queued players did not finish picking teams. They will time out soon enough')
-            return
-
-        if queue.team_1_vc is not None and queue.team_2_vc is not None:
-            if len(queue.team_1_vc.members) > 0 or len(queue.team_2_vc.members) > 0:
-                await ctx.channel.send("I'm kinda dumb right now, please vacate the team chat channels so I can be sure that match is complete.")
-                return
-
-        await self.clean_up_queue_channels(ctx.guild)
-        new_size = queue.team_size if team_size is None else team_size
-        new_game = queue.game if game is None else game
-        self.match_queues[queue_id] = MatchQueue(
-            ctx=ctx,
-            team_size=new_size,
-            game=new_game)
+        # Lobbies already formed keep going with the settings they were made with
+        if team_size is not None:
+            matchmaker.team_size = team_size
+        if game is not None:
+            matchmaker.game, matchmaker.balanced = self.parse_queue_mode(game)
         await ctx.channel.send("Queue has been cleared. Good to go again")
 
     @commands.command(
@@ -71,92 +116,407 @@ class QueueManagerCog(commands.Cog):
         help="The first time this is called, it initiates the processes to kick {player_name} from the queue. {player_name} will be kicked when this is called by a second person",
         brief='Kick a person from the queue')
     async def kick_player(self, ctx:commands.Context, *, player_name):
-        queue_id = QueueIdentifier(ctx=ctx)
-        if queue_id in self.match_queues:
-            queue = self.match_queues[queue_id]
+        matchmaker = self.get_matchmaker(ctx)
+        if matchmaker is None:
+            return
+        # Counting the vote never awaits, so two people seconding at the same moment only kick once
+        kicked, kick_msg = self._kick_player(matchmaker, player_name, ctx.author.id)
+        await ctx.channel.send(kick_msg)
+        if kicked:
+            await self.update_player_count(ctx, matchmaker)
+
+    def _kick_player(self, matchmaker:Matchmaker, player_name:str, voter_id:int) -> Tuple[bool, str]:
+        for p in matchmaker.players:
+            if p.display_name == player_name:
+                kicked, vote_msg = matchmaker.vote_to_kick(p, voter_id, self.bot.timers)
+                if not kicked:
+                    return False, vote_msg
+                matchmaker.remove(p)
+                self.waiting_players.pop(p.discord_id, None)
+                return True, '{p} has been kicked by the group'.format(p=player_name)
+        # Someone who went missing after their lobby formed holds up everyone else in it
+        for queue in self.get_matchmaker_lobbies(matchmaker):
+            if queue.progress.vote_complete:
+                continue
             for p in queue.players:
                 if p.display_name == player_name:
-                    if queue.kick_vote is None:
-                        queue.kick_vote = KickVote(p)
-                        await ctx.channel.send('Vote has been initiated to kick {p}. One more player is needed to complete the kick'.format(p=player_name))
-                        return
-                    else:
-                        if queue.progress.filled:
-                            await ctx.channel.send(
-                                "Voting already began before anyone noticed {p} was missing. Resetting the queue to empty. Blame {p}".format(p=player_name))
-                            await self.clean_up_queue_channels(ctx.guild)
-                            self.match_queues[queue_id] = MatchQueue(
-                                ctx=ctx,
-                                team_size=queue.team_size,
-                                game=queue.game)
-                            await ctx.channel.send("Queue has been cleared. Good to go again")
-                            return
-                        queue.remove_player(p)
-                        queue.kick_vote = None
-                        await ctx.channel.send('{p} has been kicked by the group'.format(p=player_name))
-                        return
-            await ctx.channel.send('{p} was not found in the queue. Check spelling/capitalization and try again. Make sure you are using this from a channel other than "pick-teams"'.format(p=player_name))
+                    kicked, vote_msg = queue.vote_to_kick(p, voter_id, self.bot.timers)
+                    if not kicked:
+                        return False, vote_msg
+                    self.close_lobby(queue)
+                    return False, "Voting already began before anyone noticed {p} was missing. Lobby {n} has been cleared. Blame {p}".format(
+                        p=player_name, n=queue.queue_id.lobby)
+        return False, '{p} was not found in the queue. Check spelling/capitalization and try again. Make sure you are using this from a channel other than "pick-teams"'.format(p=player_name)
 
 
-    @commands.command(name='leave', help="Leave the existing queue")
+    @commands.command(name='leave', help="Leave the queue you are waiting in")
     async def leave_queue(self, ctx:commands.Context):
-        queue_id = QueueIdentifier(ctx=ctx)
-        if queue_id in self.match_queues:
-            queue = self.match_queues[queue_id]
-            player = await self.bot.get_player_from_db(ctx.author, ctx.guild.id, queue.game)
-            _, leave_msg = await queue.try_remove_player(ctx, player)
-            await ctx.channel.send(leave_msg)
-            self.bot.save_players()
+        matchmaker = self.matchmakers.get(self.waiting_players.get(ctx.author.id))
+        if matchmaker is None:
+            if self.get_players_queues(ctx.author.id):
+                await ctx.channel.send('Its too late, your lobby filled. You messed up. Okay, mistakes happen... Just finish the voting and reset the lobby because this situation is too complicated for me.')
+            elif self.get_matchmaker(ctx) is None:
+                await ctx.channel.send("No queue exists in this channel yet")
+            else:
+                await ctx.channel.send("LMAO YOU ARE TRYING TO QUIT AND YOU NEVER EVEN STARTED")
+            return
+        player = await self.bot.get_player_from_db(ctx.author, ctx.guild.id, matchmaker.game)
+        removed, leave_msg = matchmaker.try_remove_player(player)
+        if removed:
+            self.waiting_players.pop(player.discord_id, None)
+            self.touch_matchmaker(matchmaker)
+            await self.update_player_count(ctx, matchmaker)
         else:
-            await ctx.channel.send("No queue exists in this channel yet")
+            await ctx.channel.send(leave_msg)
+        self.bot.save_players()
 
-    async def test_queue(self, queue):
+    def test_queue(self, matchmaker:Matchmaker):
         for i in list(range(self.number_fakes)):
             new_player = self.bot.get_fake_player(
                 "Player {j}".format(j=i),
                 "Display {j}".format(j=i),
-                queue.queue_id.guild_id)
-            _, add_msg = await  queue.try_add_fake(new_player)
+                matchmaker.queue_id.guild_id)
+            matchmaker.try_add_player(new_player)
 
 
-    @commands.command(name='q', help="Add yourself to the existing queue")
+    @commands.command(name='q', help="Add yourself to the queue. Works from any channel when the server only has one queue")
     async def queue(self, ctx:commands.Context):
-        queue_id = QueueIdentifier(ctx=ctx)
-        if queue_id in self.match_queues:
-            queue = self.match_queues[queue_id]
-            player = await self.bot.get_player_from_db(ctx.author, ctx.guild.id, queue.game)
-            _, add_msg = await queue.try_add_player(ctx, player)
+        matchmaker = self.get_matchmaker(ctx)
+        if matchmaker is None:
+            guild_matchmakers = self.guild_matchmakers.get(ctx.guild.id, {})
+            if len(guild_matchmakers) > 0:
+                channels = [self.bot.get_channel(q.channel_id) for q in guild_matchmakers]
+                await ctx.channel.send("Queues are being held in {channels}. Please head to one of them and try again".format(
+                    channels=', '.join(c.name for c in channels if c is not None)))
+                return
+            await ctx.channel.send("No queue exists in this channel yet. Create one first!")
+            return
+
+        player = await self.bot.get_player_from_db(ctx.author, ctx.guild.id, matchmaker.game)
+        # Nothing below awaits until the player is in the pool and any full lobby has been taken out of it,
+        # so a burst of joins can never see the same pool twice
+        queue_ids = self.get_players_queues(ctx.author.id)
+        if queue_ids and self.match_queues[queue_ids[0]].progress.state != LobbyState.FINISHED:
+            await ctx.channel.send("You are already in lobby {n}. Finish that match first".format(n=queue_ids[0].lobby))
+            return
+        if ctx.author.id in self.waiting_players:
+            await ctx.channel.send("Hold your horses, you already joined the conga line")
+            return
+        added, add_msg = matchmaker.try_add_player(player)
+        if not added:
             await ctx.channel.send(add_msg)
-            if self.testing and (len(queue.players) + self.number_fakes == queue.team_size * 2):
-                await self.test_queue(queue)
-            if queue.progress.filled:
-                teams_chosen = await queue.do_roll_call_and_pick_teams(ctx, testing=self.testing)
-                if teams_chosen:
-                    await queue.add_voice_channels(ctx)
-                else:
-                    await self.clean_up_queue_channels(ctx.guild)
-                    self.match_queues[queue_id] = MatchQueue(
-                        ctx=ctx,
-                        team_size=queue.team_size,
-                        game=queue.game)
-                    await ctx.channel.send("Queue has been cleared. Good to go again")
-            return
-
-        if any([ctx.guild.id == k.guild_id for k,v in self.match_queues.items()]):
-            queue_id, _ = self.get_current_guild_queues(ctx.guild.id)[0]
-            channel = await self.bot.fetch_channel(queue_id.channel_id)
-            await ctx.channel.send("This queue is being held in {channel}. Please head there and try again".format(channel=channel.name))
-            return
-
-        await ctx.channel.send("No queue exists in this channel yet. Create one first!")
-
-    @commands.command(name='rollcall', help="List the players that are in the current queue")
+            return
+        self.waiting_players[player.discord_id] = matchmaker.queue_id
+        if queue_ids:
+            self.leave_finished_lobby(player.discord_id, self.match_queues[queue_ids[0]])
+        if self.testing and len(matchmaker) + self.number_fakes == matchmaker.lobby_size:
+            self.test_queue(matchmaker)
+        self.touch_matchmaker(matchmaker)
+        lobbies = self.form_lobbies(matchmaker)
+
+        lobby_channel = self._get_lobby_channel(ctx, matchmaker)
+        for queue in lobbies:
+            queue.start_lobby(self.run_lobby(lobby_channel, queue.queue_id, queue))
+        await self.update_player_count(ctx, matchmaker)
+        if lobbies and lobby_channel.id != ctx.channel.id:
+            await ctx.channel.send("{n} has been filled! Head over to {c} for roll call".format(
+                n=', '.join("Lobby {n}".format(n=q.queue_id.lobby) for q in lobbies), c=lobby_channel.name))
+
+    def form_lobbies(self, matchmaker:Matchmaker) -> List[MatchQueue]:
+        # Each full set of waiting players becomes its own lobby, whoever is left over waits for the next one
+        lobbies = []
+        for players in matchmaker.form_lobbies():
+            queue_id = matchmaker.next_lobby_id()
+            queue = MatchQueue(
+                guild_id=queue_id.guild_id,
+                channel_id=queue_id.channel_id,
+                lobby=queue_id.lobby,
+                team_size=matchmaker.team_size,
+                game=matchmaker.game,
+                balanced=matchmaker.balanced)
+            for p in players:
+                queue.add_player(p)
+                self.waiting_players.pop(p.discord_id, None)
+            self.set_queue(queue_id, queue)
+            lobbies.append(queue)
+        return lobbies
+
+    def _get_lobby_channel(self, ctx:commands.Context, matchmaker:Matchmaker) -> discord.TextChannel:
+        # Roll call and picking always happen in the matchmaker's own channel, even when the last player joined from elsewhere
+        if ctx.channel.id == matchmaker.queue_id.channel_id:
+            return ctx.channel
+        channel = self.bot.get_channel(matchmaker.queue_id.channel_id)
+        return channel if channel is not None else ctx.channel
+
+    async def update_player_count(self, ctx:commands.Context, matchmaker:Matchmaker):
+        await matchmaker.update_player_count(self._get_lobby_channel(ctx, matchmaker))
+
+    async def run_lobby(self, channel:discord.TextChannel, queue_id:QueueIdentifier, queue:MatchQueue):
+        if queue.rollcall is None and queue.picker is None:
+            await channel.send("Lobby {n} has been filled! Roll call will start soon!".format(n=queue_id.lobby))
+        recent_teams = self.recent_teams.setdefault(queue_id.guild_id, deque(maxlen=RECENT_TEAMS_KEPT))
+        try:
+            teams_chosen = await queue.do_roll_call_and_pick_teams(
+                channel, self.bot, self.get_voice_pool(channel.guild), testing=self.testing, recent_teams=recent_teams)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("Lobby %s failed", queue_id)
+            queue.progress.errored = True
+            teams_chosen = False
+        if teams_chosen:
+            recent_teams.append(frozenset(p.discord_id for p in queue.team_1))
+            recent_teams.append(frozenset(p.discord_id for p in queue.team_2))
+            self.voice_channel_queues[queue.team_1_vc.id] = queue
+            self.voice_channel_queues[queue.team_2_vc.id] = queue
+            # Voice events only reach the lobby from here on, anyone who got to their team chat sooner is counted off the channels
+            await queue.update_voice_status(queue.recount_arrivals())
+        elif self.match_queues.get(queue_id) is queue:
+            self.close_lobby(queue)
+
+    def leave_finished_lobby(self, member_id:int, queue:MatchQueue):
+        # Going back in line leaves the finished match behind, the last player out closes its lobby
+        del self.player_queues[member_id]
+        if any(self.player_queues.get(p.discord_id) == queue.queue_id for p in queue.players):
+            self.finished_queues[member_id] = queue.queue_id
+        else:
+            self.close_lobby(queue)
+
+    def close_lobby(self, queue:MatchQueue):
+        queue.cancel_lobby()
+        self.remove_queue(queue.queue_id)
+        queue.release_voice_channels(self.voice_pools.get(queue.queue_id.guild_id))
+
+    def get_voice_pool(self, guild:discord.Guild) -> VoiceChannelPool:
+        if guild.id not in self.voice_pools:
+            self.voice_pools[guild.id] = VoiceChannelPool(guild)
+        return self.voice_pools[guild.id]
+
+    def touch_matchmaker(self, matchmaker:Matchmaker):
+        # Queues that nobody joins or leaves for a while are emptied
+        if matchmaker.idle_timer is not None:
+            matchmaker.idle_timer.cancel()
+        matchmaker.idle_timer = self.bot.timers.call_later(IDLE_QUEUE_TIMEOUT, lambda: self.expire_idle_matchmaker(matchmaker))
+
+    def expire_idle_matchmaker(self, matchmaker:Matchmaker):
+        if self.matchmakers.get(matchmaker.queue_id) is not matchmaker or len(matchmaker) < 1:
+            return
+        for p in matchmaker.clear():
+            if self.waiting_players.get(p.discord_id) == matchmaker.queue_id:
+                del self.waiting_players[p.discord_id]
+        if matchmaker.player_count_message is not None:
+            matchmaker.player_count_message.update(matchmaker.get_roll_call_message())
+        channel = self.bot.get_channel(matchmaker.queue_id.channel_id)
+        if channel is not None:
+            self.bot.loop.create_task(channel.send("The queue sat idle for too long and has been cleared"))
+
+    # Snapshots
+    def get_snapshot_changes(self) -> Tuple[Dict[str, dict], Dict[str, tuple]]:
+        # Every live row's stamp, and the snapshot of only those rows whose stamp moved since the last save
+        live: List[Tuple[str, typing.Union[Matchmaker, MatchQueue]]] = []
+        for queue_id, matchmaker in self.matchmakers.items():
+            live.append(('matchmaker {g} {c}'.format(g=queue_id.guild_id, c=queue_id.channel_id), matchmaker))
+        for queue_id, queue in self.match_queues.items():
+            if queue.progress.state != LobbyState.CANCELLED:
+                live.append(('lobby {g} {c} {l}'.format(g=queue_id.guild_id, c=queue_id.channel_id, l=queue_id.lobby), queue))
+        changed = {}
+        stamps = {}
+        for key, item in live:
+            stamps[key] = item.snapshot_stamp()
+            if self._snapshot_stamps.get(key) != stamps[key]:
+                changed[key] = item.to_snapshot()
+        return changed, stamps
+
+    async def save_snapshot(self):
+        changed, stamps = self.get_snapshot_changes()
+        try:
+            written = await self.bot.snapshots.save(changed, stamps)
+        except sqlite3.Error:
+            log.exception("Could not save the lobby snapshot")
+            # Nothing is known to be on disk, the next save writes every row again
+            self._snapshot_stamps = {}
+            return
+        self._snapshot_stamps = stamps
+        if written:
+            log.debug("Snapshot updated %s rows", written)
+
+    async def _snapshot_loop(self):
+        await self.bot.wait_until_ready()
+        try:
+            await self.restore_snapshot()
+        except Exception:
+            log.exception("Could not restore the lobby snapshot")
+        while True:
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+            await self.save_snapshot()
+
+    async def restore_snapshot(self):
+        state = await self.bot.snapshots.load()
+        for key, data in state.items():
+            channel = self.bot.get_channel(data['channel_id'])
+            if channel is None:
+                log.info("Dropping snapshot %s, its channel is gone", key)
+                continue
+            if key.startswith('matchmaker'):
+                await self._restore_matchmaker(channel, data)
+            else:
+                await self._restore_lobby(channel, data)
+        log.info("Restored %s queues and %s lobbies", len(self.matchmakers), len(self.match_queues))
+
+    async def _restore_players(self, guild:discord.Guild, game:typing.Union[str, None], refs:List[list]) -> List[typing.Union[Player, None]]:
+        players = []
+        for discord_id, discord_name, display_name in refs:
+            if discord_id is None:
+                players.append(self.bot.get_fake_player(discord_name, display_name, guild.id))
+                continue
+            member = guild.get_member(discord_id)
+            if member is None:
+                try:
+                    member = await guild.fetch_member(discord_id)
+                except discord.HTTPException:
+                    players.append(None)
+                    continue
+            players.append(await self.bot.get_player_from_db(member, guild.id, game))
+        return players
+
+    async def _restore_matchmaker(self, channel:discord.TextChannel, data:dict):
+        matchmaker = Matchmaker(data['guild_id'], data['channel_id'], team_size=data['team_size'], game=data['game'], balanced=data['balanced'])
+        matchmaker.lobbies_formed = data['lobbies_formed']
+        for p in await self._restore_players(channel.guild, matchmaker.game, data['waiting']):
+            if p is not None and matchmaker.add(p) and p.discord_id is not None:
+                self.waiting_players[p.discord_id] = matchmaker.queue_id
+        self.set_matchmaker(matchmaker)
+        if len(matchmaker) > 0:
+            self.touch_matchmaker(matchmaker)
+        msg = await fetch_message(channel, data['player_count_message_id'])
+        if msg is not None:
+            matchmaker.player_count_message = MessageUpdater(msg)
+            matchmaker.player_count_message.update(matchmaker.get_roll_call_message())
+
+    async def _restore_lobby(self, channel:discord.TextChannel, data:dict):
+        players = await self._restore_players(channel.guild, data['game'], data['players'])
+        if any(p is None for p in players):
+            log.info("Dropping lobby %s, a player has left the server", data['lobby'])
+            await channel.send("Lobby {n} could not be picked back up after the restart because someone left the server".format(n=data['lobby']))
+            return
+        queue = MatchQueue(
+            guild_id=data['guild_id'],
+            channel_id=data['channel_id'],
+            lobby=data['lobby'],
+            team_size=data['team_size'],
+            game=data['game'],
+            balanced=data['balanced'])
+        for p in players:
+            queue.add_player(p)
+        queue.restore_snapshot(data, testing=self.testing)
+        queue.voting_channel = channel
+        self.set_queue(queue.queue_id, queue)
+        if not queue.progress.vote_complete:
+            # Roll call or picking carries on in its old message
+            queue.start_lobby(self.run_lobby(channel, queue.queue_id, queue))
+            return
+
+        voice_pool = self.get_voice_pool(channel.guild)
+        vcs = [self.bot.get_channel(data['team_1_vc']), self.bot.get_channel(data['team_2_vc'])]
+        if all(vc is not None for vc in vcs):
+            voice_pool.claim(vcs)
+            queue.team_1_vc, queue.team_2_vc = vcs
+        elif queue.progress.state != LobbyState.FINISHED:
+            await queue.add_voice_channels(voice_pool)
+        if queue.team_1_vc is None:
+            return
+        self.voice_channel_queues[queue.team_1_vc.id] = queue
+        self.voice_channel_queues[queue.team_2_vc.id] = queue
+        # Joins and departures while the bot was away are read straight off the channels
+        queue.recount_arrivals()
+        if queue.progress.state in (LobbyState.WAITING_FOR_PLAYERS, LobbyState.READY):
+            msg = await fetch_message(channel, data['voice_status_message_id'])
+            if msg is None:
+                msg = await channel.send(embed=queue.get_voice_status_page())
+            queue.voice_status = MessageUpdater(msg)
+            queue.voice_status.update(queue.get_voice_status_page())
+
+    def cog_unload(self):
+        self._snapshot_task.cancel()
+        self.bot.metrics.remove_gauge('queuebot_lobbies')
+        self.bot.metrics.remove_gauge('queuebot_waiting_players')
+        for matchmaker in self.matchmakers.values():
+            matchmaker.close()
+        for queue in self.match_queues.values():
+            queue.cancel_lobby()
+
+    @commands.command(
+        name='result',
+        help="Report which team won (1 or 2). Both captains must report the same result before it counts",
+        brief='Report the result of a match')
+    async def report_result(self, ctx:commands.Context, team:int):
+        queue_ids = self.get_players_queues(ctx.author.id)
+        queue = self.match_queues.get(queue_ids[0]) if queue_ids else None
+        if queue is None:
+            await ctx.channel.send("There is no match to report a result for")
+            return
+        async with queue.lock:
+            recorded, msg = queue.report_result(ctx.author.id, team)
+            if recorded:
+                try:
+                    await self.bot.record_match_result(
+                        queue.queue_id.guild_id, queue.game, queue.team_1, queue.team_2, queue.result_report.winning_team)
+                except sqlite3.Error:
+                    # The match stays queued with the players it changed, the flush loop writes them together later
+                    log.exception("Saving the result of %s failed", queue.queue_id)
+        await ctx.channel.send(msg)
+
+    @commands.command(
+        name='history',
+        help="Show the most recent matches for yourself or the member you mention. Add a game name to see another game's matches",
+        brief='Show recent matches')
+    async def match_history(self, ctx:commands.Context, member:typing.Optional[discord.Member]=None, *, game:str=None):
+        member = ctx.author if member is None else member
+        records = await self.bot.history.get_player_history(member.id, ctx.guild.id, game, page_size=10)
+        if len(records) < 1:
+            await ctx.channel.send("No recorded matches for {p} yet".format(p=member.display_name))
+            return
+        lines = ["{r} - with {t} against {o}".format(
+            r='Win' if r.won else 'Loss',
+            t=self._get_member_names(ctx.guild, r.teammates) or 'nobody',
+            o=self._get_member_names(ctx.guild, r.opponents) or 'nobody') for r in records]
+        form = ''.join('W' if r.won else 'L' for r in records[:5])
+        embed = discord.Embed(title="Recent matches for {p}".format(p=member.display_name), description='\n'.join(lines))
+        embed.set_footer(text="Recent form: {f}".format(f=form))
+        await ctx.channel.send(embed=embed)
+
+    @commands.command(
+        name='h2h',
+        help="Show your record in matches played against the member you mention",
+        brief='Head to head record')
+    async def head_to_head(self, ctx:commands.Context, member:discord.Member, *, game:str=None):
+        wins, losses = await self.bot.history.get_head_to_head(ctx.author.id, member.id, ctx.guild.id, game)
+        await ctx.channel.send("{p} vs {o}: {w} wins, {l} losses".format(
+            p=ctx.author.display_name, o=member.display_name, w=wins, l=losses))
+
+    @staticmethod
+    def _get_member_names(guild:discord.Guild, member_ids:List[int]) -> str:
+        members = [guild.get_member(m) for m in member_ids]
+        return ', '.join(m.display_name for m in members if m is not None)
+
+    @commands.command(
+        name='leaderboard',
+        help="Show the standings. Optionally give a game and end with one of: wins, winrate, streak, rating",
+        brief='Show the leaderboard')
+    async def leaderboard(self, ctx:commands.Context, *, args:str=None):
+        words = args.split() if args is not None else []
+        metric = 'rating'
+        if words and words[-1].lower() in LEADERBOARD_METRICS:
+            metric = words.pop().lower()
+        game = ' '.join(words) or None
+        board = await self.bot.get_leaderboard(ctx.guild.id, game)
+        await EmbeddedLeaderboard(board, metric, game, ctx.author.id).send_message(ctx)
+
+    @commands.command(name='rollcall', help="List the players waiting in this server's queues")
     async def number_players(self, ctx:commands.Context):
-        guild_queues = self.get_current_guild_queues(ctx.guild.id)
-        if len(guild_queues) > 0:
-            for k,v in guild_queues:
-                roll_call_embed:discord.Embed = v.get_roll_call_message()
-                await ctx.channel.send(embed=roll_call_embed)
+        for matchmaker in self.guild_matchmakers.get(ctx.guild.id, {}).values():
+            roll_call_embed:discord.Embed = matchmaker.get_roll_call_message()
+            await ctx.channel.send(embed=roll_call_embed)
 
 
     @commands.command(
@@ -164,11 +524,11 @@ class QueueManagerCog(commands.Cog):
         help="Get moved to your assigned team chat. Will not work until teams have been chosen",
         brief="Get moved to your assigned team chat.")
     async def go_to_team_chat(self, ctx:commands.Context):
-        queue_id = QueueIdentifier(ctx=ctx)
-        if queue_id not in self.match_queues:
+        queue_ids = self.get_players_queues(ctx.author.id)
+        if not queue_ids:
             await ctx.channel.send("There must be a queue and team selection must be done before using this command")
             return
-        queue = self.match_queues[queue_id]
+        queue = self.match_queues[queue_ids[0]]
 
         if not queue.progress.vote_complete:
             await ctx.channel.send("Teams haven't been selected yet. Give it time")
@@ -182,48 +542,74 @@ class QueueManagerCog(commands.Cog):
             await ctx.author.move_to(queue.team_2_vc)
 
     @commands.Cog.listener()
+    @timed_listener
     async def on_voice_state_update(self, member:discord.Member, before:discord.VoiceState, after:discord.VoiceState):
-        # Roll call or earlier
-        if after.channel is None:
-            return
-        guild_id = member.guild.id
-        current_queues = self.get_current_guild_queues(guild_id)
-        if len(current_queues) < 1:
+        # Only joins to and departures from a queue's team chats matter, everything else is dropped here
+        queue = self.voice_channel_queues.get(after.channel.id) if after.channel is not None else None
+        if queue is None and before.channel is not None:
+            queue = self.voice_channel_queues.get(before.channel.id)
+        if queue is None:
             return
-        queue_id, queue = current_queues[0]
         # bail if queue not filled
         if not queue.progress.filled:
             return
 
         await queue.handle_relevant_voice_event(member, before, after)
 
-    def get_current_guild_queues(self, guild_id:int) -> List[Tuple[QueueIdentifier, MatchQueue]]:
-        queues = [(k,v) for k,v in self.match_queues.items() if k.guild_id == guild_id]
-        return queues
-
-    def get_players_queues(self, member_id):
-        queue_ids = []
-        for k,v in self.match_queues:
-            if any([x.discord_id == member_id for x in v.players]):
-                queue_ids.append(k)
-        return queue_ids
-
     @staticmethod
-    async def clean_up_queue_channels(guild:discord.Guild):
-        existing_cat:discord.CategoryChannel = discord.utils.find(lambda x: x.name == "Custom Games", guild.categories)
-        if existing_cat is not None:
-            channels = existing_cat.channels
-            for channel in channels:
-                try:
-                    print(channel.name)
-                    await channel.delete()
-                except AttributeError:
-                    pass
-            await existing_cat.delete()
-
-
-
-
-
-
+    def parse_queue_mode(game:typing.Union[str, None]) -> Tuple[typing.Union[str, None], bool]:
+        if game is None:
+            return None, False
+        words = game.split()
+        if words and words[-1].lower() == 'balanced':
+            return ' '.join(words[:-1]) or None, True
+        return game, False
 
+    def get_current_guild_queues(self, guild_id:int) -> List[Tuple[QueueIdentifier, MatchQueue]]:
+        return list(self.guild_queues.get(guild_id, {}).items())
+
+    def get_matchmaker(self, ctx:commands.Context) -> typing.Union[Matchmaker, None]:
+        # A server with a single queue takes joins from any of its channels
+        matchmaker = self.matchmakers.get(QueueIdentifier(ctx=ctx))
+        if matchmaker is None:
+            guild_matchmakers = self.guild_matchmakers.get(ctx.guild.id, {})
+            if len(guild_matchmakers) == 1:
+                matchmaker = next(iter(guild_matchmakers.values()))
+        return matchmaker
+
+    def get_matchmaker_lobbies(self, matchmaker:Matchmaker) -> List[MatchQueue]:
+        return [q for q_id, q in self.get_current_guild_queues(matchmaker.queue_id.guild_id)
+                if q_id.channel_id == matchmaker.queue_id.channel_id]
+
+    def get_players_queues(self, member_id) -> List[QueueIdentifier]:
+        queue_id = self.player_queues.get(member_id)
+        return [queue_id] if queue_id is not None else []
+
+    def set_matchmaker(self, matchmaker:Matchmaker):
+        self.matchmakers[matchmaker.queue_id] = matchmaker
+        self.guild_matchmakers.setdefault(matchmaker.queue_id.guild_id, {})[matchmaker.queue_id] = matchmaker
+
+    def set_queue(self, queue_id:QueueIdentifier, queue:MatchQueue):
+        self.remove_queue(queue_id)
+        self.match_queues[queue_id] = queue
+        self.guild_queues.setdefault(queue_id.guild_id, {})[queue_id] = queue
+        for p in queue.players:
+            if p.discord_id is not None:
+                self.player_queues[p.discord_id] = queue_id
+
+    def remove_queue(self, queue_id:QueueIdentifier):
+        queue = self.match_queues.pop(queue_id, None)
+        if queue is None:
+            return
+        guild_queues = self.guild_queues.get(queue_id.guild_id, {})
+        guild_queues.pop(queue_id, None)
+        if not guild_queues:
+            self.guild_queues.pop(queue_id.guild_id, None)
+        for vc in (queue.team_1_vc, queue.team_2_vc):
+            if vc is not None and self.voice_channel_queues.get(vc.id) is queue:
+                del self.voice_channel_queues[vc.id]
+        for p in queue.players:
+            if self.player_queues.get(p.discord_id) == queue_id:
+                del self.player_queues[p.discord_id]
+            if self.finished_queues.get(p.discord_id) == queue_id:
+                del self.finished_queues[p.discord_id]
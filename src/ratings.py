@@ -0,0 +1,64 @@
+import logging
+from typing import Dict, Iterable, List, Tuple
+
+from src.player import Player, DEFAULT_RATING
+
+log = logging.getLogger(__name__)
+
+class EloRatings:
+    # Team Elo: each side is rated by its average, and every player on a side moves by the same amount
+    def __init__(self, k_factor:float=32.0, scale:float=400.0, initial_rating:float=DEFAULT_RATING):
+        self.k_factor = k_factor
+        self.scale = scale
+        self.initial_rating = initial_rating
+
+    def expected_score(self, rating:float, opponent_rating:float) -> float:
+        return 1.0 / (1.0 + 10.0 ** ((opponent_rating - rating) / self.scale))
+
+    def get_rating_change(self, winner_ratings:List[float], loser_ratings:List[float]) -> float:
+        winner_avg = sum(winner_ratings) / len(winner_ratings)
+        loser_avg = sum(loser_ratings) / len(loser_ratings)
+        return self.k_factor * (1.0 - self.expected_score(winner_avg, loser_avg))
+
+    def rate_match(self, winners:List[Player], losers:List[Player]):
+        if not winners or not losers:
+            return
+        change = self.get_rating_change([p.rating for p in winners], [p.rating for p in losers])
+        for p in winners:
+            p.rating += change
+        for p in losers:
+            p.rating -= change
+
+    def replay(self, matches:Iterable[Tuple[List[int], List[int]]]) -> Dict[int, float]:
+        # Ratings from scratch over a whole history, oldest match first. Each match depends on the one before,
+        # so this is a tight sequential loop over a flat list instead of per-player objects.
+        index: Dict[int, int] = {}
+        ratings: List[float] = []
+        k = self.k_factor
+        scale = self.scale
+        initial = self.initial_rating
+        for winner_ids, loser_ids in matches:
+            if not winner_ids or not loser_ids:
+                continue
+            winners = []
+            for d in winner_ids:
+                i = index.get(d)
+                if i is None:
+                    i = index[d] = len(ratings)
+                    ratings.append(initial)
+                winners.append(i)
+            losers = []
+            for d in loser_ids:
+                i = index.get(d)
+                if i is None:
+                    i = index[d] = len(ratings)
+                    ratings.append(initial)
+                losers.append(i)
+            winner_avg = sum([ratings[i] for i in winners]) / len(winners)
+            loser_avg = sum([ratings[i] for i in losers]) / len(losers)
+            change = k * (1.0 - 1.0 / (1.0 + 10.0 ** ((loser_avg - winner_avg) / scale)))
+            for i in winners:
+                ratings[i] += change
+            for i in losers:
+                ratings[i] -= change
+        return {d: ratings[i] for d, i in index.items()}
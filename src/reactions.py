@@ -0,0 +1,27 @@
+import asyncio
+import logging
+from typing import Dict
+
+import discord
+
+log = logging.getLogger(__name__)
+
+class ReactionDispatcher:
+    def __init__(self):
+        # message id -> reactions waiting to be handled by the roll call or picker that owns the message
+        self.sessions: Dict[int, asyncio.Queue] = {}
+
+    def register(self, message_id:int) -> asyncio.Queue:
+        reactions = asyncio.Queue()
+        self.sessions[message_id] = reactions
+        return reactions
+
+    def unregister(self, message_id:int):
+        self.sessions.pop(message_id, None)
+
+    def dispatch(self, payload:discord.RawReactionActionEvent) -> bool:
+        reactions = self.sessions.get(payload.message_id)
+        if reactions is None:
+            return False
+        reactions.put_nowait(payload)
+        return True
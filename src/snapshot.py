@@ -0,0 +1,62 @@
+import asyncio
+import json
+import logging
+import sqlite3
+from concurrent.futures import Executor
+from typing import Dict, Iterable, List, Tuple
+
+log = logging.getLogger(__name__)
+
+# One JSON row per live matchmaker or lobby, written next to the players so a restart can pick up where it left off
+_CREATE_SNAPSHOTS = """
+CREATE TABLE IF NOT EXISTS lobby_snapshots (
+    key TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+) WITHOUT ROWID
+"""
+
+
+class LobbySnapshots:
+    def __init__(self, conn:sqlite3.Connection, executor:Executor):
+        self._conn = conn
+        self.executor = executor
+        # What is on disk right now, so a save only writes the rows that changed since the last one
+        self._written: Dict[str, str] = {}
+        self._lock = asyncio.Lock()
+        conn.execute(_CREATE_SNAPSHOTS)
+        conn.commit()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, func, *args)
+
+    async def load(self) -> Dict[str, dict]:
+        async with self._lock:
+            rows = await self._run(self._load)
+            self._written = dict(rows)
+        return {k: json.loads(d) for k, d in rows}
+
+    def _load(self) -> List[Tuple[str, str]]:
+        return [(r['key'], r['data']) for r in self._conn.execute("SELECT key, data FROM lobby_snapshots")]
+
+    async def save(self, changed:Dict[str, dict], live:Iterable[str]) -> int:
+        # Only the rows the caller says moved are encoded, anything on disk that is no longer live is deleted
+        encoded = [(k, json.dumps(v, separators=(',', ':'))) for k, v in changed.items()]
+        live = set(live)
+        async with self._lock:
+            changed = [(k, d) for k, d in encoded if self._written.get(k) != d]
+            removed = [(k,) for k in self._written if k not in live]
+            if not changed and not removed:
+                return 0
+            await self._run(self._save, changed, removed)
+            self._written.update(changed)
+            for (k,) in removed:
+                del self._written[k]
+        return len(changed) + len(removed)
+
+    def _save(self, changed:List[Tuple[str, str]], removed:List[Tuple[str]]):
+        # One transaction, a crash part way through leaves the previous snapshot untouched
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO lobby_snapshots (key, data) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET data = excluded.data",
+                changed)
+            self._conn.executemany("DELETE FROM lobby_snapshots WHERE key = ?", removed)
@@ -0,0 +1,58 @@
+import itertools
+from typing import Iterable, FrozenSet, List, Set, Tuple
+
+from src.player import Player
+
+# Splits whose rating gap is within this of the best gap count as ties
+TIE_TOLERANCE = 25.0
+
+
+def recent_teammate_pairs(recent_teams:Iterable[FrozenSet[int]]) -> Set[FrozenSet[int]]:
+    pairs = set()
+    for team in recent_teams:
+        pairs.update(frozenset(p) for p in itertools.combinations(sorted(team), 2))
+    return pairs
+
+
+def balance_teams(players:List[Player], recent_teams:Iterable[FrozenSet[int]]=()) -> Tuple[List[Player], List[Player]]:
+    team_size = len(players) // 2
+    ratings = [p.rating for p in players]
+    total = sum(ratings)
+    others = range(1, len(players))
+
+    # Exact search over every split. Player 0 is pinned to the first team so mirrored splits are only seen once,
+    # which leaves C(2n-1, n-1) candidates: 6435 for an 8v8.
+    candidates = []
+    best_gap = None
+    for rest in itertools.combinations(others, team_size - 1):
+        team_sum = ratings[0] + sum(ratings[i] for i in rest)
+        gap = abs(total - 2 * team_sum)
+        if best_gap is None or gap < best_gap:
+            best_gap = gap
+            candidates = [c for c in candidates if c[0] <= gap + TIE_TOLERANCE]
+        if gap <= best_gap + TIE_TOLERANCE:
+            candidates.append((gap, rest))
+
+    # Among near-equal splits prefer the one that breaks up people who just played together
+    repeat_pairs = recent_teammate_pairs(recent_teams)
+    _, first_team = min(candidates, key=lambda c: (_repeat_count(players, (0,) + c[1], repeat_pairs), c[0]))
+    first = set((0,) + first_team)
+    team_1 = [players[i] for i in range(len(players)) if i in first]
+    team_2 = [players[i] for i in range(len(players)) if i not in first]
+    # Highest rated player on each side is listed first and acts as captain
+    team_1.sort(key=lambda p: p.rating, reverse=True)
+    team_2.sort(key=lambda p: p.rating, reverse=True)
+    return team_1, team_2
+
+
+def _repeat_count(players:List[Player], team_1:Tuple[int, ...], repeat_pairs:Set[FrozenSet[int]]) -> int:
+    if not repeat_pairs:
+        return 0
+    first = set(team_1)
+    team_2 = [i for i in range(len(players)) if i not in first]
+    count = 0
+    for team in (team_1, team_2):
+        for a, b in itertools.combinations(team, 2):
+            if frozenset((players[a].discord_id, players[b].discord_id)) in repeat_pairs:
+                count += 1
+    return count
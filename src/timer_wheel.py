@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import typing
+from typing import Callable, List
+
+log = logging.getLogger(__name__)
+
+class WheelTimer:
+    __slots__ = ('deadline', 'tick', 'callback', 'cancelled')
+
+    def __init__(self, deadline:float, tick:int, callback:Callable[[], None]):
+        self.deadline = deadline
+        self.tick = tick
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    # Hierarchical wheel on the loop's monotonic clock. Level 0 slots are one tick wide, every level above
+    # covers a whole turn of the level below it, so inserting a timer or firing it is O(1).
+    def __init__(self, tick:float=0.5, slots:int=64, levels:int=4):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self._wheels: List[List[List[WheelTimer]]] = [[[] for _ in range(slots)] for _ in range(levels)]
+        self._current_tick = 0
+        self._start: typing.Union[float, None] = None
+        self._overflow: List[WheelTimer] = []
+        self._task: typing.Union[asyncio.Task, None] = None
+        self.active = 0
+
+    def call_at(self, deadline:float, callback:Callable[[], None]) -> WheelTimer:
+        loop = asyncio.get_event_loop()
+        if self._start is None:
+            self._start = loop.time()
+        if self._task is None or self._task.done():
+            # The wheel is empty while no task is running, so it can jump straight to the present
+            self._current_tick = int((loop.time() - self._start) // self.tick)
+            self._task = loop.create_task(self._run())
+        # Round up so nothing fires before its deadline
+        tick = max(self._current_tick + 1, -int(-(deadline - self._start) // self.tick))
+        timer = WheelTimer(deadline, tick, callback)
+        self._insert(timer)
+        self.active += 1
+        return timer
+
+    def call_later(self, delay:float, callback:Callable[[], None]) -> WheelTimer:
+        return self.call_at(asyncio.get_event_loop().time() + delay, callback)
+
+    def _insert(self, timer:WheelTimer):
+        ticks_away = timer.tick - self._current_tick
+        span = 1
+        for level in range(self.levels):
+            if ticks_away < span * self.slots:
+                slot = (max(timer.tick, self._current_tick) // span) % self.slots
+                self._wheels[level][slot].append(timer)
+                return
+            span *= self.slots
+        self._overflow.append(timer)
+
+    def _advance(self):
+        self._current_tick += 1
+        # Cascade timers from the level above whenever the level below wraps around
+        span = 1
+        for level in range(1, self.levels):
+            span *= self.slots
+            if self._current_tick % span != 0:
+                break
+            slot = (self._current_tick // span) % self.slots
+            timers, self._wheels[level][slot] = self._wheels[level][slot], []
+            for timer in timers:
+                self._insert(timer)
+        else:
+            if self._current_tick % (span * self.slots) == 0:
+                timers, self._overflow = self._overflow, []
+                for timer in timers:
+                    self._insert(timer)
+
+        slot = self._current_tick % self.slots
+        expired, self._wheels[0][slot] = self._wheels[0][slot], []
+        for timer in expired:
+            self.active -= 1
+            if timer.cancelled:
+                continue
+            try:
+                timer.callback()
+            except Exception:
+                log.exception("Timer callback failed")
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while self.active > 0:
+            next_tick_at = self._start + (self._current_tick + 1) * self.tick
+            await asyncio.sleep(max(0.0, next_tick_at - loop.time()))
+            # Catch up on every tick that passed while the loop was busy
+            while self._start + (self._current_tick + 1) * self.tick <= loop.time():
+                self._advance()
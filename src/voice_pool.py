@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import typing
+from typing import Dict, List, Sequence
+
+import discord
+
+from src.constants import VOICE_POOL_IDLE_KEPT
+
+log = logging.getLogger(__name__)
+
+CATEGORY_NAME = "Custom Games"
+
+
+class VoiceChannelPool:
+    # Team voice channels for one guild. They sit under a category that outlives matches and restarts, lobbies
+    # lease them and hand them back on reset, so a match normally starts without creating a single channel.
+    def __init__(self, guild:discord.Guild, idle_kept:int=VOICE_POOL_IDLE_KEPT):
+        self.guild = guild
+        self.idle_kept = idle_kept
+        self.category: typing.Union[discord.CategoryChannel, None] = discord.utils.find(
+            lambda c: c.name == CATEGORY_NAME, guild.categories)
+        self._idle: List[discord.VoiceChannel] = list(self.category.voice_channels) if self.category is not None else []
+        self._leased: Dict[int, discord.VoiceChannel] = {}
+        self._renames: Dict[int, asyncio.Task] = {}
+        self._lock = asyncio.Lock()
+
+    def _exists(self, channel:discord.abc.GuildChannel) -> bool:
+        return self.guild.get_channel(channel.id) is not None
+
+    async def _get_category(self) -> discord.CategoryChannel:
+        if self.category is None or not self._exists(self.category):
+            self.category = await self.guild.create_category(CATEGORY_NAME)
+            self._idle = []
+        return self.category
+
+    async def lease(self, names:Sequence[str]) -> List[discord.VoiceChannel]:
+        async with self._lock:
+            category = await self._get_category()
+            # Anyone still hanging around in an idle channel would be treated as a rat by the next lobby
+            self._idle = [c for c in self._idle if self._exists(c)]
+            free = [c for c in self._idle if len(c.members) == 0][:len(names)]
+            for c in free:
+                self._idle.remove(c)
+            created = await asyncio.gather(*[category.create_voice_channel(n) for n in names[len(free):]])
+            channels = free + list(created)
+            for c in channels:
+                self._leased[c.id] = c
+        for c, name in zip(channels, names):
+            self._rename_later(c, name)
+        return channels
+
+    def claim(self, channels:typing.Iterable[discord.VoiceChannel]):
+        # Channels a restored lobby was already using when the bot went down
+        for c in channels:
+            if c in self._idle:
+                self._idle.remove(c)
+            self._leased[c.id] = c
+
+    def release(self, channels:typing.Iterable[typing.Union[discord.VoiceChannel, None]]):
+        for c in channels:
+            if c is None or self._leased.pop(c.id, None) is None:
+                continue
+            if self._exists(c):
+                self._idle.append(c)
+        if len(self._idle) > self.idle_kept:
+            # A channel people are still talking in is kept until a later release finds it empty
+            extra = [c for c in self._idle[self.idle_kept:] if len(c.members) == 0]
+            self._idle = [c for c in self._idle if c not in extra]
+            if extra:
+                asyncio.get_event_loop().create_task(self._delete(extra))
+
+    def _rename_later(self, channel:discord.VoiceChannel, name:str):
+        # Channel renames have a tight rate limit of their own, the lobby never waits on one
+        pending = self._renames.pop(channel.id, None)
+        if pending is not None:
+            pending.cancel()
+        if channel.name != name:
+            self._renames[channel.id] = asyncio.get_event_loop().create_task(self._rename(channel, name))
+
+    async def _rename(self, channel:discord.VoiceChannel, name:str):
+        try:
+            await channel.edit(name=name)
+        except discord.HTTPException:
+            log.warning("Could not rename voice channel %s to %s", channel.id, name)
+        finally:
+            if self._renames.get(channel.id) is asyncio.current_task():
+                del self._renames[channel.id]
+
+    async def _delete(self, channels:List[discord.VoiceChannel]):
+        results = await asyncio.gather(*[c.delete() for c in channels], return_exceptions=True)
+        for c, result in zip(channels, results):
+            if isinstance(result, Exception):
+                log.warning("Could not delete voice channel %s: %s", c.id, result)
@@ -0,0 +1,106 @@
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import typing
+from types import FrameType
+
+from src.constants import LOOP_HEARTBEAT_INTERVAL, LOOP_LAG_THRESHOLD, PROFILE_SAMPLE_INTERVAL
+
+log = logging.getLogger(__name__)
+
+
+def _collapse(frame:FrameType) -> str:
+    # One line of the collapsed-stack format flamegraph.pl and speedscope read, outermost frame first
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{f}:{n}'.format(f=os.path.basename(code.co_filename), n=code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class LoopWatchdog:
+    # A heartbeat task on the loop and a thread that watches it. When the heartbeat goes quiet the thread
+    # reads the loop thread's stack while it is still stuck, so the log names whatever is blocking it.
+    def __init__(self, interval:float=LOOP_HEARTBEAT_INTERVAL, threshold:float=LOOP_LAG_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._beat = time.monotonic()
+        self._loop_thread: typing.Union[int, None] = None
+        self._task: typing.Union[asyncio.Task, None] = None
+        self._thread: typing.Union[threading.Thread, None] = None
+        self._stopped = threading.Event()
+        self._profile_lock = asyncio.Lock()
+
+    def start(self):
+        # Must be called from the loop's own thread
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.get_event_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._stopped.set()
+
+    async def _heartbeat(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            started = loop.time()
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.last_lag = loop.time() - started - self.interval
+            self.max_lag = max(self.max_lag, self.last_lag)
+            if self.last_lag >= self.threshold:
+                log.warning("Event loop was blocked for %.0f ms", self.last_lag * 1000)
+
+    def _watch(self):
+        reported = None
+        while not self._stopped.wait(self.interval):
+            beat = self._beat
+            blocked = time.monotonic() - beat - self.interval
+            if blocked < self.threshold or reported == beat:
+                continue
+            # Once per stall, the heartbeat logs how long it lasted when the loop gets going again
+            reported = beat
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = ''.join(traceback.format_stack(frame)) if frame is not None else 'no frame\n'
+            del frame
+            log.warning("Event loop blocked for %.0f ms so far, it is running:\n%s", blocked * 1000, stack)
+
+    def get_lag(self) -> typing.Dict[typing.Tuple[typing.Tuple[str, str], ...], float]:
+        return {(('stat', 'last'),): self.last_lag, (('stat', 'max'),): self.max_lag}
+
+    async def profile(self, seconds:float, interval:float=PROFILE_SAMPLE_INTERVAL) -> str:
+        # Samples the loop thread from the default executor while the loop carries on as usual
+        if self._loop_thread is None:
+            self._loop_thread = threading.get_ident()
+        async with self._profile_lock:
+            stacks = await asyncio.get_event_loop().run_in_executor(None, self._sample, seconds, interval)
+        return ''.join('{s} {n}\n'.format(s=s, n=n) for s, n in stacks.most_common())
+
+    def _sample(self, seconds:float, interval:float) -> typing.Counter[str]:
+        stacks: typing.Counter[str] = collections.Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None:
+                stacks[_collapse(frame)] += 1
+            del frame
+            time.sleep(interval)
+        return stacks
@@ -0,0 +1,56 @@
+import asyncio
+
+import discord
+import pytest
+
+from loadtest.fake_discord import FakeGuild, MockRest
+from loadtest.run import LoadTestBot
+from src.queue_cog import QueueManagerCog
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    # Lobbies still waiting on a roll call or a draft are dropped with the loop
+    pending = asyncio.all_tasks(loop)
+    for task in pending:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+    loop.close()
+
+
+@pytest.fixture
+def rest():
+    # Rate limit windows shrunk a thousandfold, so bursts still queue up behind each other without slowing the tests
+    return MockRest(latency=0.05, time_scale=0.001)
+
+
+@pytest.fixture
+def bot(loop, rest, tmp_path):
+    bot = LoadTestBot("!", data_path=str(tmp_path / 'players.db'), intents=discord.Intents.default())
+    # There is no gateway to log in to, so the snapshot loop would otherwise wait forever
+    bot._ready.set()
+    yield bot
+    bot.store.close()
+
+
+@pytest.fixture
+def guild(bot, rest) -> FakeGuild:
+    guild = FakeGuild(rest, 'guild', bot.dispatch)
+    bot.fake_guilds[guild.id] = guild
+    return guild
+
+
+@pytest.fixture
+def cog(loop, bot):
+    cog = QueueManagerCog(bot)
+    bot.add_cog(cog)
+    yield cog
+
+    # Unloading cancels lobby tasks, which needs to happen on the loop the way discord.py does it
+    async def unload():
+        cog.cog_unload()
+    loop.run_until_complete(unload())
+
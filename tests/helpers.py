@@ -0,0 +1,15 @@
+import asyncio
+import typing
+
+from loadtest.fake_discord import FakeContext, FakeMember, FakeTextChannel
+
+
+def context(bot, member:FakeMember, channel:FakeTextChannel) -> FakeContext:
+    return FakeContext(bot, member.guild, channel, member)
+
+
+async def until(predicate:typing.Callable[[], bool], timeout:float=10.0):
+    deadline = asyncio.get_event_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_event_loop().time() < deadline, "Timed out waiting for the lobby"
+        await asyncio.sleep(0.01)
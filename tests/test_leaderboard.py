@@ -0,0 +1,39 @@
+import bisect
+import random
+
+import pytest
+
+from src.leaderboard import RankIndex
+
+
+@pytest.mark.parametrize('initial', [0, 1, 2, 777], ids=lambda n: 'from_sorted{n}'.format(n=n))
+@pytest.mark.parametrize('seed', range(3))
+def test_rank_index_matches_a_sorted_list(initial, seed):
+    rng = random.Random(seed)
+    # Keys shaped like the leaderboard's, a score with plenty of ties and a unique id behind it
+    expected = sorted((-rng.randrange(50), i) for i in range(initial))
+    index = RankIndex.from_sorted(list(expected)) if initial else RankIndex()
+    next_id = initial
+
+    for _ in range(3000):
+        roll = rng.random()
+        if roll < 0.45 or not expected:
+            key = (-rng.randrange(50), next_id)
+            next_id += 1
+            index.insert(key)
+            bisect.insort(expected, key)
+        elif roll < 0.8:
+            key = expected.pop(rng.randrange(len(expected)))
+            assert index.remove(key)
+            assert not index.remove(key)
+        else:
+            key = rng.choice(expected)
+            assert index.rank(key) == expected.index(key)
+            assert index.rank((key[0], -1)) is None
+        assert len(index) == len(expected)
+        start = rng.randrange(len(expected) + 2)
+        count = rng.randrange(-1, 30)
+        assert index.slice(start, count) == expected[start:start + max(count, 0)]
+
+    assert index.slice(0, len(expected)) == expected
+    assert [index.rank(k) for k in expected] == list(range(len(expected)))
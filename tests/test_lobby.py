@@ -0,0 +1,109 @@
+import asyncio
+
+from loadtest.fake_discord import make_reaction
+from src.match_queue_session import LobbyState
+from tests.helpers import context, until
+
+
+async def fill_lobby(bot, cog, guild, channel, names):
+    members = [guild.add_member(n) for n in names]
+    for m in members:
+        await cog.queue(context(bot, m, channel))
+    queue = cog.match_queues[cog.player_queues[members[0].id]]
+    await until(lambda: queue.rollcall is not None and queue.rollcall.message_id in bot.reactions.sessions)
+    for m in members:
+        bot.reactions.dispatch(make_reaction(queue.rollcall.message_id, m, channel, '✅'))
+    return members, queue
+
+
+def team_vc(queue, member):
+    return queue.team_1_vc if any(p.discord_id == member.id for p in queue.team_1) else queue.team_2_vc
+
+
+def test_arrivals_before_the_voice_status_message_count(loop, bot, guild, cog):
+    channel = guild.add_text_channel('queue')
+
+    async def scenario():
+        await cog.new_queue(context(bot, guild.add_member('admin'), channel), 1)
+        members, queue = await fill_lobby(bot, cog, guild, channel, ['a', 'b'])
+        # Everyone is already in their team chat while the status message is still being sent
+        while queue.progress.state != LobbyState.WAITING_FOR_PLAYERS:
+            await asyncio.sleep(0)
+        assert queue.team_1_vc.id not in cog.voice_channel_queues
+        for m in members:
+            m.connect(team_vc(queue, m))
+        await until(lambda: queue.progress.ready_to_start)
+
+    loop.run_until_complete(scenario())
+
+
+def test_finished_lobby_closes_when_its_players_queue_again(loop, bot, guild, cog):
+    channel = guild.add_text_channel('queue')
+
+    async def scenario():
+        await cog.new_queue(context(bot, guild.add_member('admin'), channel), 1)
+        (a, b), queue = await fill_lobby(bot, cog, guild, channel, ['a', 'b'])
+        await until(lambda: queue.progress.vote_complete)
+        for m in (a, b):
+            m.connect(team_vc(queue, m))
+        await until(lambda: queue.progress.ready_to_start)
+        for m in (a, b):
+            await cog.report_result(context(bot, m, channel), 1)
+        assert queue.progress.state == LobbyState.FINISHED
+
+        # The first one back in line leaves the lobby open for !reset, the last one out closes it
+        a.connect(None)
+        await cog.queue(context(bot, a, channel))
+        assert cog.finished_queues == {a.id: queue.queue_id}
+        b.connect(None)
+        await cog.queue(context(bot, b, channel))
+        assert queue.queue_id not in cog.match_queues
+        assert not cog.finished_queues
+        assert not cog.voice_pools[guild.id]._leased
+        assert cog.match_queues[cog.player_queues[a.id]] is not queue
+
+    loop.run_until_complete(scenario())
+
+
+def test_result_is_recorded_once(loop, bot, guild, cog):
+    channel = guild.add_text_channel('queue')
+    writes = []
+    write_changes = bot._write_changes
+
+    def counted(records, matches):
+        writes.append(len(matches))
+        write_changes(records, matches)
+    bot._write_changes = counted
+
+    async def scenario():
+        await cog.new_queue(context(bot, guild.add_member('admin'), channel), 2, game='balanced')
+        members, queue = await fill_lobby(bot, cog, guild, channel, ['a', 'b', 'c', 'd'])
+        await until(lambda: queue.progress.vote_complete)
+        for m in members:
+            m.connect(team_vc(queue, m))
+        await until(lambda: queue.progress.ready_to_start)
+        by_id = {m.id: m for m in members}
+        captain_1, captain_2 = [by_id[d] for d in queue.captain_ids]
+        others = [m for m in members if m not in (captain_1, captain_2)]
+        await bot.flush_players()
+        writes.clear()
+
+        # Neither a player who isn't a captain nor two captains who disagree get a result recorded
+        await cog.report_result(context(bot, others[0], channel), 1)
+        await cog.report_result(context(bot, captain_1, channel), 2)
+        await cog.report_result(context(bot, captain_2, channel), 1)
+        assert queue.progress.state != LobbyState.FINISHED
+        assert not writes
+        # Then both agree at the same moment, and report it again for good measure
+        await asyncio.gather(*[cog.report_result(context(bot, m, channel), 1)
+                               for m in (captain_1, captain_2, captain_1, captain_2)])
+        await cog.report_result(context(bot, others[1], channel), 1)
+        assert queue.progress.state == LobbyState.FINISHED
+        assert writes == [1]
+        for p in queue.team_1:
+            assert (p.total_wins, p.total_losses) == (1, 0)
+        for p in queue.team_2:
+            assert (p.total_wins, p.total_losses) == (0, 1)
+        assert bot.store.connection.execute("SELECT COUNT(*) FROM matches").fetchone()[0] == 1
+
+    loop.run_until_complete(scenario())
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from loadtest.fake_discord import make_reaction
+from src.embeds import EmbeddedPicker
+from tests.helpers import until
+
+
+async def draft(bot, guild, team_size:int) -> EmbeddedPicker:
+    channel = guild.add_text_channel('pick-teams')
+    members = {}
+    players = []
+    for i in range(team_size * 2):
+        member = guild.add_member('player {i}'.format(i=i))
+        members[member.id] = member
+        players.append(await bot.get_player_from_db(member, guild.id, None))
+    picker = EmbeddedPicker(players, testing=True)
+    task = asyncio.get_event_loop().create_task(picker.send_message(channel, bot))
+    await until(lambda: picker.message_id in bot.reactions.sessions)
+    while picker.unplaced_players:
+        left = len(picker.unplaced_players)
+        captain = members[picker.current_captain.discord_id]
+        bot.reactions.dispatch(make_reaction(picker.message_id, captain, channel, picker.remaining_emojis[0]))
+        await until(lambda: len(picker.unplaced_players) < left)
+    assert await task
+    return picker
+
+
+@pytest.mark.parametrize('team_size', [4, 5])
+def test_draft_rest_calls(loop, bot, guild, rest, team_size):
+    loop.run_until_complete(draft(bot, guild, team_size))
+    picks = team_size * 2 - 2
+    # One message, every emoji added once up front, only the picked emoji cleared after each pick but the last,
+    # and the page edits made during the draft all folded into the final one
+    assert rest.calls == {
+        'POST /channels/{channel_id}/messages': 1,
+        'PUT /channels/{channel_id}/messages/{message_id}/reactions/{emoji}/@me': picks,
+        'DELETE /channels/{channel_id}/messages/{message_id}/reactions/{emoji}': picks - 1,
+        'PATCH /channels/{channel_id}/messages/{message_id}': 1,
+    }
+
+
+def test_resumed_draft_applies_picks_made_while_away(loop, bot, guild):
+    channel = guild.add_text_channel('pick-teams')
+
+    async def scenario():
+        members = [guild.add_member('player {i}'.format(i=i)) for i in range(6)]
+        players = [await bot.get_player_from_db(m, guild.id, None) for m in members]
+        by_id = {m.id: m for m in members}
+        before = EmbeddedPicker(list(players), testing=True)
+        msg = await channel.send()
+        # The bot went down after adding three of the four emojis, then both captains picked
+        for emoji in before.remaining_emojis[:3]:
+            await msg.add_reaction(emoji)
+        captain_1 = by_id[before.team_1[0].discord_id]
+        captain_2 = by_id[before.team_2[0].discord_id]
+        msg.react(captain_1, before.player_emojis[players[2]])
+        msg.react(captain_2, before.player_emojis[players[3]])
+
+        picker = EmbeddedPicker(list(players), testing=True, team_1=before.team_1, team_2=before.team_2, message_id=msg.id)
+        task = asyncio.get_event_loop().create_task(picker.send_message(channel, bot))
+        await until(lambda: msg.id in bot.reactions.sessions)
+        assert picker.team_1 == [players[0], players[2]]
+        assert picker.team_2 == [players[1], players[3]]
+        # The picked emojis are gone and the one that never got added is back
+        assert sorted(r.emoji for r in msg.reactions if r.me) == sorted(picker.remaining_emojis)
+        task.cancel()
+
+    loop.run_until_complete(scenario())
+
+
+def test_out_of_turn_reaction_can_be_made_again_on_your_turn(loop, bot, guild):
+    channel = guild.add_text_channel('pick-teams')
+
+    async def scenario():
+        members = [guild.add_member('player {i}'.format(i=i)) for i in range(6)]
+        by_id = {m.id: m for m in members}
+        players = [await bot.get_player_from_db(m, guild.id, None) for m in members]
+        picker = EmbeddedPicker(players, testing=True)
+        task = asyncio.get_event_loop().create_task(picker.send_message(channel, bot))
+        await until(lambda: picker.message_id in bot.reactions.sessions)
+        msg = channel.get_message(picker.message_id)
+        captain_1 = by_id[picker.team_1[0].discord_id]
+        captain_2 = by_id[picker.team_2[0].discord_id]
+        early, first = picker.remaining_emojis[-1], picker.remaining_emojis[0]
+
+        def react(member, emoji):
+            msg.react(member, emoji)
+            bot.reactions.dispatch(make_reaction(msg.id, member, channel, emoji))
+
+        # The second captain jumps the gun, and a bystander reacts as well
+        react(captain_2, early)
+        react(by_id[picker.unplaced_players[1].discord_id], first)
+        await until(lambda: not any(r.reacted for r in msg.reactions))
+        react(captain_1, first)
+        await until(lambda: len(picker.team_1) == 2)
+        react(captain_2, early)
+        await until(lambda: len(picker.team_2) == 2)
+        assert picker.team_2[1] is picker.emoji_players[early]
+        task.cancel()
+
+    loop.run_until_complete(scenario())
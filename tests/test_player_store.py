@@ -0,0 +1,37 @@
+import json
+import sqlite3
+
+import pytest
+
+from src.queue_bot import QueueBot
+
+
+def write_players(path, records):
+    with open(path, 'w') as f:
+        json.dump({str(i): r for i, r in enumerate(records)}, f)
+
+
+def test_failed_migration_runs_again_next_start(loop, tmp_path):
+    data_path = str(tmp_path / 'players.json')
+    records = [dict(discord_name='p{i}'.format(i=i), display_name='P{i}'.format(i=i), discord_id=i, guild_id=1,
+                    game=None, total_wins=i, total_losses=0) for i in range(1, 4)]
+    # The last record can't be bound, after the first two are already written in the migration's transaction
+    write_players(data_path, records + [dict(records[0], discord_id=[4])])
+    with pytest.raises(sqlite3.Error):
+        QueueBot("!", data_path=data_path)
+
+    write_players(data_path, records)
+    bot = QueueBot("!", data_path=data_path)
+    try:
+        assert bot.store.json_migrated
+        assert sorted(r['total_wins'] for r in bot.store.load_guild(1)) == [1, 2, 3]
+    finally:
+        bot.store.close()
+
+    # Once recorded, the JSON file is left alone even if it changes
+    write_players(data_path, [dict(records[0], total_wins=99)])
+    bot = QueueBot("!", data_path=data_path)
+    try:
+        assert sorted(r['total_wins'] for r in bot.store.load_guild(1)) == [1, 2, 3]
+    finally:
+        bot.store.close()
@@ -0,0 +1,79 @@
+import asyncio
+import random
+
+import pytest
+
+from tests.helpers import context
+
+
+def assert_everyone_in_one_place(cog):
+    # Waiting in a matchmaker and sitting in a lobby are exclusive, and every index agrees with the queues themselves
+    assert not set(cog.waiting_players) & set(cog.player_queues)
+    for queue_id, matchmaker in cog.matchmakers.items():
+        assert {p.discord_id for p in matchmaker.players} == {m for m, q in cog.waiting_players.items() if q == queue_id}
+        assert len(matchmaker) < matchmaker.lobby_size
+    seated = set()
+    for queue_id, queue in cog.match_queues.items():
+        ids = {p.discord_id for p in queue.players}
+        assert len(ids) == len(queue.players) == queue.team_size * 2
+        assert not seated & ids
+        seated |= ids
+        assert all(cog.player_queues[i] == queue_id for i in ids)
+        assert cog.guild_queues[queue_id.guild_id][queue_id] is queue
+    assert set(cog.player_queues) == seated
+    assert sum(len(g) for g in cog.guild_queues.values()) == len(cog.match_queues)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_interleaved_joins_leaves_and_kicks(loop, bot, guild, cog, seed):
+    rng = random.Random(seed)
+    channels = [guild.add_text_channel('queue-{c}'.format(c=c)) for c in range(2)]
+    members = [guild.add_member('player {i}'.format(i=i)) for i in range(60)]
+    admin = guild.add_member('admin')
+
+    async def play(member):
+        # Each player hops between the two queues, and every command yields to the others on its REST calls
+        for _ in range(12):
+            await asyncio.sleep(rng.uniform(0, 0.02))
+            ctx = context(bot, member, rng.choice(channels))
+            roll = rng.random()
+            if roll < 0.55:
+                await cog.queue(ctx)
+            elif roll < 0.8:
+                await cog.leave_queue(ctx)
+            else:
+                await cog.kick_player(ctx, player_name=rng.choice(members).display_name)
+
+    async def scenario():
+        for channel in channels:
+            await cog.new_queue(context(bot, admin, channel), 2)
+        await asyncio.gather(*[play(m) for m in members])
+        assert_everyone_in_one_place(cog)
+        # Lobbies formed along the way have been running their roll calls concurrently, none of them broke
+        assert not any(q.progress.errored for q in cog.match_queues.values())
+        return sum(m.lobbies_formed for m in cog.matchmakers.values())
+
+    assert loop.run_until_complete(scenario()) > 0
+
+
+def test_kick_needs_a_second_voter_naming_the_same_player(loop, bot, guild, cog):
+    channel = guild.add_text_channel('queue')
+    a, b, c, d = [guild.add_member(n) for n in 'abcd']
+
+    async def scenario():
+        await cog.new_queue(context(bot, guild.add_member('admin'), channel), 5)
+        for m in (a, b, c, d):
+            await cog.queue(context(bot, m, channel))
+        matchmaker = cog.get_matchmaker(context(bot, a, channel))
+        await cog.kick_player(context(bot, a, channel), player_name='b')
+        # Neither a repeat from the same voter nor a vote for someone else completes the open vote
+        await cog.kick_player(context(bot, a, channel), player_name='b')
+        await cog.kick_player(context(bot, a, channel), player_name='c')
+        await cog.kick_player(context(bot, d, channel), player_name='c')
+        assert len(matchmaker) == 4
+        await cog.kick_player(context(bot, d, channel), player_name='b')
+        assert {p.discord_id for p in matchmaker.players} == {a.id, c.id, d.id}
+        assert b.id not in cog.waiting_players
+        assert matchmaker.kick_vote is None
+
+    loop.run_until_complete(scenario())
@@ -0,0 +1,30 @@
+from tests.helpers import context, until
+
+
+def test_snapshot_writes_only_what_changed(loop, bot, guild, cog):
+    channel = guild.add_text_channel('queue')
+    saved = []
+    save = bot.snapshots.save
+
+    async def record_save(changed, live):
+        saved.append(sorted(k.split()[0] for k in changed))
+        return await save(changed, live)
+    bot.snapshots.save = record_save
+
+    async def scenario():
+        await cog.new_queue(context(bot, guild.add_member('admin'), channel), 2)
+        members = [guild.add_member('player {i}'.format(i=i)) for i in range(5)]
+        for m in members:
+            await cog.queue(context(bot, m, channel))
+        queue = next(iter(cog.match_queues.values()))
+        await until(lambda: queue.rollcall is not None and queue.rollcall.message_id is not None)
+        await cog.save_snapshot()
+        await cog.save_snapshot()
+        await cog.leave_queue(context(bot, members[4], channel))
+        await cog.save_snapshot()
+        return await bot.snapshots.load()
+
+    state = loop.run_until_complete(scenario())
+    assert saved == [['lobby', 'matchmaker'], [], ['matchmaker']]
+    assert sorted(k.split()[0] for k in state) == ['lobby', 'matchmaker']
+    assert next(v for k, v in state.items() if k.startswith('matchmaker'))['waiting'] == []
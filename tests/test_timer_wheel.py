@@ -0,0 +1,85 @@
+import asyncio
+import random
+
+import pytest
+
+from src.timer_wheel import TimerWheel
+
+TICK = 0.01
+# Levels cover 4, 16 and 64 ticks, so anything past 64 ticks out starts in the overflow list
+SLOTS = 4
+LEVELS = 3
+
+
+def drive(loop, wheel:TimerWheel):
+    # Ticks are stepped by hand on a clock of the wheel's own, so every timer is checked against exactly the tick it
+    # fired on. The wheel thinks its task is still running and leaves the current tick alone
+    async def start():
+        wheel.call_later(0, lambda: None)
+        wheel._task.cancel()
+        wheel._task = loop.create_future()
+    loop.run_until_complete(start())
+    wheel._advance()
+    return lambda: wheel._start + wheel._current_tick * wheel.tick
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_timers_fire_on_the_first_tick_after_their_deadline(loop, seed):
+    rng = random.Random(seed)
+    wheel = TimerWheel(tick=TICK, slots=SLOTS, levels=LEVELS)
+    now = drive(loop, wheel)
+    deadlines = {}
+    timers = {}
+    fired = {}
+
+    def fire(i):
+        fired.setdefault(i, []).append(now())
+
+    # Timers are added in batches as the wheel turns, so they land on every level from unaligned ticks too
+    for batch in range(20):
+        for _ in range(500):
+            i = len(deadlines)
+            deadlines[i] = now() + rng.uniform(0, 300 * TICK)
+            timers[i] = wheel.call_at(deadlines[i], lambda i=i: fire(i))
+        for i in rng.sample(sorted(set(timers) - set(fired)), 100):
+            timers[i].cancel()
+        for _ in range(rng.randrange(40)):
+            wheel._advance()
+    # Every deadline is at most 300 ticks past the last batch
+    for _ in range(301):
+        wheel._advance()
+    assert wheel.active == 0
+
+    cancelled = {i for i, t in timers.items() if t.cancelled}
+    assert len(deadlines) == 10000
+    assert set(fired) == set(deadlines) - cancelled
+    for i, times in fired.items():
+        fired_at, = times
+        assert deadlines[i] <= fired_at + 1e-9
+        assert fired_at - deadlines[i] < TICK + 1e-9
+
+
+def test_wheel_runs_its_own_ticks_on_the_loop(loop):
+    rng = random.Random(0)
+    wheel = TimerWheel(tick=TICK, slots=SLOTS, levels=LEVELS)
+    late = []
+
+    async def scenario():
+        done = asyncio.Event()
+        pending = set(range(300))
+
+        def fire(i, deadline):
+            late.append(loop.time() - deadline)
+            pending.discard(i)
+            if not pending:
+                done.set()
+        for i in range(300):
+            # Some past the overflow horizon, so the running wheel has to cascade them down on its own
+            delay = rng.uniform(0, 100 * TICK)
+            wheel.call_later(delay, lambda i=i, d=loop.time() + delay: fire(i, d))
+        await asyncio.wait_for(done.wait(), timeout=10)
+
+    loop.run_until_complete(scenario())
+    assert len(late) == 300
+    assert min(late) >= 0
+    assert wheel.active == 0